@@ -0,0 +1,89 @@
+"""
+
+Cost of tracking browser responses after each callback, with a number of
+browser responses kept open in the meta of pending requests.
+
+Run as: python benchmarks/response_tracker.py
+
+"""
+
+import timeit
+
+from scrapy import Request
+from scrapy.http import HtmlResponse
+
+from scrapy_qtwebkit.middleware.http import BrowserResponse
+from scrapy_qtwebkit.middleware.spidermw import (
+    BrowserResponseTrackerMiddleware
+)
+
+
+META = {
+    'depth': 3,
+    'download_slot': 'example.com',
+    'item': {'title': 'x' * 200, 'tags': ['a', 'b', 'c'] * 10},
+}
+
+
+def make_browser_response(url):
+    response = BrowserResponse(url, request=Request(url))
+    # Not a real webpage, nothing to close.
+    response._webpage = None
+    response._page_slot = None
+    response._cookiejar = None
+    return response
+
+
+def open_pages(mw, number):
+    """Keep number browser responses in the meta of pending requests."""
+    responses = []
+    requests = []
+    for i in range(number):
+        response = make_browser_response(f'https://example.com/page/{i}')
+        request = Request(f'https://example.com/next/{i}',
+                          meta=dict(META, page=response))
+        list(mw.process_spider_output(response, [request], None))
+        responses.append(response)
+        requests.append(request)
+    return responses, requests
+
+
+def callback(mw):
+    """
+
+    Process the output of a callback not involving browser responses, without
+    the middleware if mw is None.
+
+    """
+
+    request = Request('https://example.com/item', meta=dict(META))
+    response = HtmlResponse(request.url, request=request)
+    output = [Request(f'https://example.com/item/{i}', meta=dict(META))
+              for i in range(10)]
+    if mw is None:
+        list(output)
+    else:
+        list(mw.process_spider_output(response, output, None))
+
+
+def per_callback(mw, number, repeat=5):
+    """Best time of a callback, in microseconds."""
+    times = timeit.repeat(lambda: callback(mw), number=number, repeat=repeat)
+    return min(times) / number * 1e6
+
+
+def main(number=1000):
+    # Making the requests of the callback is not part of the tracking cost.
+    base = per_callback(None, number)
+    print(f"{'open pages':>10} {'per callback (us)':>18} "
+          f"{'tracking (us)':>14}")
+    for pages in (0, 100, 300, 1000):
+        mw = BrowserResponseTrackerMiddleware()
+        kept = open_pages(mw, pages)
+        time = per_callback(mw, number)
+        print(f"{pages:>10} {time:>18.1f} {time - base:>14.1f}")
+        del kept
+
+
+if __name__ == '__main__':
+    main()
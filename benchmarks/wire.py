@@ -0,0 +1,74 @@
+"""
+
+Cost of serialising the messages exchanged for each request, with jelly and
+with the compact binary encoding.
+
+Run as: python benchmarks/wire.py
+
+"""
+
+import timeit
+
+from twisted.spread import banana, jelly
+
+from scrapy_qtwebkit._intermediaries import (RequestFromBrowser,
+                                             RequestFromScrapy,
+                                             ResponseFromScrapy)
+from scrapy_qtwebkit._wire import decode_message, encode_message
+
+
+HEADERS = {
+    b'Accept': [b'text/html,application/xhtml+xml,application/xml;q=0.9'],
+    b'Accept-Language': [b'en'],
+    b'User-Agent': [b'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/538.1'],
+    b'Referer': [b'https://example.com/some/page.html'],
+    b'Cookie': [b'session=0123456789abcdef; tracking=fedcba9876543210'],
+}
+
+MESSAGES = {
+    'RequestFromScrapy': RequestFromScrapy(
+        'https://example.com/some/page.html', 'GET', HEADERS, b''
+    ),
+    'RequestFromBrowser': RequestFromBrowser(
+        'https://example.com/static/app.js', 'GET', HEADERS, None,
+        is_first_request=False, cookiejarkey=None
+    ),
+    'ResponseFromScrapy (1 KiB)': ResponseFromScrapy(
+        'https://example.com/static/app.js', 200, HEADERS, b'x' * 1024
+    ),
+    'ResponseFromScrapy (200 KiB)': ResponseFromScrapy(
+        'https://example.com/static/image.png', 200, HEADERS,
+        b'x' * 200 * 1024
+    ),
+}
+
+_security = jelly.DummySecurityOptions()
+
+
+def jelly_round_trip(message):
+    data = banana.encode(jelly.jelly(message))
+    return jelly.unjelly(banana.decode(data), taster=_security)
+
+
+def wire_round_trip(message):
+    data = banana.encode(encode_message(message, 1))
+    return decode_message(banana.decode(data))
+
+
+def main(number=5000):
+    print(f"{'message':<30} {'jelly (us)':>12} {'binary (us)':>12} "
+          f"{'jelly (B)':>10} {'binary (B)':>10}")
+    for name, message in MESSAGES.items():
+        jelly_time = timeit.timeit(lambda: jelly_round_trip(message),
+                                   number=number)
+        wire_time = timeit.timeit(lambda: wire_round_trip(message),
+                                  number=number)
+        jelly_size = len(banana.encode(jelly.jelly(message)))
+        wire_size = len(banana.encode(encode_message(message, 1)))
+        print(f"{name:<30} {jelly_time / number * 1e6:>12.1f} "
+              f"{wire_time / number * 1e6:>12.1f} "
+              f"{jelly_size:>10} {wire_size:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,401 @@
+"""Transfer of bodies between Scrapy and the browser engine."""
+
+import mmap
+import os
+import tempfile
+import zlib
+
+from twisted.internet.defer import fail, inlineCallbacks, succeed
+from twisted.spread.pb import Copyable, Referenceable
+
+
+# Twisted's banana protocol does not accept strings larger than 640 KiB, so
+# larger bodies are sent in chunks.
+CHUNK_SIZE = 256 * 1024
+
+# Between processes on the same host, bodies larger than this are written to
+# shared memory, and only their location is sent.
+SHARED_MEMORY_MIN_SIZE = 64 * 1024
+
+if os.path.isdir('/dev/shm'):
+    SHARED_MEMORY_DIR = '/dev/shm'
+else:
+    SHARED_MEMORY_DIR = tempfile.gettempdir()
+
+_SHARED_MEMORY_PREFIX = 'scrapy-qtwebkit-body-'
+
+# Seconds after which shared memory files not removed by the receiver are
+# removed by the sender. Receivers map bodies as soon as they get them.
+SHARED_MEMORY_LEASE = 60
+
+# Bodies that do not compress below this ratio of their size (e.g. images) are
+# sent uncompressed.
+MAX_COMPRESSION_RATIO = 0.9
+
+
+class _BodyChunks(Referenceable, object):
+    def __init__(self, body, chunk_size):
+        super().__init__()
+        self._body = memoryview(body)
+        self._chunk_size = chunk_size
+        self._offset = 0
+
+    def remote_read(self):
+        """Read the next chunk of the body, or b'' at its end."""
+        end = self._offset + self._chunk_size
+        chunk = bytes(self._body[self._offset:end])
+        self._offset += len(chunk)
+        if not chunk:
+            self._body.release()
+        return chunk
+
+
+class StreamedBody(Copyable, object):
+    """A body that the receiver reads in chunks from the sender."""
+
+    def __init__(self, body, chunk_size=CHUNK_SIZE):
+        super().__init__()
+        self.size = len(body)
+        self.chunks = _BodyChunks(body, chunk_size)
+
+
+class SharedMemoryFiles(object):
+    """
+
+    The shared memory files created by this side for bodies sent to the other
+    side, which owns them. The receiver removes a file once it has mapped it,
+    but may never do so (e.g. when it drops a reply arriving after a timeout,
+    or when it dies), so files are also removed here: when the call sending
+    them ends (see release_after()), lease seconds after their creation, and
+    when release_all() is called (e.g. on shutdown).
+
+    """
+
+    def __init__(self, lease=SHARED_MEMORY_LEASE, clock=None):
+        super().__init__()
+        self.lease = lease
+        self._clock = clock
+        # Delayed calls removing the files, by path.
+        self._expiries = {}
+
+    def create(self, body):
+        """Write a body to a new file, returning its path."""
+        fd, path = tempfile.mkstemp(prefix=_SHARED_MEMORY_PREFIX,
+                                    dir=SHARED_MEMORY_DIR)
+        with open(fd, 'wb') as f:
+            f.write(body)
+        if self._clock is None:
+            from twisted.internet import reactor
+            self._clock = reactor
+        self._expiries[path] = self._clock.callLater(self.lease,
+                                                     self._remove, path)
+        return path
+
+    def __contains__(self, path):
+        return path in self._expiries
+
+    def _remove(self, path):
+        del self._expiries[path]
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def release(self, body):
+        """Remove the file of an encoded body, if this side created it."""
+        if isinstance(body, CompressedBody):
+            body = body.data
+        if isinstance(body, SharedMemoryBody) and body.path in self:
+            self._expiries[body.path].cancel()
+            self._remove(body.path)
+
+    def release_after(self, dfd, body):
+        """
+
+        Remove the file of an encoded body once a call sending it, whose
+        result is dfd, has ended in any way. The receiver having replied (or
+        the call having failed or timed out), it does not need the file.
+
+        """
+
+        def release(result):
+            self.release(body)
+            return result
+        return dfd.addBoth(release)
+
+    def release_all(self):
+        """Remove all the files created by this side."""
+        for path, expiry in list(self._expiries.items()):
+            expiry.cancel()
+            self._remove(path)
+
+
+shared_memory_files = SharedMemoryFiles()
+
+
+class SharedMemoryBody(Copyable, object):
+    """
+
+    A body in a shared memory file, which the receiver maps and then removes
+    (see SharedMemoryFiles for its removal by the sender).
+
+    """
+
+    def __init__(self, path, size):
+        super().__init__()
+        self.path = path
+        self.size = size
+
+    @classmethod
+    def from_bytes(cls, body, files=None):
+        if files is None:
+            files = shared_memory_files
+        return cls(files.create(body), len(body))
+
+    def _check_path(self):
+        # The path comes from the other side, which must not be able to make
+        # this side read or remove any other file.
+        path = os.path.abspath(self.path)
+        if not (os.path.dirname(path) == os.path.abspath(SHARED_MEMORY_DIR)
+                and os.path.basename(path).startswith(_SHARED_MEMORY_PREFIX)):
+            raise ValueError(f"Invalid shared memory body path {self.path!r}")
+        return path
+
+    def map(self):
+        """Map the body into memory, removing its file."""
+        path = self._check_path()
+        try:
+            with open(path, 'rb') as f:
+                return mmap.mmap(f.fileno(), self.size,
+                                 access=mmap.ACCESS_READ)
+        finally:
+            os.unlink(path)
+
+    def discard(self):
+        """Remove the body without reading it."""
+        try:
+            os.unlink(self._check_path())
+        except FileNotFoundError:
+            pass
+
+
+class CompressedBody(Copyable, object):
+    """A zlib compressed body, itself encoded as an uncompressed one."""
+
+    def __init__(self, data, size):
+        super().__init__()
+        self.data = data
+        self.size = size
+
+
+class BodyCompression(object):
+    """
+
+    Compression of bodies of at least min_size bytes with the given zlib
+    level. The sizes of bodies, before and after compression, are kept in
+    stats, both for bodies compressed here and for those received compressed
+    (see record_received).
+
+    """
+
+    def __init__(self, level=6, min_size=1024, stats=None):
+        super().__init__()
+        self.level = level
+        self.min_size = min_size
+        self._stats = stats
+
+    def compress(self, body):
+        """Compress a body, returning None if it is not worth compressing."""
+        if len(body) < self.min_size:
+            return None
+        data = zlib.compress(body, self.level)
+        compressed = len(data) < len(body) * MAX_COMPRESSION_RATIO
+        if self._stats is not None:
+            self._record(len(body), len(data) if compressed else len(body))
+            if not compressed:
+                self._stats.inc_value('browser_engine/compression/'
+                                      'incompressible')
+        if compressed:
+            return data
+
+    def record_received(self, body):
+        """Keep the sizes of a body received compressed in stats."""
+        if self._stats is not None and isinstance(body, CompressedBody):
+            self._record(body.size, body_size(body.data))
+
+    def _record(self, size, sent_size):
+        self._stats.inc_value('browser_engine/compression/original_bytes',
+                              size)
+        self._stats.inc_value('browser_engine/compression/compressed_bytes',
+                              sent_size)
+        original = self._stats.get_value(
+            'browser_engine/compression/original_bytes'
+        )
+        compressed = self._stats.get_value(
+            'browser_engine/compression/compressed_bytes'
+        )
+        self._stats.set_value('browser_engine/compression/ratio',
+                              round(compressed / original, 3))
+
+
+def encode_body(body, chunk_size=CHUNK_SIZE, shared_memory=False,
+                compression=None):
+    """
+
+    Prepare a body for sending to the other side. If shared_memory is true,
+    the other side must be on the same host. If compression is given (a
+    BodyCompression), the other side must support compressed bodies.
+
+    """
+
+    if body is None:
+        return body
+    if shared_memory and len(body) > SHARED_MEMORY_MIN_SIZE:
+        return SharedMemoryBody.from_bytes(body)
+    if compression is not None:
+        data = compression.compress(body)
+        if data is not None:
+            return CompressedBody(encode_body(data, chunk_size), len(body))
+    if len(body) > chunk_size:
+        return StreamedBody(body, chunk_size)
+    return body
+
+
+def body_size(body):
+    """Size of an encoded body."""
+    if isinstance(body, (StreamedBody, SharedMemoryBody, CompressedBody)):
+        return body.size
+    return len(body or b'')
+
+
+def discard_body(body):
+    """Release the resources of an encoded body that will not be read."""
+    if isinstance(body, SharedMemoryBody):
+        body.discard()
+    elif isinstance(body, CompressedBody):
+        discard_body(body.data)
+
+
+@inlineCallbacks
+def receive_body(body, write):
+    """Receive an encoded body, calling write() with each chunk of it."""
+    if isinstance(body, CompressedBody):
+        decompressor = zlib.decompressobj()
+
+        def write_decompressed(data):
+            data = decompressor.decompress(data)
+            if data:
+                write(data)
+
+        yield receive_body(body.data, write_decompressed)
+        data = decompressor.flush()
+        if data:
+            write(data)
+    elif isinstance(body, SharedMemoryBody):
+        with body.map() as buf:
+            write(buf[:])
+    elif isinstance(body, StreamedBody):
+        while True:
+            chunk = yield body.chunks.callRemote('read')
+            if not chunk:
+                break
+            write(chunk)
+    elif body:
+        write(body)
+
+
+def read_body(body, compression=None):
+    """
+
+    Receive a complete encoded body. If compression (a BodyCompression) is
+    given, the sizes of compressed bodies are kept in its stats.
+
+    """
+
+    if compression is not None:
+        compression.record_received(body)
+    if isinstance(body, CompressedBody):
+        return read_body(body.data).addCallback(zlib.decompress)
+    if isinstance(body, SharedMemoryBody):
+        try:
+            with body.map() as buf:
+                return succeed(buf[:])
+        except Exception:
+            return fail()
+    if not isinstance(body, StreamedBody):
+        return succeed(body)
+
+    chunks = []
+    return receive_body(body, chunks.append).addCallback(
+        lambda result: b''.join(chunks)
+    )
+
+
+# Bodies are compared in blocks of this size when making deltas.
+_DELTA_BLOCK_SIZE = 4096
+
+
+def _common_prefix_length(a, b, limit):
+    length = 0
+    while length < limit:
+        end = min(length + _DELTA_BLOCK_SIZE, limit)
+        if a[length:end] != b[length:end]:
+            while a[length] == b[length]:
+                length += 1
+            return length
+        length = end
+    return limit
+
+
+def body_delta(old, new):
+    """
+
+    Make a delta from one version of a body to another, as the lengths of the
+    prefix and suffix of the old version kept in the new one, and the new bytes
+    between them.
+
+    """
+
+    limit = min(len(old), len(new))
+    prefix = _common_prefix_length(old, new, limit)
+    suffix = _common_prefix_length(old[::-1], new[::-1], limit - prefix)
+    return (prefix, suffix, new[prefix:len(new) - suffix])
+
+
+def apply_body_delta(old, delta):
+    prefix, suffix, middle = delta
+    return old[:prefix] + middle + old[len(old) - suffix:]
+
+
+class BodySnapshot(object):
+    """
+
+    The last version of a body sent to the other side, so that later versions
+    can be sent as deltas from it.
+
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.version = 0
+        self._body = None
+
+    def update(self, body, base_version=None):
+        """
+
+        Make body the last version sent, returning its version number and a
+        delta to it (applied with apply_body_delta) from base_version, or None
+        if it did not change. If base_version is not the last version sent,
+        the delta contains the whole body.
+
+        """
+
+        if base_version is None or base_version != self.version:
+            delta = (0, 0, body)
+        elif body == self._body:
+            return self.version, None
+        else:
+            delta = body_delta(self._body, body)
+        self._body = body
+        self.version += 1
+        return self.version, delta
@@ -0,0 +1,237 @@
+"""
+
+Extraction of data from pages with named CSS or XPath selectors, done by the
+browser engine in the page so that only the extracted data is sent to Scrapy.
+
+Selectors are given as a dict of names to selectors, each either a CSS
+selector string, or a dict with a 'css' or 'xpath' key. As in Scrapy, CSS
+selectors may end with ::text (to select the text nodes of the matched
+elements) or ::attr(name) (to select an attribute), after a space to select
+those of their descendants too ('h1 ::text'). Each name is extracted as a list
+of strings, formatted as by parsel: the HTML of matched elements, or the text
+of matched text nodes, attributes or values.
+
+"""
+
+import json
+import re
+
+
+# Scrapy's pseudo-elements, which the browser engine does not support.
+_CSS_PSEUDO_ELEMENT_RE = re.compile(
+    r'::(?:(text)|attr\(\s*([^)\s]+)\s*\))\s*$'
+)
+
+_SCRIPT = """
+(function (selectors) {
+    function nodeValue(node) {
+        switch (node.nodeType) {
+        case Node.ELEMENT_NODE:
+            return node.outerHTML;
+        case Node.COMMENT_NODE:
+            return '<!--' + node.nodeValue + '-->';
+        case Node.DOCUMENT_NODE:
+            return node.documentElement.outerHTML;
+        default:
+            return node.nodeValue === null ? node.textContent : node.nodeValue;
+        }
+    }
+
+    function addDescendantTexts(node, values) {
+        var children = node.childNodes;
+        for (var i = 0; i < children.length; i++) {
+            if (children[i].nodeType === Node.TEXT_NODE) {
+                values.push(children[i].nodeValue);
+            } else {
+                addDescendantTexts(children[i], values);
+            }
+        }
+    }
+
+    function compareNodes(a, b) {
+        return a.compareDocumentPosition(b) &
+            Node.DOCUMENT_POSITION_FOLLOWING ? -1 : 1;
+    }
+
+    function css(selector) {
+        var values = [];
+        var elements = document.querySelectorAll(selector.query);
+        var outer = null;
+        var texts = [];
+        for (var i = 0; i < elements.length; i++) {
+            var element = elements[i];
+            if (selector.descendants) {
+                // The text or attributes of elements nested in a previous
+                // match were already selected with it.
+                if (outer !== null && outer.contains(element)) {
+                    continue;
+                }
+                outer = element;
+            }
+            if (selector.text && selector.descendants) {
+                addDescendantTexts(element, values);
+            } else if (selector.text) {
+                var children = element.childNodes;
+                for (var j = 0; j < children.length; j++) {
+                    if (children[j].nodeType === Node.TEXT_NODE) {
+                        texts.push(children[j]);
+                    }
+                }
+            } else if (selector.attr !== null) {
+                var owners = [element];
+                if (selector.descendants) {
+                    var nested = element.querySelectorAll('*');
+                    for (var k = 0; k < nested.length; k++) {
+                        owners.push(nested[k]);
+                    }
+                }
+                for (var l = 0; l < owners.length; l++) {
+                    if (owners[l].hasAttribute(selector.attr)) {
+                        values.push(owners[l].getAttribute(selector.attr));
+                    }
+                }
+            } else {
+                values.push(element.outerHTML);
+            }
+        }
+        // Text nodes of nested matches are interleaved in document order.
+        texts.sort(compareNodes);
+        for (var m = 0; m < texts.length; m++) {
+            values.push(texts[m].nodeValue);
+        }
+        return values;
+    }
+
+    function formatNumber(number) {
+        // As Python formats floats, as in parsel.
+        if (isNaN(number)) {
+            return 'nan';
+        }
+        if (!isFinite(number)) {
+            return number > 0 ? 'inf' : '-inf';
+        }
+        var sign = number < 0 || 1 / number < 0 ? '-' : '';
+        var parts = Math.abs(number).toExponential().split('e');
+        var digits = parts[0].replace('.', '');
+        var exponent = parseInt(parts[1], 10);
+        if (exponent < -4 || exponent >= 16) {
+            var mantissa = digits.charAt(0);
+            if (digits.length > 1) {
+                mantissa += '.' + digits.slice(1);
+            }
+            var power = String(Math.abs(exponent));
+            return sign + mantissa + 'e' + (exponent < 0 ? '-' : '+') +
+                (power.length < 2 ? '0' : '') + power;
+        }
+        if (exponent < 0) {
+            return sign + '0.' + new Array(-exponent).join('0') + digits;
+        }
+        while (digits.length <= exponent) {
+            digits += '0';
+        }
+        return sign + digits.slice(0, exponent + 1) + '.' +
+            (digits.slice(exponent + 1) || '0');
+    }
+
+    function xpath(selector) {
+        var result = document.evaluate(selector.query, document, null,
+                                       XPathResult.ANY_TYPE, null);
+        switch (result.resultType) {
+        case XPathResult.NUMBER_TYPE:
+            return [formatNumber(result.numberValue)];
+        case XPathResult.STRING_TYPE:
+            return [result.stringValue];
+        case XPathResult.BOOLEAN_TYPE:
+            return [result.booleanValue ? '1' : '0'];
+        }
+        var values = [];
+        for (var node = result.iterateNext(); node;
+             node = result.iterateNext()) {
+            values.push(nodeValue(node));
+        }
+        return values;
+    }
+
+    var results = {};
+    for (var name in selectors) {
+        var selector = selectors[name];
+        results[name] = (selector.type === 'css' ? css : xpath)(selector);
+    }
+    return JSON.stringify(results);
+})(%s)
+"""
+
+
+def parse_selector(selector):
+    """
+
+    Parse a selector into a dict with its type ('css' or 'xpath'), query and,
+    for CSS selectors, whether to select text nodes, which attribute to select
+    and whether to select them from descendants of the matched elements too.
+
+    """
+
+    if isinstance(selector, str):
+        selector = {'css': selector}
+    if set(selector) == {'xpath'}:
+        return {'type': 'xpath', 'query': selector['xpath']}
+    if set(selector) != {'css'}:
+        raise ValueError(f"invalid selector {selector!r}: expected a CSS "
+                         f"selector string, or a dict with a 'css' or "
+                         f"'xpath' key")
+    query = selector['css']
+    match = _CSS_PSEUDO_ELEMENT_RE.search(query)
+    if not match:
+        return {'type': 'css', 'query': query, 'text': False, 'attr': None,
+                'descendants': False}
+    text, attr = match.groups()
+    query = query[:match.start()]
+    # As in parsel, a pseudo-element of any descendant ('h1 ::text' or
+    # 'h1 *::text') selects the text or attributes of the matched elements
+    # and all their descendants.
+    ancestors = query[:-1] if query.endswith('*') else query
+    descendants = (not ancestors.strip() or (
+        ancestors[-1].isspace() and ancestors.rstrip()[-1] not in '>+~'
+    ))
+    if descendants:
+        query = ancestors.strip() or '*'
+    else:
+        query = query.rstrip()
+        if query[-1] in '>+~':
+            query += ' *'
+    return {'type': 'css', 'query': query, 'text': bool(text), 'attr': attr,
+            'descendants': descendants}
+
+
+def extraction_script(selectors):
+    """JavaScript code evaluating to the extracted data as a JSON string."""
+    parsed = {name: parse_selector(selector)
+              for name, selector in selectors.items()}
+    return _SCRIPT % json.dumps(parsed)
+
+
+def load_extracted(result):
+    """Load the result of the extraction script."""
+    return json.loads(result)
+
+
+def extract_from_response(response, selectors):
+    """
+
+    Extract data from a response body as the browser engine would, for engines
+    not supporting extraction.
+
+    """
+
+    results = {}
+    for name, selector in selectors.items():
+        if isinstance(selector, str):
+            selector = {'css': selector}
+        # Raise on invalid selectors as the browser engine would.
+        parse_selector(selector)
+        if 'xpath' in selector:
+            selected = response.xpath(selector['xpath'])
+        else:
+            selected = response.css(selector['css'])
+        results[name] = selected.getall()
+    return results
@@ -12,7 +12,7 @@ class RequestFromScrapy(Copyable, object):
 
 class RequestFromBrowser(Copyable, object):
     def __init__(self, url, method, headers, body, is_first_request,
-                 cookiejarkey):
+                 cookiejarkey, follow_redirects=False):
         super().__init__()
         self.url = url
         self.method = method
@@ -20,6 +20,7 @@ class RequestFromBrowser(Copyable, object):
         self.body = body
         self.is_first_request = is_first_request
         self.cookiejarkey = cookiejarkey
+        self.follow_redirects = follow_redirects
 
 
 class ResponseFromScrapy(Copyable, object):
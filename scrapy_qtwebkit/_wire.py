@@ -0,0 +1,245 @@
+"""
+
+Compact binary encoding of the messages exchanged between Scrapy and the
+browser engine for each request, used instead of jelly when both sides support
+it.
+
+A message is encoded as a bytes string, starting with the encoding version and
+the message type, followed by the message's attributes. Messages that cannot
+be encoded (e.g. with a streamed body) are sent with jelly, so the receiver
+must accept both.
+
+"""
+
+from struct import Struct
+from weakref import WeakKeyDictionary
+
+from ._bodies import CompressedBody, SharedMemoryBody
+from ._intermediaries import (RequestFromBrowser, RequestFromScrapy,
+                              ResponseFromScrapy)
+
+
+# Encoding versions supported by this side. The highest version supported by
+# both sides is used, version 0 meaning jelly. Later versions add features,
+# supported by both sides from the versions below on.
+WIRE_VERSIONS = (0, 1, 2, 3, 4, 5, 6)
+
+# Compressed bodies, which a side supporting them also accepts with jelly.
+COMPRESSION_VERSION = 2
+# The follow_redirects attribute of requests from the browser.
+FOLLOW_REDIRECTS_VERSION = 3
+# Extraction of data from pages by browser engines (see _extract).
+EXTRACT_VERSION = 4
+# Page bodies sent by browser engines as deltas (see _bodies.BodySnapshot).
+BODY_DELTAS_VERSION = 5
+# Cookie jars replicated lazily, with changes sent in batches (see
+# cookies.RemotelyAccessibleCookieJar).
+BATCHED_COOKIES_VERSION = 6
+
+# Last version changing the encoding of messages, with which messages for
+# receivers supporting later versions are encoded.
+_ENCODING_VERSION = FOLLOW_REDIRECTS_VERSION
+
+# Twisted's banana protocol does not accept strings larger than 640 KiB.
+MAX_MESSAGE_SIZE = 512 * 1024
+
+_MESSAGE_TYPES = {
+    RequestFromScrapy: (1, ('url', 'method', 'headers', 'body')),
+    RequestFromBrowser: (2, ('url', 'method', 'headers', 'body',
+                             'is_first_request', 'cookiejarkey',
+                             'follow_redirects')),
+    ResponseFromScrapy: (3, ('url', 'status', 'headers', 'body')),
+}
+_MESSAGE_CLASSES = {type_id: (cls, attrs)
+                    for cls, (type_id, attrs) in _MESSAGE_TYPES.items()}
+# Encoding versions in which attributes were added, which are only encoded for
+# receivers supporting them. Omitted attributes get their default values.
+_ATTR_VERSIONS = {'follow_redirects': FOLLOW_REDIRECTS_VERSION}
+
+_header = Struct('!BB')
+_uint32 = Struct('!I')
+_int64 = Struct('!q')
+
+_NONE = b'N'
+_FALSE = b'F'
+_TRUE = b'T'
+_INT = b'I'
+_STR = b'S'
+_BYTES = b'B'
+_HEADERS = b'H'
+_SHARED_MEMORY_BODY = b'M'
+_COMPRESSED_BODY = b'Z'
+
+
+# Negotiated encoding versions of the connections to browser engines.
+_broker_versions = WeakKeyDictionary()
+
+
+class _Unencodable(Exception):
+    pass
+
+
+def _encode_bytes(out, value):
+    out += _uint32.pack(len(value))
+    out += value
+
+
+def _encode_value(out, value):
+    if value is None:
+        out += _NONE
+    elif value is False:
+        out += _FALSE
+    elif value is True:
+        out += _TRUE
+    elif isinstance(value, int):
+        if not -2**63 <= value < 2**63:
+            raise _Unencodable(value)
+        out += _INT
+        out += _int64.pack(value)
+    elif isinstance(value, str):
+        out += _STR
+        _encode_bytes(out, value.encode('utf-8'))
+    elif isinstance(value, bytes):
+        out += _BYTES
+        _encode_bytes(out, value)
+    elif isinstance(value, dict):
+        # Headers, with either one or a list of values for each name.
+        out += _HEADERS
+        out += _uint32.pack(len(value))
+        for name, values in value.items():
+            if isinstance(values, bytes):
+                values = (values,)
+            if not isinstance(name, bytes):
+                raise _Unencodable(name)
+            _encode_bytes(out, name)
+            out += _uint32.pack(len(values))
+            for v in values:
+                if not isinstance(v, bytes):
+                    raise _Unencodable(v)
+                _encode_bytes(out, v)
+    elif isinstance(value, SharedMemoryBody):
+        out += _SHARED_MEMORY_BODY
+        _encode_bytes(out, value.path.encode('utf-8'))
+        out += _int64.pack(value.size)
+    elif isinstance(value, CompressedBody):
+        out += _COMPRESSED_BODY
+        out += _int64.pack(value.size)
+        _encode_value(out, value.data)
+    else:
+        raise _Unencodable(value)
+
+
+class _Decoder(object):
+    def __init__(self, data, offset=0):
+        self._data = memoryview(data)
+        self._offset = offset
+
+    def _unpack(self, struct):
+        value, = struct.unpack_from(self._data, self._offset)
+        self._offset += struct.size
+        return value
+
+    def _bytes(self):
+        size = self._unpack(_uint32)
+        end = self._offset + size
+        if end > len(self._data):
+            raise ValueError("Truncated message")
+        value = bytes(self._data[self._offset:end])
+        self._offset = end
+        return value
+
+    def value(self):
+        tag = bytes(self._data[self._offset:self._offset + 1])
+        self._offset += 1
+        if tag == _NONE:
+            return None
+        elif tag == _FALSE:
+            return False
+        elif tag == _TRUE:
+            return True
+        elif tag == _INT:
+            return self._unpack(_int64)
+        elif tag == _STR:
+            return self._bytes().decode('utf-8')
+        elif tag == _BYTES:
+            return self._bytes()
+        elif tag == _HEADERS:
+            headers = {}
+            for _ in range(self._unpack(_uint32)):
+                name = self._bytes()
+                headers[name] = [self._bytes()
+                                 for _ in range(self._unpack(_uint32))]
+            return headers
+        elif tag == _SHARED_MEMORY_BODY:
+            path = self._bytes().decode('utf-8')
+            return SharedMemoryBody(path, self._unpack(_int64))
+        elif tag == _COMPRESSED_BODY:
+            size = self._unpack(_int64)
+            return CompressedBody(self.value(), size)
+        raise ValueError(f"Unknown value tag {tag!r}")
+
+
+def negotiate_version(other_versions):
+    """Highest encoding version supported by both sides."""
+    return max(set(WIRE_VERSIONS) & set(other_versions), default=0)
+
+
+def set_broker_version(broker, version):
+    """Record the encoding version negotiated for a connection."""
+    _broker_versions[broker] = version
+
+
+def broker_version(broker):
+    """
+
+    Encoding version negotiated for a connection, 0 if none was (e.g. with
+    older browser engines).
+
+    """
+
+    return _broker_versions.get(broker, 0)
+
+
+def encode_message(message, version):
+    """
+
+    Encode a message for a receiver supporting the given encoding version,
+    returning the message itself if it is to be sent with jelly.
+
+    """
+
+    if version < 1:
+        return message
+    version = min(version, _ENCODING_VERSION)
+    type_id, attrs = _MESSAGE_TYPES[type(message)]
+    out = bytearray(_header.pack(version, type_id))
+    try:
+        for attr in attrs:
+            if _ATTR_VERSIONS.get(attr, 1) <= version:
+                _encode_value(out, getattr(message, attr))
+    except _Unencodable:
+        return message
+    if len(out) > MAX_MESSAGE_SIZE:
+        return message
+    return bytes(out)
+
+
+def decode_message(data):
+    """Decode a message, which may have been sent with jelly."""
+    if not isinstance(data, bytes):
+        return data
+    version, type_id = _header.unpack_from(data)
+    if version not in WIRE_VERSIONS or version < 1:
+        raise ValueError(f"Unsupported message encoding version {version}")
+    cls, attrs = _MESSAGE_CLASSES[type_id]
+    decoder = _Decoder(data, _header.size)
+    return cls(*(decoder.value() for attr in attrs
+                 if _ATTR_VERSIONS.get(attr, 1) <= version))
+
+
+def message_version(data):
+    """Encoding version of a received message, 0 if sent with jelly."""
+    if not isinstance(data, bytes):
+        return 0
+    version, type_id = _header.unpack_from(data)
+    return version
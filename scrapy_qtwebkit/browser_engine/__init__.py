@@ -1,11 +1,59 @@
 from twisted.spread import pb
 
+from .._bodies import shared_memory_files
+from .._wire import WIRE_VERSIONS
+from .utils.loop_lag import LoopLagMonitor
+from .utils.memory import get_rss
+
 
 class BrowserManager(pb.Root):
     def __init__(self, reactor, browser_cls):
         super().__init__()
         self._reactor = reactor
         self.browser_cls = browser_cls
+        self._loop_lag_monitor = LoopLagMonitor(reactor)
+        # Connections to Scrapy, the lag being measured while there are any.
+        self._brokers = set()
+        reactor.addSystemEventTrigger('before', 'shutdown',
+                                      self._loop_lag_monitor.stop)
+        reactor.addSystemEventTrigger('before', 'shutdown',
+                                      shared_memory_files.release_all)
+
+    def rootObject(self, broker):
+        self._brokers.add(broker)
+        broker.notifyOnDisconnect(lambda: self._disconnected(broker))
+        return self
+
+    def _disconnected(self, broker):
+        self._brokers.discard(broker)
+        if not self._brokers:
+            self._loop_lag_monitor.stop()
+            # Nobody is left to read the bodies sent.
+            shared_memory_files.release_all()
 
     def remote_open_browser(self, downloader, options):
         return self.browser_cls(self._reactor, downloader, options)
+
+    def remote_get_wire_versions(self):
+        """Message encoding versions supported by the browser engine."""
+        return WIRE_VERSIONS
+
+    def remote_get_memory_usage(self):
+        """Resident set size of the browser engine process, in bytes."""
+        return get_rss()
+
+    def remote_get_status(self):
+        """
+
+        Load of the browser engine process: memory usage (in bytes) and maximum
+        event loop lag (in seconds) since the last call.
+
+        """
+
+        # Only measure the lag if someone is interested in it.
+        if not self._loop_lag_monitor.running:
+            self._loop_lag_monitor.start()
+        return {
+            'memory_usage': get_rss(),
+            'loop_lag': self._loop_lag_monitor.pop_max_lag()
+        }
@@ -57,6 +57,18 @@ def _potential_domain_matches(domain):
     return matches + ['.' + d for d in matches]
 
 
+def potential_cookie_domains(url):
+    """Domains of the cookies that may match an URL."""
+    host = urlparse(url).hostname
+    if not IPV4_RE.search(host):
+        hosts = _potential_domain_matches(host)
+        if host.find(".") == -1:
+            hosts.append(host + ".local")
+    else:
+        hosts = [host]
+    return hosts
+
+
 def cookies_for_url(jar, url):
     """
 
@@ -66,13 +78,7 @@ def cookies_for_url(jar, url):
 
     """
 
-    host = urlparse(url).hostname
-    if not IPV4_RE.search(host):
-        hosts = _potential_domain_matches(host)
-        if host.find(".") == -1:
-            hosts += host + ".local"
-    else:
-        hosts = [host]
+    hosts = potential_cookie_domains(url)
 
     jar._policy._now = jar._now = int(time.time())
 
@@ -82,3 +88,44 @@ def cookies_for_url(jar, url):
             req = Request(url)
             for cookie in jar._cookies_for_domain(host, req):
                 yield cookie
+
+
+def cookies_for_origin(jar, url):
+    """
+
+    Get cookies for the origin (scheme, host and port) of an URL from a
+    cookielib CookieJar, regardless of their paths, which can be matched with
+    path_matches().
+
+    """
+
+    hosts = potential_cookie_domains(url)
+
+    jar._policy._now = jar._now = int(time.time())
+
+    req = Request(url)
+    for host in hosts:
+        if (host not in jar._cookies or
+                not jar._policy.domain_return_ok(host, req)):
+            continue
+        for cookies_by_name in jar._cookies[host].values():
+            for cookie in cookies_by_name.values():
+                if jar._policy.return_ok(cookie, req):
+                    yield cookie
+
+
+def path_matches(cookie_path, request_path):
+    """
+
+    Whether a cookie path matches the (escaped) path of a request.
+
+    From http.cookiejar.DefaultCookiePolicy.path_return_ok().
+
+    """
+
+    if request_path == cookie_path:
+        return True
+    pathlen = len(cookie_path)
+    return (request_path.startswith(cookie_path) and
+            (cookie_path.endswith("/") or
+             request_path[pathlen:pathlen + 1] == "/"))
@@ -8,9 +8,14 @@ gi.require_version('WebKit2', '4.0')
 from gi.repository import GLib, Gtk, WebKit2
 
 from twisted.internet.defer import Deferred, inlineCallbacks
+from twisted.internet.error import TimeoutError
 from twisted.spread import pb
 
+from ..._bodies import (BodyCompression, BodySnapshot, encode_body,
+                        read_body, shared_memory_files)
+from ..._extract import extraction_script, load_extracted
 from ..._intermediaries import RequestFromScrapy, RequestFromBrowser
+from ..._wire import decode_message, encode_message
 
 from ..utils.proxy import RemoteScrapyProxyFactory
 
@@ -39,12 +44,24 @@ class Browser(pb.Referenceable):
         self._reactor = reactor
         self.downloader = downloader
         self.options = global_options
+        # Set by the Scrapy side when it runs on the same host.
+        self.shared_memory = self.options.get('shared_memory', False)
+        # Negotiated by the Scrapy side for messages sent to it.
+        self.wire_version = self.options.get('wire_version', 0)
+        compression_options = self.options.get('compression')
+        if compression_options is not None:
+            self.compression = BodyCompression(**compression_options)
+        else:
+            self.compression = None
         self._windows = None
 
     def remote_create_webpage(self, options: dict):
         proxy = RemoteScrapyProxyFactory(
             remote_downloader=self.downloader,
-            cookiejarkey=options.get('cookiejarkey')
+            cookiejarkey=options.get('cookiejarkey'),
+            shared_memory=self.shared_memory,
+            wire_version=self.wire_version,
+            compression=self.compression
         )
         # TODO: add warning about an HTTP proxy opening on some port.
         listeningport = self._reactor.listenTCP(0, proxy)
@@ -69,6 +86,38 @@ class Browser(pb.Referenceable):
         return WebPageRemoteControl(self, self.downloader, options, webview,
                                     window, listeningport)
 
+    @inlineCallbacks
+    def remote_fetch(self, options: dict, request: RequestFromScrapy,
+                     timeout=None, return_partial=False, extract=None):
+        """
+
+        Load a request in a new webpage and close it, returning the load result
+        together with the webpage URL, encoding and body. If extract (a dict of
+        selectors) is given, the data extracted with it is returned instead of
+        the encoding and body, after the URL.
+
+        """
+
+        webpage = self.remote_create_webpage(options)
+        try:
+            load_result = yield webpage.remote_load_request(
+                request, timeout=timeout, return_partial=return_partial
+            )
+            if load_result[0]:
+                url = webpage.remote_get_url()
+                if extract is not None:
+                    extracted = yield webpage.remote_extract(extract)
+                else:
+                    encoding, body = yield webpage.remote_get_body()
+            else:
+                url = encoding = body = extracted = None
+        finally:
+            yield webpage.remote_close()
+
+        if extract is not None:
+            return load_result + (url, extracted)
+        return load_result + (url, encoding, body)
+
 
 class WebPageRemoteControl(pb.Referenceable):
     def __init__(self, browser: Browser, downloader, options: dict,
@@ -81,6 +130,7 @@ class WebPageRemoteControl(pb.Referenceable):
         self._webview = webview
         self._window = window
         self._listeningport = listeningport
+        self._body_snapshot = BodySnapshot()
 
     def _close(self):
         if self._webview:
@@ -114,18 +164,33 @@ class WebPageRemoteControl(pb.Referenceable):
         return d
 
     @inlineCallbacks
-    def remote_load_request(self, request: RequestFromScrapy):
+    def remote_load_request(self, request: RequestFromScrapy, timeout=None,
+                            return_partial=False):
+        reactor = self.browser._reactor
+        if timeout:
+            deadline = reactor.seconds() + timeout
+
         # WebKitGTK does not support setting headers or method when loading
         # request. Instead, make the request and set it as the content.
+        request = decode_message(request)
+        request_body = yield read_body(request.body)
+        body = encode_body(request_body,
+                           shared_memory=self.browser.shared_memory,
+                           compression=self.browser.compression)
         remote_req = RequestFromBrowser(
             url=request.url,
             method=request.method,
             headers=request.headers,
-            body=request.body,
+            body=body,
             is_first_request=True,
             cookiejarkey=self._options.get('cookiejarkey')
         )
-        response = yield self._downloader.callRemote('make_request', remote_req)
+        remote_req = encode_message(remote_req, self.browser.wire_version)
+        response = yield shared_memory_files.release_after(
+            self._downloader.callRemote('make_request', remote_req), body
+        )
+        response = decode_message(response)
+        response_body = yield read_body(response.body)
 
         # Scrapy's Headers object keeps headers in title case.
         ctype = response.headers.get(b'Content-Type')
@@ -136,15 +201,33 @@ class WebPageRemoteControl(pb.Referenceable):
             mime_type = None
             enconding = None
 
+        timeout_exc = TimeoutError(f"Page not loaded within {timeout} seconds")
+        if timeout and reactor.seconds() >= deadline:
+            return (False, None, None, timeout_exc, [])
+
         load_finished = self._load_finished(self._webview)
 
-        self._webview.load_bytes(GLib.Bytes(response.body), mime_type,
+        self._webview.load_bytes(GLib.Bytes(response_body), mime_type,
                                  enconding, request.url)
 
+        if timeout:
+            timeout_call = reactor.callLater(deadline - reactor.seconds(),
+                                             self._webview.stop_loading)
+
         yield load_finished
 
+        flags = []
+        if timeout:
+            if timeout_call.active():
+                timeout_call.cancel()
+            elif return_partial:
+                # The main document was already received.
+                flags.append('partial')
+            else:
+                return (False, None, None, timeout_exc, flags)
+
         # TODO: report load errors.
-        return (True, response.status, response.headers, None)
+        return (True, response.status, response.headers, None, flags)
 
     def remote_get_url(self):
         return self._webview.get_uri()
@@ -163,7 +246,36 @@ class WebPageRemoteControl(pb.Referenceable):
     @inlineCallbacks
     def remote_get_body(self):
         jsvalue = yield self._run_script("document.documentElement.outerHTML")
-        return ('utf-8', jsvalue.to_string_as_bytes().get_data())
+        body = encode_body(jsvalue.to_string_as_bytes().get_data(),
+                           shared_memory=self.browser.shared_memory,
+                           compression=self.browser.compression)
+        return ('utf-8', body)
+
+    @inlineCallbacks
+    def remote_get_body_delta(self, version=None):
+        """
+
+        Get the page body as a delta from the version of it given (as returned
+        by a previous call), returning the new version, the encoding and the
+        delta, which is None if the body did not change.
+
+        """
+
+        jsvalue = yield self._run_script("document.documentElement.outerHTML")
+        body = jsvalue.to_string_as_bytes().get_data()
+        version, delta = self._body_snapshot.update(body, version)
+        if delta is not None:
+            prefix, suffix, middle = delta
+            delta = (prefix, suffix,
+                     encode_body(middle,
+                                 shared_memory=self.browser.shared_memory,
+                                 compression=self.browser.compression))
+        return (version, 'utf-8', delta)
+
+    def remote_extract(self, selectors):
+        """Extract data from the page with a dict of selectors by name."""
+        d = self._run_script(extraction_script(selectors))
+        return d.addCallback(get_js_value).addCallback(load_extracted)
 
     def remote_run_script(self, script):
         return self._run_script(script).addCallback(get_js_value)
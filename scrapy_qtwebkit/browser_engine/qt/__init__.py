@@ -11,10 +11,15 @@ from twisted.internet.error import (ConnectError, ConnectingCancelledError,
                                     DNSLookupError, SSLError, TimeoutError)
 from twisted.spread import pb
 
+from ..._bodies import (BodyCompression, BodySnapshot, encode_body,
+                        read_body)
+from ..._extract import extraction_script, load_extracted
 from ..._intermediaries import ScrapyNotSupported, RequestFromScrapy
+from ..._wire import decode_message
+from ..utils.blocking import BlockingRules
 from .http_methods import HTTP_METHOD_TO_QT_OPERATION
 from .nam import ScrapyNetworkAccessManager
-from .page import CustomQWebPage
+from .page import CustomQWebPage, MyErrorPageExtensionOption
 from .utils import deferred_for_qt_signal
 from .windows import window_types
 
@@ -42,10 +47,30 @@ class Browser(pb.Referenceable):
         self._reactor = reactor
         self.downloader = downloader
         self.options = global_options
+        # Set by the Scrapy side when it runs on the same host.
+        self.shared_memory = self.options.get('shared_memory', False)
+        # Negotiated by the Scrapy side for messages sent to it.
+        self.wire_version = self.options.get('wire_version', 0)
+        compression_options = self.options.get('compression')
+        if compression_options is not None:
+            self.compression = BodyCompression(**compression_options)
+        else:
+            self.compression = None
+        # Blocking rules for all pages, which may be overridden by those given
+        # for each page.
+        self.block = self.options.get('block', {})
         QWebSettings.setObjectCacheCapacities(0, 0, 0)
         QWebSettings.setMaximumPagesInCache(0)
         self._windows = None
 
+        # Blank webpages kept for reuse.
+        self._page_pool = []
+        self._page_pool_size = self.options.get('page_pool_size', 0)
+        self._pages_resetting = 0
+        for _ in range(min(self.options.get('page_pool_prewarm', 0),
+                           self._page_pool_size)):
+            self._page_pool.append(self._make_webpage())
+
     def show_window(self, webpage):
         if self._windows is None:
             window_type = self.options.get('window_type', 'simple')
@@ -58,11 +83,61 @@ class Browser(pb.Referenceable):
     def remove_webview_window(self, webview):
         self._windows.remove_webview(webview)
 
-    def remote_create_webpage(self, options: dict):
+    def _nam_options(self, options):
+        """Make network access manager options from webpage options."""
+        options = dict(options)
+        block = dict(self.block, **options.pop('block', {}))
+        options['blocking_rules'] = BlockingRules.from_options(block)
+        return options
+
+    def _make_webpage(self, **options):
+        options = self._nam_options(options)
         qwebpage = CustomQWebPage()
         nam = ScrapyNetworkAccessManager(self.downloader, parent=qwebpage,
+                                         shared_memory=self.shared_memory,
+                                         wire_version=self.wire_version,
+                                         compression=self.compression,
                                          **options)
         qwebpage.setNetworkAccessManager(nam)
+        return qwebpage
+
+    def release_webpage(self, qwebpage: CustomQWebPage):
+        """Stop a closed webpage, keeping it for reuse if the pool has room."""
+        reuse = ((len(self._page_pool) + self._pages_resetting) <
+                 self._page_pool_size)
+        if reuse:
+            self._pages_resetting += 1
+            d = deferred_for_qt_signal(qwebpage.loadFinished)
+
+        qwebpage.networkAccessManager().abort_replies()
+        # Resetting the main frame URL prevents it from making further
+        # requests, which would cause Qt errors after the webpage is deleted.
+        qwebpage.mainFrame().setUrl(QUrl())
+
+        if reuse:
+            def add_to_pool(result):
+                qwebpage.reset()
+                qwebpage.networkAccessManager().bind(
+                    self.downloader,
+                    **self._nam_options({})
+                )
+                self._page_pool.append(qwebpage)
+
+            def resetting_done(result):
+                self._pages_resetting -= 1
+
+            # Pages that do not finish loading the blank URL are not reused.
+            d.addTimeout(5, self._reactor)
+            d.addCallbacks(add_to_pool, lambda failure: None)
+            d.addBoth(resetting_done)
+
+    def remote_create_webpage(self, options: dict):
+        if self._page_pool:
+            qwebpage = self._page_pool.pop()
+            qwebpage.networkAccessManager().bind(self.downloader,
+                                                 **self._nam_options(options))
+        else:
+            qwebpage = self._make_webpage(**options)
 
         cookiejar = options.get('cookiejar')
 
@@ -71,6 +146,38 @@ class Browser(pb.Referenceable):
 
         return WebPageRemoteControl(self, qwebpage, cookiejar)
 
+    @inlineCallbacks
+    def remote_fetch(self, options: dict, request: RequestFromScrapy,
+                     timeout=None, return_partial=False, extract=None):
+        """
+
+        Load a request in a new webpage and close it, returning the load result
+        together with the webpage URL, encoding and body. If extract (a dict of
+        selectors) is given, the data extracted with it is returned instead of
+        the encoding and body, after the URL.
+
+        """
+
+        webpage = self.remote_create_webpage(options)
+        try:
+            load_result = yield webpage.remote_load_request(
+                request, timeout=timeout, return_partial=return_partial
+            )
+            if load_result[0]:
+                url = webpage.remote_get_url()
+                if extract is not None:
+                    extracted = webpage.remote_extract(extract)
+                else:
+                    encoding, body = webpage.remote_get_body()
+            else:
+                url = encoding = body = extracted = None
+        finally:
+            webpage.remote_close()
+
+        if extract is not None:
+            return load_result + (url, extracted)
+        return load_result + (url, encoding, body)
+
 
 class WebPageRemoteControl(pb.Referenceable):
     def __init__(self, browser: Browser, qwebpage: CustomQWebPage, cookiejar):
@@ -80,16 +187,21 @@ class WebPageRemoteControl(pb.Referenceable):
         # XXX: nothing else should keep a reference to the webpage.
         self._qwebpage = qwebpage
         self._cookiejar = cookiejar
+        self._body_snapshot = BodySnapshot()
 
     def _close(self):
-        # Resetting the main frame URL prevents it from making further requests,
-        # which would cause Qt errors after the webpage is deleted.
-        self._qwebpage.mainFrame().setUrl(QUrl())
+        qwebpage = self._qwebpage
+        if qwebpage is None:
+            return
+        # The webpage may be reused after being released.
+        self._qwebpage = None
 
-        if self._qwebpage.webview is not None:
-            self.browser.remove_webview_window(self._qwebpage.webview)
-            self._qwebpage.webview.setPage(None)
-            self._qwebpage.webview = None
+        if qwebpage.webview is not None:
+            self.browser.remove_webview_window(qwebpage.webview)
+            qwebpage.webview.setPage(None)
+            qwebpage.webview = None
+
+        self.browser.release_webpage(qwebpage)
 
     def __del__(self):
         self._close()
@@ -128,22 +240,59 @@ class WebPageRemoteControl(pb.Referenceable):
         QNetworkReply.ProtocolUnknownError: ScrapyNotSupported
     }
 
+    def _stop_loading(self):
+        self._qwebpage.networkAccessManager().abort_replies()
+        self._qwebpage.triggerAction(QWebPage.Stop)
+
     @inlineCallbacks
-    def remote_load_request(self, request: RequestFromScrapy):
+    def remote_load_request(self, request: RequestFromScrapy, timeout=None,
+                            return_partial=False):
+        """
+
+        Load a request, stopping after timeout seconds. If stopped, the page is
+        considered to have loaded (partially) if return_partial is true and its
+        main document was received, and to have failed with TimeoutError
+        otherwise.
+
+        """
+
+        request = decode_message(request)
+        request.body = yield read_body(request.body)
+
         if self._cookiejar:
             yield self._cookiejar.commit()
 
         d = deferred_for_qt_signal(self._qwebpage.loadFinishedWithError)
         self._qwebpage.mainFrame().load(*self._make_qt_request(request))
 
+        if timeout:
+            timeout_call = self.browser._reactor.callLater(timeout,
+                                                           self._stop_loading)
+
         ok, error = yield d
         exc = None
+        flags = []
+
+        if timeout:
+            timed_out = not timeout_call.active()
+            if not timed_out:
+                timeout_call.cancel()
+        else:
+            timed_out = False
 
         self._url = error.url
-        if error.domain == QWebPage.Http:
+        if timed_out and not (return_partial and
+                              isinstance(error, MyErrorPageExtensionOption)):
+            ok = False
+            status = None
+            headers = None
+            exc = TimeoutError(f"Page not loaded within {timeout} seconds")
+        elif error.domain == QWebPage.Http:
             ok = True
             status = error.error
             headers = getattr(error, 'headers', {})
+            if timed_out:
+                flags.append('partial')
         else:
             status = None
             headers = None
@@ -157,14 +306,44 @@ class WebPageRemoteControl(pb.Referenceable):
         if self._cookiejar:
             yield self._cookiejar.sync()
 
-        return (ok, status, headers, exc)
+        return (ok, status, headers, exc, flags)
 
     def remote_get_url(self):
         return self._qwebpage.mainFrame().url().toString()
 
     def remote_get_body(self):
         # TODO: use original page encoding.
-        return ('utf-8', self._qwebpage.mainFrame().toHtml().encode('utf-8'))
+        html = self._qwebpage.mainFrame().toHtml()
+        body = encode_body(html.encode('utf-8'),
+                           shared_memory=self.browser.shared_memory,
+                           compression=self.browser.compression)
+        return ('utf-8', body)
+
+    def remote_get_body_delta(self, version=None):
+        """
+
+        Get the page body as a delta from the version of it given (as returned
+        by a previous call), returning the new version, the encoding and the
+        delta, which is None if the body did not change.
+
+        """
+
+        body = self._qwebpage.mainFrame().toHtml().encode('utf-8')
+        version, delta = self._body_snapshot.update(body, version)
+        if delta is not None:
+            prefix, suffix, middle = delta
+            delta = (prefix, suffix,
+                     encode_body(middle,
+                                 shared_memory=self.browser.shared_memory,
+                                 compression=self.browser.compression))
+        return (version, 'utf-8', delta)
+
+    def remote_extract(self, selectors):
+        """Extract data from the page with a dict of selectors by name."""
+        script = extraction_script(selectors)
+        return load_extracted(
+            self._qwebpage.mainFrame().evaluateJavaScript(script)
+        )
 
     def remote_run_script(self, script):
         return self._qwebpage.mainFrame().evaluateJavaScript(script)
@@ -1,18 +1,30 @@
 import datetime
+import time
 from http.cookiejar import Absent, Cookie
+from urllib.parse import urlsplit
 
-from PyQt5.QtCore import QDateTime
+from PyQt5.QtCore import QDateTime, QUrl
 from PyQt5.QtNetwork import QNetworkCookie, QNetworkCookieJar
 
-from .._cookies_for_url import cookies_for_url
+from .._cookies_for_url import cookies_for_origin, path_matches
 
 
 class CookielibQtCookieJar(QNetworkCookieJar):
-    """Qt cookie jar for accessing Python cookielib cookies."""
+    """
+
+    Qt cookie jar for accessing Python cookielib cookies.
+
+    Cookies for each origin are looked up once, together with their Qt
+    cookies, while the cookielib jar (if it has a generation attribute, as
+    SynchronisedCookieJar) does not change.
+
+    """
 
     def __init__(self, cookiejar, parent=None):
         super().__init__(parent)
         self._jar = cookiejar
+        self._origin_cookies = {}
+        self._generation = None
 
     @staticmethod
     def _make_qt_cookie(cookie):
@@ -68,12 +80,47 @@ class CookielibQtCookieJar(QNetworkCookieJar):
             rest={'HttpOnly': qt_cookie.isHttpOnly()}
         )
 
-    def _cookies_for_url(self, url):
-        return cookies_for_url(self._jar, url)
+    def fetch_cookies(self, qurl):
+        """
+
+        Make sure the cookies for an URL are in the cookielib jar, if it
+        fetches them lazily, returning a Deferred if they are being fetched.
+
+        """
+
+        fetch_cookies = getattr(self._jar, 'fetch_cookies', None)
+        if fetch_cookies is not None:
+            return fetch_cookies(qurl.toString())
+
+    def _cookies_for_origin(self, url):
+        """List of cookies for the origin of an URL, with their Qt cookies."""
+        generation = getattr(self._jar, 'generation', None)
+        if generation is None:
+            return [(cookie, self._make_qt_cookie(cookie))
+                    for cookie in cookies_for_origin(self._jar, url)]
+        if generation != self._generation:
+            self._origin_cookies.clear()
+            self._generation = generation
+
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        cookies = self._origin_cookies.get(key)
+        if cookies is None:
+            cookies = self._origin_cookies[key] = [
+                (cookie, self._make_qt_cookie(cookie))
+                for cookie in cookies_for_origin(self._jar, url)
+            ]
+        return cookies
 
     def cookiesForUrl(self, qurl):
-        return list(map(self._make_qt_cookie,
-                        self._cookies_for_url(qurl.toString())))
+        path = qurl.path(QUrl.FullyEncoded) or '/'
+        now = time.time()
+        return [qt_cookie
+                for cookie, qt_cookie in self._cookies_for_origin(
+                    qurl.toString()
+                )
+                if path_matches(cookie.path, path) and
+                not cookie.is_expired(now)]
 
     def deleteCookie(self, qt_cookie):
         domain = qt_cookie.domain()
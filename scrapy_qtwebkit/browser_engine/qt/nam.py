@@ -1,17 +1,24 @@
-from io import BytesIO
+from io import SEEK_END, BytesIO
 
-from PyQt5.QtCore import QIODevice, QUrl
+from PyQt5.QtCore import QIODevice, QTimer, QUrl
 from PyQt5.QtNetwork import (QNetworkAccessManager, QNetworkCookie,
-                             QNetworkReply, QNetworkRequest)
+                             QNetworkCookieJar, QNetworkReply,
+                             QNetworkRequest)
+from PyQt5.QtWebKitWidgets import QWebFrame
 
 from twisted.internet.error import (ConnectingCancelledError,
                                     ConnectionAborted, ConnectionLost,
                                     ConnectionRefusedError, DNSLookupError,
                                     SSLError, TCPTimedOutError, TimeoutError,
                                     UnknownHostError)
-
-from ..._intermediaries import (RequestFromBrowser, ScrapyIgnoreRequest,
-                                ScrapyNotSupported)
+from twisted.python.failure import Failure
+
+from ..._bodies import (SharedMemoryBody, body_size, discard_body,
+                        encode_body, receive_body, shared_memory_files)
+from ..._intermediaries import (RequestFromBrowser, ResponseFromScrapy,
+                                ScrapyIgnoreRequest, ScrapyNotSupported)
+from ..._wire import decode_message, encode_message
+from ..utils.blocking import STUB_BODIES, guess_resource_type
 from .cookiejar import CookielibQtCookieJar
 from .http_methods import QT_OPERATION_TO_HTTP_METHOD
 
@@ -19,36 +26,128 @@ from .http_methods import QT_OPERATION_TO_HTTP_METHOD
 class ScrapyNetworkAccessManager(QNetworkAccessManager):
     def __init__(self, remote_downloader, user_agent=None,
                  remote_request_counter=None, cookiejarkey=None,
-                 cookiejar=None, parent=None):
+                 cookiejar=None, shared_memory=False, wire_version=0,
+                 compression=None, blocking_rules=None,
+                 follow_redirects=False, parent=None):
         super().__init__(parent)
+        self._replies = set()
+        self.shared_memory = shared_memory
+        self.wire_version = wire_version
+        self.compression = compression
+        self.bind(remote_downloader, user_agent=user_agent,
+                  remote_request_counter=remote_request_counter,
+                  cookiejarkey=cookiejarkey, cookiejar=cookiejar,
+                  blocking_rules=blocking_rules,
+                  follow_redirects=follow_redirects)
+
+    def bind(self, remote_downloader, user_agent=None,
+             remote_request_counter=None, cookiejarkey=None, cookiejar=None,
+             blocking_rules=None, follow_redirects=False):
+        """Set the options for the requests of the webpage being loaded."""
         self.remote_downloader = remote_downloader
         self.user_agent = user_agent
         self.remote_request_counter = remote_request_counter
         self.cookiejarkey = cookiejarkey
+        self.blocking_rules = blocking_rules
+        # Whether Scrapy follows redirects of page resources, replying with the
+        # final response.
+        self.follow_redirects = follow_redirects
+        self._page_url = None
+        # Kinds of documents ('main' or 'frame') of the targets of document
+        # redirects, by URL.
+        self._document_redirects = {}
+        # The previous cookie jar is deleted by Qt.
         if cookiejar is not None:
             self.setCookieJar(CookielibQtCookieJar(cookiejar))
+        else:
+            self.setCookieJar(QNetworkCookieJar())
         self._had_requests = False
 
-    def createRequest(self, operation, request, device=None):
-        if self.remote_request_counter:
-            self.remote_request_counter.callRemote('increase_request_count', 1)
+    def abort_replies(self):
+        """Abort all unfinished replies."""
+        replies = list(self._replies)
+        self._replies.clear()
+        for reply in replies:
+            reply.abort()
+
+    def discard_reply(self, reply):
+        """Stop tracking a reply that finished or failed."""
+        self._replies.discard(reply)
 
+    def _make_reply(self, operation, request):
         reply = ScrapyNetworkReply(self)
+        self._replies.add(reply)
+        reply.finished.connect(lambda: self.discard_reply(reply))
         reply.setRequest(request)
         reply.setOperation(operation)
+        return reply
+
+    def _document_type(self, url, request):
+        """
+
+        Whether a request is for the main document of the page ('main'), for
+        the document of a frame ('frame') or for a resource (None). The targets
+        of document redirects are documents of the same kind.
+
+        """
+
+        if not self._had_requests:
+            return 'main'
+        if url in self._document_redirects:
+            return self._document_redirects.pop(url)
+        frame = request.originatingObject()
+        if (isinstance(frame, QWebFrame) and
+                frame.requestedUrl() == request.url()):
+            return 'frame' if frame.parentFrame() else 'main'
+        return None
+
+    def document_redirected(self, url, document_type):
+        """Take the coming request for url as a document of the given kind."""
+        self._document_redirects[url] = document_type
+
+    def _should_block(self, url, request, is_document):
+        resource_type = guess_resource_type(
+            url, bytes(request.rawHeader(b'Accept')), is_document=is_document
+        )
+        if self.blocking_rules.should_block(url, resource_type,
+                                            self._page_url):
+            return resource_type
+
+    def _blocked_reply(self, operation, request, url, resource_type):
+        """Reply to a blocked request locally, with a stub body."""
+        reply = self._make_reply(operation, request)
+        content_type, body = STUB_BODIES.get(resource_type, (None, b''))
+        headers = {b'Content-Type': [content_type]} if content_type else {}
+        response = ResponseFromScrapy(url, 200, headers, body)
+        # Qt expects the reply to finish after it is returned.
+        QTimer.singleShot(0, lambda: reply.callback(response))
+        return reply
+
+    def createRequest(self, operation, request, device=None):
+        url = request.url().toString()
+        document_type = self._document_type(url, request)
+        # Third party requests are those to other sites than that of the
+        # document finally loaded, after redirects.
+        if document_type == 'main':
+            self._page_url = url
+        if self.blocking_rules is not None:
+            blocked_type = self._should_block(url, request,
+                                              document_type is not None)
+            if blocked_type is not None:
+                return self._blocked_reply(operation, request, url,
+                                           blocked_type)
+
+        if self.remote_request_counter:
+            self.remote_request_counter.callRemote('increase_request_count', 1)
+
+        reply = self._make_reply(operation, request)
+        reply.document_type = document_type
 
         if operation == QNetworkAccessManager.CustomOperation:
             method = request.attribute(QNetworkRequest.CustomVerbAttribute)
         else:
             method = QT_OPERATION_TO_HTTP_METHOD[operation]
 
-        qtcookies = self.cookieJar().cookiesForUrl(request.url())
-        if qtcookies:
-            request.setRawHeader(b'Cookie', b'; '.join(
-                c.toRawForm(QNetworkCookie.NameAndValueOnly)
-                for c in qtcookies
-            ))
-
         request.setHeader(QNetworkRequest.UserAgentHeader, None)
 
         headers = {bytes(header): bytes(request.rawHeader(header))
@@ -64,21 +163,61 @@ class ScrapyNetworkAccessManager(QNetworkAccessManager):
             body = None
 
         remote_req = RequestFromBrowser(
-            url=request.url().toString(),
+            url=url,
             method=method,
             headers=headers,
-            body=body,
-            is_first_request=(not self._had_requests),
-            cookiejarkey=self.cookiejarkey
+            body=encode_body(body, shared_memory=self.shared_memory,
+                             compression=self.compression),
+            is_first_request=(document_type == 'main'),
+            cookiejarkey=self.cookiejarkey,
+            # Redirects of documents change their URLs, so they are followed
+            # by the browser engine.
+            follow_redirects=(self.follow_redirects and document_type is None)
         )
 
         self._had_requests = True
 
-        dfd = self.remote_downloader.callRemote('make_request', remote_req)
-        dfd.addCallbacks(reply.callback, reply.errback)
+        # Cookies may have to be fetched from Scrapy first.
+        qurl = QUrl(request.url())
+        cookiejar = self.cookieJar()
+        if isinstance(cookiejar, CookielibQtCookieJar):
+            fetching = cookiejar.fetch_cookies(qurl)
+        else:
+            fetching = None
+        if fetching is None:
+            self._send_request(reply, remote_req, qurl)
+        else:
+            fetching.addCallback(lambda result: self._send_request(
+                reply, remote_req, qurl
+            ))
+            fetching.addErrback(self._request_not_sent, reply, remote_req)
 
         return reply
 
+    @staticmethod
+    def _request_not_sent(failure, reply, remote_req):
+        shared_memory_files.release(remote_req.body)
+        reply.errback(failure)
+
+    def _send_request(self, reply, remote_req, qurl):
+        if reply.aborted:
+            shared_memory_files.release(remote_req.body)
+            return
+
+        qtcookies = self.cookieJar().cookiesForUrl(qurl)
+        if qtcookies:
+            remote_req.headers[b'Cookie'] = b'; '.join(
+                c.toRawForm(QNetworkCookie.NameAndValueOnly)
+                for c in qtcookies
+            )
+
+        dfd = self.remote_downloader.callRemote(
+            'make_request', encode_message(remote_req, self.wire_version)
+        )
+        shared_memory_files.release_after(dfd, remote_req.body)
+        dfd.addCallback(decode_message)
+        dfd.addCallbacks(reply.callback, reply.errback)
+
 
 class ScrapyNetworkReply(QNetworkReply):
     """A network reply object for a request made with Scrapy."""
@@ -86,22 +225,33 @@ class ScrapyNetworkReply(QNetworkReply):
     def __init__(self, nam):
         super().__init__(nam)
         self.aborted = False
+        # Set by the network access manager for documents ('main' or 'frame').
+        self.document_type = None
         self.content = BytesIO()
+        self._content_size = 0
+        self._body_size = 0
         self.open(QIODevice.ReadOnly)
 
     def callback(self, response):
         """Finish the Qt network reply with a Scrapy response."""
 
         if self.aborted:
+            discard_body(response.body)
             return
 
+        self.setUrl(QUrl(response.url))
         if response.status in {301, 302, 303, 307}:
             location = response.headers.get(b'Location')
             if location:
+                target = QUrl(location[0].decode())
                 self.setAttribute(QNetworkRequest.RedirectionTargetAttribute,
-                                  QUrl(location[0].decode()))
-
-        self.setUrl(QUrl(response.url))
+                                  target)
+                if self.document_type is not None:
+                    # The target is requested as resolved by QtWebKit.
+                    self.parent().document_redirected(
+                        self.url().resolved(target).toString(),
+                        self.document_type
+                    )
         self.setAttribute(QNetworkRequest.HttpStatusCodeAttribute,
                           response.status)
         for header, values in response.headers.items():
@@ -111,13 +261,54 @@ class ScrapyNetworkReply(QNetworkReply):
         if qcookies:
             self.parent().cookieJar().setCookiesFromUrl(qcookies, self.url());
 
-        self.content.write(response.body)
-        self.content.seek(0)
-        self.downloadProgress.emit(len(response.body), len(response.body))
+        # Large bodies are received in chunks, each made available to be read
+        # as soon as it is received.
+        self._body_size = body_size(response.body)
+        if isinstance(response.body, SharedMemoryBody):
+            # Read directly from the shared memory, without copying it.
+            try:
+                self.content = response.body.map()
+            except Exception:
+                # E.g. removed by the sender after its lease expired.
+                self.errback(Failure())
+                return
+            self._content_size = self._body_size
+            self.downloadProgress.emit(self._content_size, self._body_size)
+            self.readyRead.emit()
+            d = None
+        elif self._body_size:
+            d = receive_body(response.body, self._write_content)
+        else:
+            self._write_content(b'')
+            d = None
+
+        if d is None:
+            self._finish(None)
+        else:
+            # Run at once for bodies received synchronously, e.g. compressed
+            # ones, which may fail to decompress.
+            d.addCallbacks(self._finish, self._receive_failed)
 
+    def _write_content(self, data):
+        if self.aborted:
+            return
+        read_position = self.content.tell()
+        self.content.seek(0, SEEK_END)
+        self.content.write(data)
+        self.content.seek(read_position)
+        self._content_size += len(data)
+        self.downloadProgress.emit(self._content_size, self._body_size)
         self.readyRead.emit()
+
+    def _finish(self, result):
+        if self.aborted:
+            return
         self.finished.emit()
 
+    def _receive_failed(self, failure):
+        # Reported with the reply, nothing else waits for the body.
+        self.errback(failure)
+
     def errback(self, failure):
         """Finish the Qt network reply with an error from Scrapy."""
         if self.aborted:
@@ -149,12 +340,15 @@ class ScrapyNetworkReply(QNetworkReply):
         self.error.emit(error_code)
         # XXX: this segfaults.
         # self.finished.emit()
+        # Not finished, so not discarded by the network access manager (and
+        # aborted on page reuse) otherwise.
+        self.parent().discard_reply(self)
 
         return failure
 
     def bytesAvailable(self):
         return (super().bytesAvailable() +
-                (len(self.content.getvalue()) - self.content.tell()))
+                (self._content_size - self.content.tell()))
 
     def readData(self, size):
         return self.content.read(size)
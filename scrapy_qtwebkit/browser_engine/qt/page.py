@@ -45,6 +45,11 @@ class CustomQWebPage(QWebPage):
         self._current_error = None
         self.loadFinished.connect(self._on_load_finished)
 
+    def reset(self):
+        """Forget the state of the previous load, for reusing the webpage."""
+        self._current_error = None
+        self.history().clear()
+
     def setNetworkAccessManager(self, nam):
         super().setNetworkAccessManager(nam)
         self.networkAccessManager().finished.connect(self._on_network_reply)
@@ -0,0 +1,139 @@
+import re
+from fnmatch import translate
+from functools import lru_cache
+from posixpath import splitext
+from urllib.parse import urlsplit
+
+import tldextract
+
+
+# Resource types guessed from URL file extensions.
+_EXTENSION_TYPES = {
+    'image': {'.png', '.jpg', '.jpeg', '.gif', '.webp', '.svg', '.ico',
+              '.bmp', '.avif'},
+    'stylesheet': {'.css'},
+    'script': {'.js', '.mjs'},
+    'font': {'.woff', '.woff2', '.ttf', '.otf', '.eot'},
+    'media': {'.mp4', '.webm', '.ogg', '.ogv', '.mp3', '.wav', '.m4a',
+              '.m3u8', '.mpd'},
+}
+_TYPE_BY_EXTENSION = {extension: resource_type
+                      for resource_type, extensions in _EXTENSION_TYPES.items()
+                      for extension in extensions}
+
+# Resource types guessed from the first media type in the Accept header.
+_ACCEPT_TYPES = [
+    (b'image/', 'image'),
+    (b'text/css', 'stylesheet'),
+    (b'video/', 'media'),
+    (b'audio/', 'media'),
+    (b'font/', 'font'),
+]
+
+# Content types and bodies of the replies to blocked requests, by resource
+# type. Other blocked requests get an empty reply.
+STUB_BODIES = {
+    # A transparent 1x1 GIF image.
+    'image': (b'image/gif',
+              b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\x00\x00\x00!'
+              b'\xf9\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01'
+              b'\x00\x00\x02\x02D\x01\x00;'),
+    'stylesheet': (b'text/css', b''),
+    'script': (b'application/javascript', b''),
+}
+
+
+def guess_resource_type(url, accept=b'', is_document=False):
+    """
+
+    Guess the type of resource requested (document, image, stylesheet, script,
+    font, media or other), since QtWebKit does not tell it. Documents (of the
+    page or its frames) are told apart by the caller.
+
+    """
+
+    if is_document:
+        return 'document'
+    path = urlsplit(url).path
+    resource_type = _TYPE_BY_EXTENSION.get(splitext(path)[1].lower())
+    if resource_type:
+        return resource_type
+    accept = accept.lstrip().lower()
+    for prefix, resource_type in _ACCEPT_TYPES:
+        if accept.startswith(prefix):
+            return resource_type
+    return 'other'
+
+
+# With the public suffix list bundled with tldextract, which is not updated
+# from the network. Private suffixes (e.g. github.io) separate sites as well.
+_extract_domain = tldextract.TLDExtract(suffix_list_urls=(), cache_dir=None,
+                                        include_psl_private_domains=True)
+
+
+@lru_cache(maxsize=1024)
+def _site(host):
+    """
+
+    The registrable domain of a host, or the host itself if it has none (e.g.
+    IP addresses and localhost).
+
+    """
+
+    host = host.lower().rstrip('.')
+    domain = _extract_domain.extract_str(host).top_domain_under_public_suffix
+    return domain or host
+
+
+def is_third_party(url, page_url):
+    host = urlsplit(url).hostname
+    page_host = urlsplit(page_url).hostname
+    if not (host and page_host):
+        return False
+    return _site(host) != _site(page_host)
+
+
+class BlockingRules(object):
+    """
+
+    Rules for blocking requests of a page, by resource type, by URL (matching
+    any of the glob patterns in urls or of the regular expressions in
+    url_regexes) or by origin (if third_party is true, requests to other sites
+    than that of the page). Requests for documents (of the page or its
+    frames) are never blocked.
+
+    """
+
+    def __init__(self, resource_types=(), urls=(), url_regexes=(),
+                 third_party=False):
+        super().__init__()
+        self.resource_types = frozenset(resource_types)
+        self._url_globs = self._compile(translate(url) for url in urls)
+        self._url_regexes = self._compile(url_regexes)
+        self.third_party = third_party
+
+    @staticmethod
+    def _compile(patterns):
+        patterns = list(patterns)
+        if patterns:
+            return re.compile('|'.join(f'(?:{p})' for p in patterns))
+
+    @classmethod
+    def from_options(cls, options):
+        """Make rules from an options dict, or return None if empty."""
+        if not options or not any(options.values()):
+            return None
+        return cls(**options)
+
+    def should_block(self, url, resource_type, page_url=None):
+        if resource_type == 'document':
+            return False
+        if resource_type in self.resource_types:
+            return True
+        if self._url_globs is not None and self._url_globs.match(url):
+            return True
+        if self._url_regexes is not None and self._url_regexes.search(url):
+            return True
+        if self.third_party and page_url and is_third_party(url, page_url):
+            return True
+        return False
@@ -0,0 +1,36 @@
+class LoopLagMonitor(object):
+    """Measures how late the reactor runs calls scheduled on it."""
+
+    def __init__(self, reactor, interval=0.1):
+        super().__init__()
+        self._reactor = reactor
+        self._interval = interval
+        self._expected_time = None
+        self._max_lag = 0
+        self._call = None
+        self.running = False
+
+    def start(self):
+        self.running = True
+        self._schedule()
+
+    def stop(self):
+        self.running = False
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+
+    def _schedule(self):
+        self._expected_time = self._reactor.seconds() + self._interval
+        self._call = self._reactor.callLater(self._interval, self._measure)
+
+    def _measure(self):
+        lag = self._reactor.seconds() - self._expected_time
+        self._max_lag = max(self._max_lag, lag)
+        self._schedule()
+
+    def pop_max_lag(self):
+        """Get the maximum lag (in seconds) since the last call."""
+        max_lag = self._max_lag
+        self._max_lag = 0
+        return max_lag
@@ -0,0 +1,16 @@
+import resource
+import sys
+
+
+def get_rss():
+    """Get the resident set size of the current process, in bytes."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # Not Linux. Use the peak resident set size instead, which is given in
+        # bytes on macOS and in kilobytes elsewhere.
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            return maxrss
+        return maxrss * 1024
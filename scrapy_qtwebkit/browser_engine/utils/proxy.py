@@ -7,7 +7,10 @@ from twisted.internet import ssl
 from twisted.python import log
 from twisted.web import http
 
+from ..._bodies import (body_size, encode_body, receive_body,
+                        shared_memory_files)
 from ..._intermediaries import RequestFromBrowser
+from ..._wire import decode_message, encode_message
 
 
 class TmpCertSSLContextFactory(ssl.DefaultOpenSSLContextFactory):
@@ -57,17 +60,23 @@ class RemoteScrapyProxyRequest(http.Request):
         base_url = f'{scheme}://{host}'
         url = urljoin(base_url, self.uri.decode())
 
+        factory = self.channel.factory
         self.content.seek(0, 0)
         remote_req = RequestFromBrowser(
             url=url,
             method=self.method.decode(),
             headers=dict(self.requestHeaders.getAllRawHeaders()),
-            body=self.content.read(),
+            body=encode_body(self.content.read(),
+                             shared_memory=factory.shared_memory,
+                             compression=factory.compression),
             is_first_request=False,
-            cookiejarkey=self.channel.factory.cookiejarkey
+            cookiejarkey=factory.cookiejarkey
         )
-        dfd = self.channel.factory.remote_downloader.callRemote('make_request',
-                                                                remote_req)
+        dfd = factory.remote_downloader.callRemote(
+            'make_request', encode_message(remote_req, factory.wire_version)
+        )
+        shared_memory_files.release_after(dfd, remote_req.body)
+        dfd.addCallback(decode_message)
         dfd.addCallbacks(self._handle_response, self._handle_error)
 
     def _handle_error(self, failure):
@@ -90,9 +99,15 @@ class RemoteScrapyProxyRequest(http.Request):
         self.setResponseCode(status)
         for header, values in headers.items():
             self.responseHeaders.setRawHeaders(header, values)
-        self.setHeader(b'Content-Length', str(len(body)).encode('ascii'))
-        self.write(body)
-        self.finish()
+        self.setHeader(b'Content-Length',
+                       str(body_size(body)).encode('ascii'))
+        # Large bodies are written as their chunks are received.
+        d = receive_body(body, self.write)
+        d.addCallbacks(lambda result: self.finish(), self._handle_body_error)
+
+    def _handle_body_error(self, failure):
+        log.err(failure)
+        self.loseConnection()
 
 
 class RemoteScrapyProxy(http.HTTPChannel):
@@ -104,9 +119,14 @@ class RemoteScrapyProxyFactory(http.HTTPFactory):
 
     _ssl_context_factory = None
 
-    def __init__(self, remote_downloader, *args, cookiejarkey=None, **kwargs):
+    def __init__(self, remote_downloader, *args, cookiejarkey=None,
+                 shared_memory=False, wire_version=0, compression=None,
+                 **kwargs):
         if self.__class__._ssl_context_factory is None:
             self.__class__._ssl_context_factory = TmpCertSSLContextFactory()
         super().__init__(*args, **kwargs)
         self.remote_downloader = remote_downloader
         self.cookiejarkey = cookiejarkey
+        self.shared_memory = shared_memory
+        self.wire_version = wire_version
+        self.compression = compression
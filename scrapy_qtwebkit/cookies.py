@@ -1,10 +1,13 @@
 import logging
+import time
 from http.cookiejar import Cookie, CookieJar
 from operator import methodcaller
 
 from twisted.internet.defer import DeferredList
 from twisted.spread import pb
 
+from ._wire import BATCHED_COOKIES_VERSION, broker_version
+from .browser_engine._cookies_for_url import potential_cookie_domains
 from .utils import PendingDeferreds
 
 
@@ -36,42 +39,76 @@ class _CookieJarRemoteMethodCaller(pb.Referenceable):
         self._cookiejar = cookiejar
 
     def remote_set_cookie(self, changer_id, key, cookie):
+        """Change a cookie, for older browser engines."""
         self._cookiejar._remote_set_cookie(key, cookie, changer_id=changer_id)
 
+    def remote_set_cookies(self, changer_id, changes):
+        for key, cookie in changes:
+            self._cookiejar._remote_set_cookie(key, cookie,
+                                               changer_id=changer_id)
+
+    def remote_get_cookies(self, observer_id, domains):
+        return self._cookiejar._cookies_for_remote(observer_id, domains)
+
     def remote_commit(self):
         return self._cookiejar.commit()
 
 
 class SynchronisedCookieJar(CookieJar):
+    """
+
+    Cookie jar with a remote copy, to which changes are sent in batches, once
+    for each reactor iteration or sync (with only the last change for each
+    cookie).
+
+    """
+
     def __init__(self, policy=None, auto_sync=False, local_observers=None):
         super().__init__(policy=policy)
         self._remote_changes = {}
         self._pending = PendingDeferreds()
         self._auto_sync = auto_sync
         self.local_observers = local_observers or []
+        # Changes to send to the remote, as (cookie, changer ID) by key.
+        self._outgoing_changes = {}
+        self._flush_call = None
+        self._clock = None
+        # Incremented on every change to the cookies, for invalidating caches
+        # of cookie lookups.
+        self.generation = 0
+
+    def set_cookie(self, cookie):
+        self.generation += 1
+        super().set_cookie(cookie)
+
+    def clear(self, domain=None, path=None, name=None):
+        self.generation += 1
+        super().clear(domain, path, name)
 
     def sync(self):
         """Ensure the remote copy has received all updates."""
+        self._flush_changes()
         return self._pending.deferred()
 
     def commit(self):
         """Commit updates received from the remote."""
-        if self._auto_sync:
+        if self._auto_sync or not self._remote_changes:
             return
 
         result = []
         changes = list(self._remote_changes.items())
         self._remote_changes.clear()
-        for key, cookie in changes:
-            self._do_change(key, cookie)
+        for key, (cookie, changer_id) in changes:
+            self._do_change(key, cookie, changer_id)
             result.extend(map(methodcaller('cookie_change', key, cookie),
                               self.local_observers))
+        self._flush_changes()
         return DeferredList(result, fireOnOneErrback=True
                             ).addCallback(lambda result: None)
 
-    def _remote_set_cookie(self, key, cookie):
+    def _remote_set_cookie(self, key, cookie, changer_id=None):
         if self._auto_sync:
-            self._do_change(key, cookie)
+            self._do_change(key, cookie, changer_id)
             return DeferredList(map(methodcaller('cookie_change', key, cookie),
                                     self.local_observers),
                                 fireOnOneErrback=True
@@ -81,9 +118,10 @@ class SynchronisedCookieJar(CookieJar):
                 logger.debug(f"Staging cookie update: {cookie}")
             else:
                 logger.debug(f"Staging cookie deletion: {key}")
-            self._remote_changes[key] = cookie
+            self._remote_changes[key] = (cookie, changer_id)
 
-    def _do_change(self, key, cookie):
+    def _do_change(self, key, cookie, changer_id=None):
+        self.generation += 1
         if cookie:
             logger.debug(f"Committing cookie update: {cookie}")
             super().set_cookie(cookie)
@@ -91,85 +129,271 @@ class SynchronisedCookieJar(CookieJar):
             logger.debug(f"Committing cookie deletion: {key}")
             super().clear(*key)
 
+    def _queue_change(self, key, cookie, changer_id=None):
+        """Queue a change to be sent to the remote."""
+        if cookie:
+            logger.debug(f"Notifying cookie update: {cookie}")
+        else:
+            logger.debug(f"Notifying cookie deletion: {key}")
+        self._outgoing_changes[key] = (cookie, changer_id)
+        if self._flush_call is None:
+            clock = self._clock
+            if clock is None:
+                # Not imported before the browser engine installs its reactor.
+                from twisted.internet import reactor as clock
+            self._flush_call = clock.callLater(0, self._flush_changes)
+
+    def _flush_changes(self):
+        if self._flush_call is not None:
+            if self._flush_call.active():
+                self._flush_call.cancel()
+            self._flush_call = None
+        if self._outgoing_changes:
+            changes = self._outgoing_changes
+            self._outgoing_changes = {}
+            self._send_changes(changes)
+
+    def _send_changes(self, changes):
+        """
+
+        Send changes, as (cookie, changer ID) by key, to the remote copies.
+        Jars without them (only having local observers) have nothing to do.
+
+        """
+
 
 class RemotelyAccessibleCookieJar(SynchronisedCookieJar, pb.Cacheable):
+    """
+
+    Cookie jar with remote copies. Remote copies start empty, get the cookies
+    of a domain when they first need them, and are then sent changes to the
+    cookies of the domains they got. Remote copies in browser engines not
+    supporting BATCHED_COOKIES_VERSION get all the cookies, and then each
+    change.
+
+    """
+
     def __init__(self, policy=None, auto_sync=False):
         super().__init__(policy=policy, auto_sync=auto_sync)
         self._remote_method_caller = _CookieJarRemoteMethodCaller(self)
         self._observers = set()
-        self._staged_last_changer = {}
+        self._legacy_observers = set()
+        # Number of batches of changes sent to each remote copy, and of those
+        # known to have been committed by it, by observer ID.
+        self._remote_versions = {}
+        self._committed_remote_versions = {}
+        # Domains whose cookies each remote copy got, by observer ID.
+        self._remote_domains = {}
 
     def getStateToCacheAndObserveFor(self, perspective, observer):
         self._observers.add(observer)
-        return (self._cookies, self._remote_method_caller, hash(observer),
-                self._auto_sync)
+        if broker_version(observer.broker) < BATCHED_COOKIES_VERSION:
+            self._legacy_observers.add(observer)
+            return (self._cookies, self._remote_method_caller, hash(observer),
+                    self._auto_sync)
+        return ({}, self._remote_method_caller, hash(observer),
+                self._auto_sync, BATCHED_COOKIES_VERSION)
 
     def stoppedObserving(self, perspective, observer):
         self._observers.remove(observer)
-
-    def _cookie_change(self, key, cookie, changer_id=None):
-        self._staged_last_changer[key] = changer_id
-        super()._cookie_change(key, cookie)
-
-    def _notify_observers(self, key, cookie):
-        last_changer_id = self._staged_last_changer.pop(key)
-        if cookie:
-            logger.debug(f"Notifying cookie update: {cookie}")
-        else:
-            logger.debug(f"Notifying cookie deletion: {key}")
+        self._legacy_observers.discard(observer)
+        self._remote_versions.pop(hash(observer), None)
+        self._committed_remote_versions.pop(hash(observer), None)
+        self._remote_domains.pop(hash(observer), None)
+
+    def _cookies_for_remote(self, observer_id, domains):
+        """Cookies of some domains for a remote copy, by domain, path and
+        name."""
+        now = time.time()
+        result = {}
+        for domain in domains:
+            if domain not in self._cookies:
+                continue
+            # Expired cookies are purged instead of sent.
+            for cookies_by_name in list(self._cookies[domain].values()):
+                for cookie in list(cookies_by_name.values()):
+                    if cookie.is_expired(now):
+                        self.clear(cookie.domain, cookie.path, cookie.name)
+            cookies_by_path = {path: dict(cookies_by_name)
+                               for path, cookies_by_name
+                               in self._cookies[domain].items()
+                               if cookies_by_name}
+            if cookies_by_path:
+                result[domain] = cookies_by_path
+        # Changes made so far are only sent to the remote copies that already
+        # got these domains, this one getting them in the result.
+        self._flush_changes()
+        self._remote_domains.setdefault(observer_id, set()).update(domains)
+        return result
+
+    def _observer_id(self, broker):
         for obs in self._observers:
-            if hash(obs) == last_changer_id:
+            if obs.broker is broker:
+                return hash(obs)
+
+    def remote_version(self, broker):
+        """Version of the changes sent to the remote copy through a broker."""
+        return self._remote_versions.get(self._observer_id(broker), 0)
+
+    def committed_remote_version(self, broker):
+        """Version of the changes known to be committed by the remote copy
+        through a broker."""
+        return self._committed_remote_versions.get(self._observer_id(broker),
+                                                   0)
+
+    def remote_committed(self, broker, version):
+        """Record that the remote copy through a broker committed the changes
+        sent to it up to a version."""
+        observer_id = self._observer_id(broker)
+        if observer_id is not None:
+            self._committed_remote_versions[observer_id] = version
+
+    def _send_changes(self, changes):
+        for obs in self._observers:
+            legacy = obs in self._legacy_observers
+            domains = self._remote_domains.get(hash(obs), ())
+            # Changes are not sent back to the remote copy that made them.
+            obs_changes = [(key, cookie)
+                           for key, (cookie, changer_id) in changes.items()
+                           if changer_id != hash(obs) and
+                           (legacy or key[0] in domains)]
+            if not obs_changes:
                 continue
-            self._pending.add(obs.callRemote('cookie_change', key, cookie))
+            self._remote_versions[hash(obs)] = (
+                self._remote_versions.get(hash(obs), 0) + 1
+            )
+            if legacy:
+                for key, cookie in obs_changes:
+                    self._pending.add(obs.callRemote('cookie_change', key,
+                                                     cookie))
+            else:
+                self._pending.add(obs.callRemote('cookie_changes',
+                                                 obs_changes))
 
-    def _do_change(self, key, cookie):
-        super()._do_change(key, cookie)
-        self._notify_observers(key, cookie)
+    def _do_change(self, key, cookie, changer_id=None):
+        super()._do_change(key, cookie, changer_id)
+        self._queue_change(key, cookie, changer_id)
 
     def set_cookie(self, cookie):
         if not isinstance(cookie, CopyableCookie):
             cookie = CopyableCookie.from_regular_cookie(cookie)
         key = (cookie.domain, cookie.path, cookie.name)
-        self._staged_last_changer[key] = None
-        self._notify_observers(key, cookie)
+        self._queue_change(key, cookie)
         super().set_cookie(cookie)
 
     def clear(self, domain, path, name):
         if domain is None or path is None or name is None:
             raise ValueError("domain, path and name must be given")
         key = (domain, path, name)
-        self._staged_last_changer[key] = None
-        self._notify_observers(key, None)
         super().clear(domain, path, name)
+        self._queue_change(key, None)
 
 
 class RemoteCookieJar(SynchronisedCookieJar, pb.RemoteCache):
     def setCopyableState(self, state):
         (self._cookies, self._jarmethods, self._observer_id,
-         self._auto_sync) = state
+         self._auto_sync, *version) = state
+        # Older Scrapy sides send all the cookies, and take changes one by one.
+        self._batched = (bool(version) and
+                         version[0] >= BATCHED_COOKIES_VERSION)
+        self._fetched_domains = set()
+        # Deferreds for the cookies being fetched, by domain.
+        self._fetching = {}
+        # Keys of the cookies deleted here while their domain was being
+        # fetched, which are not added back from the fetched cookies.
+        self._deleted_while_fetching = set()
+
+    def fetch_cookies(self, url):
+        """
+
+        Fetch the cookies that may match an URL, unless already fetched,
+        returning a Deferred fired when they are in the jar, or None if they
+        already are.
+
+        """
+
+        if not self._batched:
+            return None
+        domains = [domain for domain in potential_cookie_domains(url)
+                   if domain not in self._fetched_domains]
+        if not domains:
+            return None
+        missing = [domain for domain in domains
+                   if domain not in self._fetching]
+        if missing:
+            dfd = self._jarmethods.callRemote('get_cookies',
+                                              self._observer_id, missing)
+            dfd.addCallback(self._add_fetched_cookies, missing)
+            dfd.addBoth(self._fetch_done, missing)
+            for domain in missing:
+                self._fetching[domain] = dfd
+        fetching = {self._fetching[domain] for domain in domains
+                    if domain in self._fetching}
+        return DeferredList(list(fetching), fireOnOneErrback=True,
+                            consumeErrors=True
+                            ).addCallback(lambda result: None)
+
+    def _add_fetched_cookies(self, cookies, domains):
+        for domain, cookies_by_path in cookies.items():
+            for path, cookies_by_name in cookies_by_path.items():
+                for name, cookie in cookies_by_name.items():
+                    # Cookies changed here since are kept.
+                    if (domain, path, name) in self._deleted_while_fetching:
+                        continue
+                    self._cookies.setdefault(domain, {}).setdefault(
+                        path, {}
+                    ).setdefault(name, cookie)
+        self._fetched_domains.update(domains)
+        self.generation += 1
+
+    def _fetch_done(self, result, domains):
+        for domain in domains:
+            del self._fetching[domain]
+        self._deleted_while_fetching = {
+            key for key in self._deleted_while_fetching
+            if key[0] not in domains
+        }
+        return result
+
+    def _deleted(self, key):
+        if key[0] in self._fetching:
+            self._deleted_while_fetching.add(key)
+
+    def _do_change(self, key, cookie, changer_id=None):
+        if not cookie:
+            self._deleted(key)
+        super()._do_change(key, cookie, changer_id)
 
     def observe_cookie_change(self, key, cookie):
         self._remote_set_cookie(key, cookie)
 
-    def _set_remote_cookie(self, key, cookie):
-        if cookie:
-            logger.debug(f"Notifying cookie update: {cookie}")
-        else:
-            logger.debug(f"Notifying cookie deletion: {key}")
-        return self._pending.add(self._jarmethods.callRemote('set_cookie',
-                                                             self._observer_id,
-                                                             key, cookie))
+    def observe_cookie_changes(self, changes):
+        for key, cookie in changes:
+            self._remote_set_cookie(key, cookie)
+
+    def _send_changes(self, changes):
+        if not self._batched:
+            for key, (cookie, changer_id) in changes.items():
+                self._pending.add(self._jarmethods.callRemote(
+                    'set_cookie', self._observer_id, key, cookie
+                ))
+            return
+        self._pending.add(self._jarmethods.callRemote(
+            'set_cookies', self._observer_id,
+            [(key, cookie) for key, (cookie, changer_id) in changes.items()]
+        ))
 
     def set_cookie(self, cookie):
         if not isinstance(cookie, CopyableCookie):
             cookie = CopyableCookie.from_regular_cookie(cookie)
         key = (cookie.domain, cookie.path, cookie.name)
-        self._set_remote_cookie(key, cookie)
+        self._queue_change(key, cookie)
         super().set_cookie(cookie)
 
     def clear(self, domain, path, name):
         if domain is None or path is None or name is None:
             raise ValueError("domain, path and name must be given")
         key = (domain, path, name)
-        self._set_remote_cookie(key, None)
+        self._deleted(key)
         super().clear(domain, path, name)
+        self._queue_change(key, None)
@@ -2,29 +2,38 @@
 
 import logging
 import sys
+import time
 from functools import partial
 
 from scrapy import signals
 from scrapy.exceptions import NotConfigured, NotSupported
 from scrapy.http import HtmlResponse
+from scrapy.utils.httpobj import urlparse_cached
 
 from twisted.internet import reactor
-from twisted.internet.defer import (DeferredLock, DeferredSemaphore,
-                                    inlineCallbacks)
+from twisted.internet.defer import inlineCallbacks
 from twisted.internet.endpoints import ProcessEndpoint, clientFromString
-from twisted.python.failure import Failure
-from twisted.spread import jelly, pb
+from twisted.internet.task import LoopingCall
 
+from .._bodies import (BodyCompression, encode_body, read_body,
+                       shared_memory_files)
+from .._extract import extract_from_response
 from .._intermediaries import RequestFromScrapy, ScrapyNotSupported
-from .cookies import RemotelyAccessibleCookiesMiddleware, sync_cookies
+from .._wire import (BODY_DELTAS_VERSION, COMPRESSION_VERSION, EXTRACT_VERSION,
+                     FOLLOW_REDIRECTS_VERSION, encode_message)
+from .autothrottle import PageLimitAutoThrottle
+from .cache import SubresourceCache
+from .cookies import (RemotelyAccessibleCookiesMiddleware,
+                      commit_remote_cookies, sync_cookies)
 from .downloader import BrowserRequestDownloader
-from .http import BrowserRequest, BrowserResponse
+from .engines import BrowserEngine, BrowserEnginePool
+from .http import BrowserPageEvicted, BrowserRequest, BrowserResponse
 from .spidermw import BrowserResponseTrackerMiddleware
-from .utils import (DummySemaphore, PBBrokerForEndpoint,
-                    PBReferenceMethodsWrapper)
+from .utils import (AdjustableSemaphore, DummySemaphore, HeldPages, PageSlot,
+                    PBReferenceMethodsWrapper, PrioritySemaphore)
 
 
-__all__ = ['BrowserMiddleware', 'BrowserRequest',
+__all__ = ['BrowserMiddleware', 'BrowserPageEvicted', 'BrowserRequest',
            'BrowserResponseTrackerMiddleware']
 
 
@@ -47,94 +56,324 @@ class BrowserMiddleware(object):
         else:
             cookies_mw = None
 
-        server = settings.get('BROWSER_ENGINE_SERVER')
-        start_server = settings.getbool('BROWSER_ENGINE_START_SERVER', False)
+        if settings.getbool('BROWSER_ENGINE_CACHE_ENABLED', False):
+            subresource_cache = SubresourceCache.from_crawler(crawler)
+        else:
+            subresource_cache = None
 
-        if not (server or start_server):
+        servers = settings.getlist('BROWSER_ENGINE_SERVER')
+        # Either a boolean or a number of processes to start.
+        try:
+            num_processes = settings.getint('BROWSER_ENGINE_START_SERVER', 0)
+        except ValueError:
+            num_processes = int(
+                settings.getbool('BROWSER_ENGINE_START_SERVER')
+            )
+
+        if not (servers or num_processes):
             raise NotConfigured("Must specify either BROWSER_ENGINE_SERVER or "
                                 "BROWSER_ENGINE_START_SERVER")
-        if server and start_server:
+        if servers and num_processes:
             raise NotConfigured("Must not specify both BROWSER_ENGINE_SERVER "
-                                "and BROWSER_ENGINE_START_SERVER=True")
+                                "and BROWSER_ENGINE_START_SERVER")
 
-        if server:
-            endpoint = clientFromString(reactor, server)
+        if servers:
+            endpoints = [clientFromString(reactor, server)
+                         for server in servers]
         else:
             # Twisted logs the process's stderr with INFO level.
             logging.getLogger("twisted").setLevel(logging.INFO)
             argv = [sys.executable,
                     "-m", "scrapy_qtwebkit.browser_engine", "stdio"]
-            endpoint = ProcessEndpoint(reactor, argv[0], argv, env=None)
+            # Each connection through the endpoint starts a new process.
+            endpoints = [ProcessEndpoint(reactor, argv[0], argv, env=None)
+                         for _ in range(num_processes)]
+        # Only started browser engines are known to be on the same host.
+        shared_memory = (
+            bool(num_processes) and
+            settings.getbool('BROWSER_ENGINE_SHARED_MEMORY', True)
+        )
+
+        # Compression is only worth it over the network.
+        if settings.getbool('BROWSER_ENGINE_COMPRESSION_ENABLED',
+                            bool(servers)):
+            compression_options = {
+                'level': settings.getint(
+                    'BROWSER_ENGINE_COMPRESSION_LEVEL', 6
+                ),
+                'min_size': settings.getint(
+                    'BROWSER_ENGINE_COMPRESSION_MIN_SIZE', 1024
+                ),
+            }
+        else:
+            compression_options = None
+
+        if settings.getbool('BROWSER_ENGINE_AUTOTHROTTLE_ENABLED', False):
+            autothrottle_options = {
+                'min_pages': settings.getint(
+                    'BROWSER_ENGINE_AUTOTHROTTLE_MIN_PAGES', 1
+                ),
+                'max_pages': settings.getint(
+                    'BROWSER_ENGINE_AUTOTHROTTLE_MAX_PAGES', 16
+                ),
+                'target_latency': settings.getfloat(
+                    'BROWSER_ENGINE_AUTOTHROTTLE_TARGET_LATENCY', 10.0
+                ),
+                'max_loop_lag': settings.getfloat(
+                    'BROWSER_ENGINE_AUTOTHROTTLE_MAX_LOOP_LAG', 0.5
+                ),
+                'max_rss': settings.getint(
+                    'BROWSER_ENGINE_AUTOTHROTTLE_MAX_RSS_MB', 0
+                ) * 1024 * 1024,
+            }
+        else:
+            autothrottle_options = None
 
         mw = cls(
             crawler,
-            endpoint,
+            endpoints,
             page_limit=settings.getint('BROWSER_ENGINE_PAGE_LIMIT', 4),
+            render_timeout=settings.getfloat(
+                'BROWSER_ENGINE_RENDER_TIMEOUT',
+                settings.getfloat('DOWNLOAD_TIMEOUT')
+            ),
+            subresource_concurrency=settings.getint(
+                'BROWSER_ENGINE_SUBRESOURCE_CONCURRENCY', 16
+            ),
+            domain_page_limit=settings.getint(
+                'BROWSER_ENGINE_PAGE_LIMIT_PER_DOMAIN',
+                settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN')
+            ),
             browser_options=settings.getdict('BROWSER_ENGINE_OPTIONS'),
             cookies_middleware=cookies_mw,
+            max_pages_per_engine=settings.getint('BROWSER_ENGINE_MAX_PAGES',
+                                                 0),
+            max_engine_rss=settings.getint('BROWSER_ENGINE_MAX_RSS_MB',
+                                           0) * 1024 * 1024,
+            memory_check_interval=settings.getfloat(
+                'BROWSER_ENGINE_MEMORY_CHECK_INTERVAL', 60
+            ),
+            autothrottle_options=autothrottle_options,
+            autothrottle_interval=settings.getfloat(
+                'BROWSER_ENGINE_AUTOTHROTTLE_INTERVAL', 5
+            ),
+            shared_memory=shared_memory,
+            compression_options=compression_options,
+            subresource_cache=subresource_cache,
+            coalesce_requests=settings.getbool(
+                'BROWSER_ENGINE_COALESCE_REQUESTS', True
+            ),
+            follow_redirects=settings.getbool(
+                'BROWSER_ENGINE_FOLLOW_REDIRECTS', False
+            ),
+            page_idle_timeout=settings.getfloat(
+                'BROWSER_ENGINE_PAGE_IDLE_TIMEOUT', 0
+            ),
+            evict_pages=settings.getbool(
+                'BROWSER_ENGINE_PAGE_EVICTION_ENABLED', False
+            ),
         )
+        crawler.signals.connect(mw._engine_started,
+                                signal=signals.engine_started)
         crawler.signals.connect(mw._engine_stopped,
                                 signal=signals.engine_stopped)
 
         return mw
 
-    def __init__(self, crawler, client_endpoint, page_limit=4,
-                 browser_options=None, cookies_middleware=None):
+    # Time to wait for the browser engine to reply, after the render timeout,
+    # before giving up on a page.
+    render_timeout_grace = 5
+
+    def __init__(self, crawler, client_endpoints, page_limit=4,
+                 browser_options=None, cookies_middleware=None,
+                 max_pages_per_engine=0, max_engine_rss=0,
+                 memory_check_interval=60, autothrottle_options=None,
+                 autothrottle_interval=5, domain_page_limit=0,
+                 render_timeout=0, subresource_concurrency=16,
+                 shared_memory=False, compression_options=None,
+                 subresource_cache=None, coalesce_requests=False,
+                 follow_redirects=False, page_idle_timeout=0,
+                 evict_pages=False):
         super().__init__()
         self._crawler = crawler
-        self._client_endpoint = client_endpoint
-        if page_limit:
-            self._semaphore = DeferredSemaphore(page_limit)
-        else:
-            self._semaphore = DummySemaphore()
-
         self.browser_options = (browser_options or {})
         self.cookies_mw = cookies_middleware
+        # Whether bodies are exchanged with the browser engines through shared
+        # memory, which requires them to be on the same host.
+        self.shared_memory = shared_memory
+        if shared_memory:
+            # Files of bodies that browser engines did not get to remove.
+            reactor.addSystemEventTrigger('before', 'shutdown',
+                                          shared_memory_files.release_all)
+        # Compression of bodies sent to browser engines supporting it.
+        if compression_options is not None:
+            self._compression = BodyCompression(stats=self._crawler.stats,
+                                                **compression_options)
+        else:
+            self._compression = None
 
-        self._downloader = BrowserRequestDownloader(self._crawler)
-        self._browser = None
-        self._browser_init_lock = DeferredLock()
-
-    @inlineCallbacks
-    def _init_browser(self):
-        # XXX: open at most one browser at a time per client (i.e. per Scrapy
-        #      instance), ensure there is no communication between pages of a
-        #      browser. If not possible, open one browser per cookiejar but also
-        #      allow the user to have separate browsers on the same cookiejar.
-
-        if self._browser is not None:
-            return
-
-        # The endpoint does not call the factory's clientConnectionLost()
-        # method. PBClientFactory relies on this method being called in order
-        # to fail pending getRootObject() requests, thus a failed connection
-        # would not cause the failure of getRootObject(), which would hang
-        # forever.
-        # The endpoint does call the protocol's connectionLost(), so a protocol
-        # that calls the factory's clientConnectionLost() seems to solve this
-        # problem.
-        factory = pb.PBClientFactory(security=jelly.DummySecurityOptions())
-        factory.protocol = PBBrokerForEndpoint
-        yield self._client_endpoint.connect(factory)
-
-        root = yield factory.getRootObject()
-        self._browser = yield root.callRemote('open_browser',
-                                              downloader=self._downloader,
-                                              options=self.browser_options)
+        self._downloader = BrowserRequestDownloader(
+            self._crawler, concurrency=subresource_concurrency,
+            shared_memory=shared_memory, compression=self._compression,
+            cache=subresource_cache, coalesce=coalesce_requests,
+            cookie_jars=(self.cookies_mw.jars if self.cookies_mw else None)
+        )
+        # Whether redirects of page resources are followed by Scrapy.
+        self.follow_redirects = follow_redirects
+        engine_options = self.browser_options
+        if shared_memory:
+            engine_options = dict(engine_options, shared_memory=True)
+        self._engine_pool = BrowserEnginePool(
+            (BrowserEngine(endpoint, self._downloader, engine_options,
+                           compression_options)
+             for endpoint in client_endpoints),
+            max_pages=max_pages_per_engine,
+            max_rss=max_engine_rss,
+            stats=self._crawler.stats
+        )
+        self._memory_check = LoopingCall(self._engine_pool.check_memory_usage)
+        self._memory_check_interval = memory_check_interval
+
+        if autothrottle_options is not None:
+            min_pages = autothrottle_options.get('min_pages', 1)
+            max_pages = autothrottle_options.get('max_pages', 16)
+            self._semaphore = AdjustableSemaphore(
+                max(min_pages, min(page_limit or max_pages, max_pages)),
+                waiting_callback=self._pages_waiting_changed
+            )
+            self._autothrottle = PageLimitAutoThrottle(
+                self._semaphore, self._engine_pool, stats=self._crawler.stats,
+                **autothrottle_options
+            )
+        else:
+            if page_limit:
+                self._semaphore = PrioritySemaphore(
+                    page_limit, waiting_callback=self._pages_waiting_changed
+                )
+            else:
+                self._semaphore = DummySemaphore()
+            self._autothrottle = None
+        self._autothrottle_loop = LoopingCall(self._adjust_page_limit)
+        self._autothrottle_interval = autothrottle_interval
+
+        self._domain_page_limit = domain_page_limit
+        self._domain_semaphores = {}
+
+        self.render_timeout = render_timeout
+
+        # Pages held open by browser responses, closed when not used for
+        # page_idle_timeout seconds or, if evict_pages is true, in order of
+        # last use when pages wait for the page limit.
+        self._held_pages = HeldPages()
+        self.page_idle_timeout = page_idle_timeout
+        self.evict_pages = evict_pages
+        self._idle_page_check = LoopingCall(self._close_idle_pages)
+
+    def _engine_started(self):
+        if self._engine_pool.max_rss:
+            self._memory_check.start(self._memory_check_interval, now=False)
+        if self._autothrottle:
+            self._autothrottle_loop.start(self._autothrottle_interval,
+                                          now=False)
+        if self.page_idle_timeout:
+            self._idle_page_check.start(self.page_idle_timeout / 2,
+                                        now=False)
 
     def _engine_stopped(self):
+        for loop in (self._memory_check, self._autothrottle_loop,
+                     self._idle_page_check):
+            if loop.running:
+                loop.stop()
         # Must run after BrowserResponseTrackerMiddleware._spider_closed().
+        self._engine_pool.terminate()
+
+    @inlineCallbacks
+    def _adjust_page_limit(self):
+        # Errors must not stop the looping call.
         try:
-            self._browser.broker.transport.signalProcess("TERM")
-        except AttributeError:
-            pass
+            yield self._autothrottle.adjust()
+        except Exception:
+            logger.exception("Error adjusting page limit")
+
+    def _close_idle_pages(self):
+        for response in self._held_pages.pop_idle(self.page_idle_timeout):
+            self._evict_page(response, 'idle')
 
     @inlineCallbacks
-    def _get_browser(self):
-        if self._browser is None:
-            yield self._browser_init_lock.run(self._init_browser)
+    def _evict_page(self, response, reason):
+        logger.info(f"Closing webpage in response {response!r} ({reason})")
+        self._crawler.stats.inc_value(f'browser_engine/pages_evicted/{reason}')
+        try:
+            yield response.evict_webpage()
+        except Exception:
+            logger.exception("Error closing evicted webpage")
+
+    def _pages_waiting_changed(self, priority, num_waiting):
+        self._crawler.stats.set_value(
+            f'browser_engine/pages_waiting/priority/{priority}', num_waiting
+        )
+
+    def _page_loaded(self, result, start_time):
+        if self._autothrottle:
+            self._autothrottle.page_loaded(time.monotonic() - start_time)
+        return result
+
+    @staticmethod
+    def _get_slot_key(request):
+        # As in Scrapy's downloader.
+        if 'download_slot' in request.meta:
+            return request.meta['download_slot']
+        return urlparse_cached(request).hostname or ''
+
+    @inlineCallbacks
+    def _acquire_domain_slot(self, request, page_slot):
+        key = self._get_slot_key(request)
+        semaphore = self._domain_semaphores.get(key)
+        if semaphore is None:
+            semaphore = PrioritySemaphore(self._domain_page_limit)
+            self._domain_semaphores[key] = semaphore
+
+        yield semaphore.acquire(request.priority)
+
+        def release():
+            semaphore.release()
+            if semaphore.tokens == semaphore.limit:
+                del self._domain_semaphores[key]
+
+        page_slot.add(release)
+
+    @inlineCallbacks
+    def _acquire_page_slot(self, request):
+        page_slot = PageSlot()
+
+        try:
+            # Acquired before the global limit so that pages waiting for their
+            # domain do not take slots from other domains.
+            if self._domain_page_limit:
+                yield self._acquire_domain_slot(request, page_slot)
+
+            if self._autothrottle:
+                self._autothrottle.page_requested()
+            if self.evict_pages and self._semaphore.tokens <= 0:
+                response = self._held_pages.pop_least_recently_used()
+                if response is not None:
+                    self._evict_page(response, 'lru')
+            # Pages wait for the limit in order of request priority.
+            yield self._semaphore.acquire(request.priority)
+            page_slot.add(self._semaphore.release)
+
+            # XXX: ensure there is no communication between pages of a
+            #      browser. If not possible, open one browser per cookiejar
+            #      but also allow the user to have separate browsers on the
+            #      same cookiejar.
+            engine = self._engine_pool.open_page()
+            page_slot.add(engine.page_closed)
+            page_slot.engine = engine
+        except:
+            page_slot.release()
+            raise
 
-        return self._browser
+        return page_slot
 
     @inlineCallbacks
     def process_request(self, request, spider):
@@ -153,8 +392,6 @@ class BrowserMiddleware(object):
 
     @inlineCallbacks
     def _make_browser_request(self, request):
-        browser = yield self._get_browser()
-
         options = {
             'remote_request_counter': request.remote_counter,
             'user_agent': request.headers.get('User-Agent')
@@ -166,72 +403,251 @@ class BrowserMiddleware(object):
             options['cookiejar'] = cookiejar
         else:
             cookiejar = None
+        if 'browser_block' in request.meta:
+            options['block'] = request.meta['browser_block']
+        extract = request.meta.get('browser_extract')
+
+        load_options = {
+            'timeout': self._get_render_timeout(request),
+            'return_partial': request.meta.get(
+                'browser_render_timeout_partial', False
+            )
+        }
+
+        page_slot = yield self._acquire_page_slot(request)
+        # Pages with their own cookie jar would not have cookies for redirected
+        # requests.
+        if (self.follow_redirects and cookiejar is not None and
+                page_slot.engine.wire_version >= FOLLOW_REDIRECTS_VERSION):
+            options['follow_redirects'] = True
+
+        if not request.meta.get('browser_response', False):
+            try:
+                response = yield self._fetch_page(page_slot.engine, request,
+                                                  options, load_options,
+                                                  cookiejar, extract)
+            finally:
+                page_slot.release()
+            return response
 
-        yield self._semaphore.acquire()
+        # Once the page is loading, its result releases the slot and webpage.
+        webpage = None
         try:
+            browser = yield page_slot.engine.get_browser()
             webpage = yield browser.callRemote('create_webpage', options)
+
+            if cookiejar:
+                yield cookiejar.sync()
+                yield commit_remote_cookies(cookiejar, webpage)
+
+            remote_request, body = self._make_remote_request(
+                request, page_slot.engine
+            )
+            start_time = time.monotonic()
+            result = webpage.callRemote('load_request', remote_request,
+                                        **load_options)
         except:
-            self._semaphore.release()
+            page_slot.release()
+            if webpage is not None:
+                self._close_webpage(webpage)
             raise
-
-        if cookiejar:
-            yield cookiejar.sync()
-            yield webpage.callRemote('_commit_cookies')
-
-        result = webpage.callRemote('load_request',
-                                    RequestFromScrapy(request.url,
-                                                      request.method,
-                                                      request.headers,
-                                                      request.body))
-        result.addCallback(partial(self._handle_page_load, request, webpage,
-                                   cookiejar))
+        shared_memory_files.release_after(result, body)
+        self._add_render_timeout(result, load_options['timeout'])
+        result.addBoth(self._page_loaded, start_time)
+        result.addCallbacks(partial(self._handle_page_load, request, webpage,
+                                    page_slot, cookiejar, extract),
+                            partial(self._handle_page_load_failure, webpage,
+                                    page_slot))
         del webpage
         return (yield result)
 
+    def _make_remote_request(self, request, engine):
+        """
+
+        Make the message sending a request to a browser engine, returning it
+        with the encoded body, to be released once the request is sent.
+
+        """
+
+        if engine.wire_version >= COMPRESSION_VERSION:
+            compression = self._compression
+        else:
+            compression = None
+        body = encode_body(request.body, shared_memory=self.shared_memory,
+                           compression=compression)
+        remote_request = RequestFromScrapy(request.url, request.method,
+                                           request.headers, body)
+        return encode_message(remote_request, engine.wire_version), body
+
+    def _get_render_timeout(self, request):
+        return request.meta.get('browser_render_timeout',
+                                request.meta.get('download_timeout',
+                                                 self.render_timeout))
+
+    def _add_render_timeout(self, dfd, timeout):
+        """Stop waiting for a reply if the browser engine does not stop the
+        page on time."""
+        if timeout:
+            dfd.addTimeout(timeout + self.render_timeout_grace, reactor)
+
+    @staticmethod
+    def _engine_extracts(engine):
+        """Whether the browser engine can extract data from pages."""
+        return engine.wire_version >= EXTRACT_VERSION
+
+    @staticmethod
+    def _engine_sends_body_deltas(engine):
+        """Whether the browser engine can send page bodies as deltas."""
+        return engine.wire_version >= BODY_DELTAS_VERSION
+
+    @staticmethod
+    def _set_extracted(response, extract, extracted=None):
+        """
+
+        Keep the data extracted for a response in the browser_extracted meta
+        key, extracting it from the body if the browser engine did not.
+
+        """
+
+        if extracted is None:
+            extracted = extract_from_response(response, extract)
+        response.meta['browser_extracted'] = extracted
+
+    @staticmethod
+    def _load_error(exc):
+        if isinstance(exc, ScrapyNotSupported):
+            exc = NotSupported(*exc.args)
+        return exc
+
     @inlineCallbacks
-    def _handle_page_load(self, request, webpage, cookiejar, load_result):
-        if cookiejar:
-            yield sync_cookies(cookiejar, webpage)
+    def _fetch_page(self, engine, request, options, load_options, cookiejar,
+                    extract=None):
+        """
 
-        browser_response = request.meta.get('browser_response', False)
+        Load a page and get its contents (or, if extract is given and the
+        browser engine supports it, only the data extracted from it) in a
+        single remote call.
 
-        try:
-            ok, status, headers, exc = load_result
+        """
 
-            if ok:
-                if browser_response:
-                    respcls = BrowserResponse
-                else:
-                    respcls = HtmlResponse
+        browser = yield engine.get_browser()
 
-                url = yield webpage.callRemote('get_url')
-                encoding, body = yield webpage.callRemote('get_body')
-                response = respcls(status=status,
-                                   url=url,
-                                   headers=headers,
-                                   body=body,
-                                   encoding=encoding,
-                                   request=request)
-
-                if browser_response:
-                    response._webpage = PBReferenceMethodsWrapper(webpage)
-                    response._semaphore = self._semaphore
-                    response._cookiejar = cookiejar
+        if cookiejar:
+            yield cookiejar.sync()
 
-            else:
-                if isinstance(exc, ScrapyNotSupported):
-                    exc = NotSupported(*exc.args)
-                raise exc
+        fetch_options = dict(load_options)
+        extract_remotely = (extract is not None and
+                            self._engine_extracts(engine))
+        if extract_remotely:
+            fetch_options['extract'] = extract
+
+        remote_request, request_body = self._make_remote_request(request,
+                                                                 engine)
+        start_time = time.monotonic()
+        result = browser.callRemote('fetch', options, remote_request,
+                                    **fetch_options)
+        shared_memory_files.release_after(result, request_body)
+        self._add_render_timeout(result, load_options['timeout'])
+        result.addBoth(self._page_loaded, start_time)
+        ok, status, headers, exc, flags, url, *contents = yield result
+        if cookiejar:
+            # The browser engine ensures its cookie updates were sent before
+            # replying, so they are kept even if the body cannot be read.
+            cookiejar.commit()
 
-        except Exception as err:
-            browser_response = False
-            response = Failure(err)
+        if extract_remotely:
+            encoding, body = 'utf-8', b''
+            extracted, = contents
+        else:
+            encoding, body = contents
+            body = yield read_body(body, self._compression)
+            extracted = None
+
+        if not ok:
+            raise self._load_error(exc)
+
+        response = HtmlResponse(status=status, url=url, headers=headers,
+                                body=body, encoding=encoding, flags=flags,
+                                request=request)
+        if extract is not None:
+            self._set_extracted(response, extract, extracted)
+        return response
+
+    def _handle_page_load_failure(self, webpage, page_slot, failure):
+        # The page may still be loading in the browser engine (if it did not
+        # reply on time), but its slot is released immediately.
+        page_slot.release()
+        self._close_webpage(webpage)
+        return failure
+
+    @staticmethod
+    def _close_webpage(webpage):
+        webpage.callRemote('close').addErrback(
+            lambda f: logger.debug(f"Error closing webpage: {f.value!r}")
+        )
 
-        finally:
-            if not browser_response:
-                try:
-                    yield webpage.callRemote('close')
-                finally:
-                    self._semaphore.release()
+    @inlineCallbacks
+    def _handle_page_load(self, request, webpage, page_slot, cookiejar,
+                          extract, load_result):
+        # Only pages kept open by their browser response are loaded with
+        # load_request (see _fetch_page).
+        try:
+            if cookiejar:
+                # Browser engines sync cookies before replying to
+                # load_request.
+                yield sync_cookies(cookiejar, webpage, remote_synced=True)
+
+            ok, status, headers, exc, flags = load_result
+            if not ok:
+                raise self._load_error(exc)
+
+            engine = page_slot.engine
+            extract_remotely = (extract is not None and
+                                self._engine_extracts(engine))
+            body_deltas = self._engine_sends_body_deltas(engine)
+            body_version = None
+            url = yield webpage.callRemote('get_url')
+            if extract_remotely:
+                encoding, body = 'utf-8', b''
+                extracted = yield webpage.callRemote('extract', extract)
+            elif body_deltas:
+                # Later updates of the body are sent as deltas from it.
+                body_version, encoding, delta = yield webpage.callRemote(
+                    'get_body_delta'
+                )
+                # The first delta has the whole body.
+                body = yield read_body(delta[2], self._compression)
+                extracted = None
+            else:
+                encoding, body = yield webpage.callRemote('get_body')
+                body = yield read_body(body, self._compression)
+                extracted = None
+            response = BrowserResponse(status=status,
+                                       url=url,
+                                       headers=headers,
+                                       body=body,
+                                       encoding=encoding,
+                                       flags=flags,
+                                       request=request)
+            if extract is not None:
+                self._set_extracted(response, extract, extracted)
+
+        except Exception:
+            try:
+                yield webpage.callRemote('close')
+            finally:
+                page_slot.release()
+            raise
 
+        # The page is closed and its slot released with the response.
+        response._webpage = PBReferenceMethodsWrapper(webpage)
+        response._page_slot = page_slot
+        response._cookiejar = cookiejar
+        response._engine_extracts = self._engine_extracts(engine)
+        response._body_deltas = body_deltas
+        response._body_version = body_version
+        response._compression = self._compression
+        key = self._held_pages.add(response)
+        response._on_use = partial(self._held_pages.touch, key)
+        page_slot.add(partial(self._held_pages.discard, key))
         return response
@@ -0,0 +1,110 @@
+import logging
+
+from twisted.internet.defer import inlineCallbacks
+
+
+logger = logging.getLogger(__name__)
+
+
+class PageLimitAutoThrottle(object):
+    """
+
+    Adjusts the limit of open pages, similarly to Scrapy's AutoThrottle
+    extension.
+
+    The limit is lowered when pages take longer than target_latency seconds to
+    load, or when a browser engine lags more than max_loop_lag seconds running
+    its event loop or uses more than max_rss bytes of memory. Otherwise, it is
+    raised when pages are waiting for the limit.
+
+    """
+
+    def __init__(self, semaphore, engine_pool, stats=None, min_pages=1,
+                 max_pages=16, target_latency=10.0, max_loop_lag=0.5,
+                 max_rss=0):
+        super().__init__()
+        self._semaphore = semaphore
+        self._engine_pool = engine_pool
+        self._stats = stats
+        self.min_pages = min_pages
+        self.max_pages = max_pages
+        self.target_latency = target_latency
+        self.max_loop_lag = max_loop_lag
+        self.max_rss = max_rss
+        self._latencies = []
+        self._saturated = False
+
+    def page_requested(self):
+        if self._semaphore.tokens <= 0:
+            self._saturated = True
+
+    def page_loaded(self, latency):
+        self._latencies.append(latency)
+
+    @inlineCallbacks
+    def _get_engines_load(self):
+        loop_lag = 0
+        rss = 0
+        for engine in list(self._engine_pool.engines):
+            if engine.root is None:
+                continue
+            try:
+                status = yield engine.get_status()
+            except Exception:
+                logger.exception(f"Error getting status of browser engine "
+                                 f"{engine!r}")
+                continue
+            loop_lag = max(loop_lag, status['loop_lag'])
+            rss = max(rss, status['memory_usage'])
+        return loop_lag, rss
+
+    @inlineCallbacks
+    def adjust(self):
+        latencies = self._latencies
+        self._latencies = []
+        saturated = self._saturated or bool(self._semaphore.waiting)
+        self._saturated = False
+
+        loop_lag, rss = yield self._get_engines_load()
+        if latencies:
+            latency = sum(latencies) / len(latencies)
+        else:
+            latency = None
+
+        if loop_lag > self.max_loop_lag:
+            reason = 'loop_lag'
+        elif self.max_rss and rss > self.max_rss:
+            reason = 'memory_usage'
+        elif latency is not None and latency > self.target_latency:
+            reason = 'latency'
+        else:
+            reason = None
+
+        limit = self._semaphore.limit
+        if reason:
+            new_limit = max(self.min_pages, min(limit - 1, int(limit * 0.75)))
+        elif saturated and latency is not None:
+            new_limit = min(self.max_pages, limit + 1)
+        else:
+            new_limit = limit
+
+        if new_limit != limit:
+            if new_limit < limit:
+                logger.debug(f"Lowering page limit from {limit} to "
+                             f"{new_limit} ({reason}: latency {latency}, "
+                             f"loop lag {loop_lag}, memory usage {rss})")
+                self._inc_stats(f'browser_engine/autothrottle/'
+                                f'decreased/{reason}')
+            else:
+                logger.debug(f"Raising page limit from {limit} to "
+                             f"{new_limit} (latency {latency})")
+                self._inc_stats('browser_engine/autothrottle/increased')
+            self._semaphore.set_limit(new_limit)
+
+        if self._stats:
+            self._stats.set_value('browser_engine/autothrottle/page_limit',
+                                  new_limit)
+
+    def _inc_stats(self, key):
+        if self._stats:
+            self._stats.inc_value(key)
@@ -0,0 +1,184 @@
+from collections import OrderedDict
+from email.utils import formatdate
+
+from scrapy import signals
+from scrapy.extensions.httpcache import RFC2616Policy
+from scrapy.utils.misc import load_object
+from scrapy.utils.request import request_fingerprint
+from twisted.internet.defer import inlineCallbacks
+
+
+class SubresourceCache(object):
+    """
+
+    Cache of responses to requests made by browser engines for page resources,
+    shared by all pages.
+
+    Responses are cached as allowed by HTTP caching headers, except those that
+    are private to a client (e.g. that set cookies, or to requests with cookies
+    or credentials). They are kept in memory up to max_size bytes, evicting the
+    least recently used ones first, and optionally in a Scrapy HTTP cache
+    storage.
+
+    """
+
+    def __init__(self, policy, max_size, storage=None, stats=None):
+        super().__init__()
+        self.policy = policy
+        self.max_size = max_size
+        self.storage = storage
+        self.size = 0
+        self._responses = OrderedDict()
+        self._stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+
+        cache_dir = settings.get('BROWSER_ENGINE_CACHE_DIR')
+        if cache_dir:
+            storage_settings = settings.copy()
+            storage_settings.set('HTTPCACHE_DIR', cache_dir)
+            storage_cls = load_object(settings.get(
+                'BROWSER_ENGINE_CACHE_STORAGE',
+                'scrapy.extensions.httpcache.FilesystemCacheStorage'
+            ))
+            storage = storage_cls(storage_settings)
+        else:
+            storage = None
+
+        cache = cls(
+            RFC2616Policy(settings),
+            settings.getint('BROWSER_ENGINE_CACHE_SIZE_MB', 64) * 1024 * 1024,
+            storage=storage,
+            stats=crawler.stats
+        )
+        if storage is not None:
+            crawler.signals.connect(cache._spider_opened,
+                                    signal=signals.spider_opened)
+            crawler.signals.connect(cache._spider_closed,
+                                    signal=signals.spider_closed)
+        return cache
+
+    def _spider_opened(self, spider):
+        self.storage.open_spider(spider)
+
+    def _spider_closed(self, spider):
+        self.storage.close_spider(spider)
+
+    def _inc_stat(self, key):
+        if self._stats is not None:
+            self._stats.inc_value(f'browser_engine/cache/{key}')
+
+    # Headers of requests whose responses may be specific to a cookie jar or
+    # user, which cached responses (by request fingerprint, ignoring headers)
+    # would be shared between.
+    private_request_headers = (b'Authorization', b'Cookie')
+
+    def should_cache_request(self, request):
+        if any(name in request.headers
+               for name in self.private_request_headers):
+            return False
+        # Main documents are requested once for each page.
+        return (request.method == 'GET' and
+                not request.meta.get('browser_page_first_request') and
+                self.policy.should_cache_request(request))
+
+    def should_cache_response(self, response, request):
+        cache_control = response.headers.get(b'Cache-Control', b'').lower()
+        if b'private' in cache_control or b'Set-Cookie' in response.headers:
+            return False
+        # Responses are not stored for each variant.
+        vary = response.headers.getlist(b'Vary')
+        if any(v.strip().lower() != b'accept-encoding'
+               for value in vary for v in value.split(b',')):
+            return False
+        return self.policy.should_cache_response(response, request)
+
+    @staticmethod
+    def _response_size(response):
+        return (len(response.body) + len(response.url) +
+                sum(len(name) + sum(map(len, values))
+                    for name, values in response.headers.items()))
+
+    def get(self, request, spider):
+        """Return the cached response to a request, or None."""
+        key = request_fingerprint(request)
+        entry = self._responses.get(key)
+        if entry is not None:
+            self._responses.move_to_end(key)
+            return entry[0]
+
+        if self.storage is not None:
+            response = self.storage.retrieve_response(spider, request)
+            if response is not None:
+                self._inc_stat('disk_hit')
+                self._add(key, response)
+                return response
+
+    @inlineCallbacks
+    def fetch(self, request, spider, download):
+        """
+
+        Get the response to a request from the cache if fresh, or else with
+        download(request), revalidating or caching the downloaded response.
+
+        """
+
+        if not self.should_cache_request(request):
+            return (yield download(request))
+
+        cached_response = self.get(request, spider)
+        if cached_response is None:
+            self._inc_stat('miss')
+        elif self.policy.is_cached_response_fresh(cached_response, request):
+            self._inc_stat('hit')
+            return cached_response
+        # Otherwise, conditional request headers were set from the stale
+        # cached response.
+
+        response = yield download(request)
+
+        # As in Scrapy's HTTP cache middleware.
+        if 'Date' not in response.headers:
+            response.headers['Date'] = formatdate(usegmt=True)
+
+        if cached_response is not None:
+            if self.policy.is_cached_response_valid(cached_response, response,
+                                                    request):
+                self._inc_stat('revalidated')
+                return cached_response
+            self._inc_stat('invalidated')
+
+        self.store(request, response, spider)
+        return response
+
+    def store(self, request, response, spider):
+        if not self.should_cache_response(response, request):
+            self._inc_stat('uncacheable')
+            return
+        self._inc_stat('stored')
+        self._add(request_fingerprint(request), response)
+        if self.storage is not None:
+            self.storage.store_response(spider, request, response)
+
+    def _add(self, key, response):
+        size = self._response_size(response)
+        if size > self.max_size:
+            return
+
+        old_entry = self._responses.pop(key, None)
+        if old_entry is not None:
+            self.size -= old_entry[1]
+        self._responses[key] = (response, size)
+        self.size += size
+
+        while self.size > self.max_size:
+            old_key, (old_response, old_size) = self._responses.popitem(
+                last=False
+            )
+            self.size -= old_size
+            self._inc_stat('evicted')
+
+        if self._stats is not None:
+            self._stats.set_value('browser_engine/cache/size', self.size)
@@ -29,11 +29,23 @@ class RemotelyAccessibleCookiesMiddleware(CookiesMiddleware):
 
 
 @inlineCallbacks
-def sync_cookies(cookiejar, webpage):
+def commit_remote_cookies(cookiejar, webpage):
+    """Commit the cookie updates sent to the browser engine of a webpage,
+    unless there are none since its last commit."""
+    version = cookiejar.remote_version(webpage.broker)
+    if version > cookiejar.committed_remote_version(webpage.broker):
+        yield webpage.callRemote('_commit_cookies')
+        cookiejar.remote_committed(webpage.broker, version)
+
+
+@inlineCallbacks
+def sync_cookies(cookiejar, webpage, remote_synced=False):
     # Sync and commit cookie updates from browser engine first, so that
-    # they prevail over cookie updates from the Scrapy side.
-    yield webpage.callRemote('_sync_cookies')
+    # they prevail over cookie updates from the Scrapy side. If remote_synced
+    # is true, the browser engine synced them before its last reply.
+    if not remote_synced:
+        yield webpage.callRemote('_sync_cookies')
     cookiejar.commit()
 
     yield cookiejar.sync()
-    yield webpage.callRemote('_commit_cookies')
+    yield commit_remote_cookies(cookiejar, webpage)
@@ -1,15 +1,24 @@
 import logging
+from urllib.parse import urljoin, urlsplit
 
 from scrapy import Request, signals
 from scrapy.exceptions import IgnoreRequest, NotSupported
+from scrapy.http import Response
 from scrapy.utils.datatypes import CaselessDict
-from twisted.internet.defer import Deferred
+from scrapy.utils.log import logformatter_adapter
+from twisted.internet.defer import (Deferred, DeferredSemaphore,
+                                    inlineCallbacks)
 from twisted.internet.error import ConnectionAborted
 from twisted.python.failure import Failure
 from twisted.spread import pb
+from w3lib.url import safe_url_string
 
+from .._bodies import encode_body, read_body
 from .._intermediaries import (ResponseFromScrapy, ScrapyIgnoreRequest,
                                ScrapyNotSupported)
+from .._wire import (COMPRESSION_VERSION, decode_message, encode_message,
+                     message_version)
+from .utils import DummySemaphore
 
 
 logger = logging.getLogger(__name__)
@@ -23,19 +32,50 @@ class _BrowserDownloadRequest(Request):
 
 
 class BrowserRequestDownloader(pb.Referenceable, object):
-    def __init__(self, crawler):
+    """
+
+    Downloads requests from browser engines.
+
+    Requests are given directly to Scrapy's downloader, passing through
+    downloader middlewares but not through the scheduler, so that they are not
+    queued behind the browser requests waiting for them. At most concurrency
+    of them are downloaded at the same time. While being downloaded, they
+    count towards CONCURRENT_REQUESTS, delaying requests from the scheduler,
+    and are subject to the limits of their download slots. If a cache (a
+    SubresourceCache) is given, cached responses are returned without
+    downloading. If coalesce is true, identical requests for page resources
+    made while one of them is being downloaded get the response to that one.
+    Redirects of requests for page resources are followed here when the
+    browser engine asks for it, taking cookies for each redirected request
+    from cookie_jars (the jars of the cookies middleware, by key).
+
+    """
+
+    # Headers not taken into account when coalescing requests, which differ
+    # between pages requesting the same resource.
+    coalesce_ignored_headers = {b'referer'}
+
+    redirect_statuses = {301, 302, 303, 307, 308}
+
+    def __init__(self, crawler, concurrency=16, shared_memory=False,
+                 compression=None, cache=None, coalesce=False,
+                 cookie_jars=None):
         super().__init__()
         self.crawler = crawler
-        self.crawler.signals.connect(self._handle_request_dropped,
-                                     signals.request_dropped)
-
-    @staticmethod
-    def _handle_request_dropped(request):
-        if request.meta.get('from_browser', False):
-            logger.error(("Request {!r} for browser engine dropped by Scrapy "
-                          "scheduler.").format(request))
+        self.cookie_jars = cookie_jars
+        self.shared_memory = shared_memory
+        self.compression = compression
+        self.cache = cache
+        self.coalesce = coalesce
+        # Deferreds waiting for the response to a request being downloaded,
+        # by coalescing key.
+        self._in_flight = {}
+        if concurrency:
+            self._semaphore = DeferredSemaphore(concurrency)
+        else:
+            self._semaphore = DummySemaphore()
 
-    def _make_scrapy_request(self, request_from_browser, callback, errback):
+    def _make_scrapy_request(self, request_from_browser):
         headers = CaselessDict(request_from_browser.headers)
         # Scrapy will set Content-Length if it is needed.
         headers.pop(b'Content-Length', None)
@@ -44,7 +84,8 @@ class BrowserRequestDownloader(pb.Referenceable, object):
         # requests from it.
 
         meta = {
-            # XXX: could handle redirects on this side to avoid round-trips.
+            # Redirects are followed by the browser engine, or by
+            # _follow_redirects if it asks for it.
             'dont_redirect': True,
             'handle_httpstatus_all': True,
             'from_browser': True,
@@ -52,18 +93,16 @@ class BrowserRequestDownloader(pb.Referenceable, object):
             'dont_merge_cookies': True
         }
 
-        # TODO: increase priority.
         return _BrowserDownloadRequest(
             url=request_from_browser.url,
             method=request_from_browser.method,
             headers=headers,
             body=request_from_browser.body,
             dont_filter=True,
-            meta=meta,
-            callback=callback,
-            errback=errback
+            meta=meta
         )
 
+    @inlineCallbacks
     def remote_make_request(self, request_from_browser):
         engine = self.crawler.engine
         if not engine.running:
@@ -73,17 +112,178 @@ class BrowserRequestDownloader(pb.Referenceable, object):
         if spider not in engine.open_spiders:
             raise ConnectionAborted("Spider closed")
 
-        dfd = Deferred()
-        dfd.addCallbacks(self.process_response, self.process_failure)
-        scrapy_req = self._make_scrapy_request(request_from_browser,
-                                               dfd.callback, dfd.errback)
-        assert scrapy_req.dont_filter
-        engine.crawl(scrapy_req, spider)
-        return dfd
+        # The response is encoded as the request was, since the engine sent it
+        # in the negotiated encoding.
+        wire_version = message_version(request_from_browser)
+        request_from_browser = decode_message(request_from_browser)
+        request_from_browser.body = yield read_body(
+            request_from_browser.body, self.compression
+        )
+        scrapy_req = self._make_scrapy_request(request_from_browser)
+        dfd = self._coalesced_fetch(request_from_browser, scrapy_req)
+        dfd.addCallbacks(self.process_response, self.process_failure,
+                         callbackArgs=(wire_version,))
+        response = yield dfd
+        return encode_message(response, wire_version)
+
+    def _coalescing_key(self, request_from_browser):
+        if (request_from_browser.method != 'GET' or
+                request_from_browser.body or
+                request_from_browser.is_first_request):
+            return None
+        headers = []
+        for name, values in request_from_browser.headers.items():
+            if name.lower() in self.coalesce_ignored_headers:
+                continue
+            if isinstance(values, bytes):
+                values = (values,)
+            headers.append((name.lower(), tuple(values)))
+        return (request_from_browser.url, request_from_browser.cookiejarkey,
+                self._follows_redirects(request_from_browser),
+                frozenset(headers))
+
+    def _coalesced_fetch(self, request_from_browser, request):
+        key = None
+        if self.coalesce:
+            key = self._coalescing_key(request_from_browser)
+        if key is None:
+            return self._fetch_resource(request_from_browser, request)
+
+        waiting = self._in_flight.get(key)
+        if waiting is not None:
+            self.crawler.stats.inc_value('browser_engine/coalesced')
+            dfd = Deferred()
+            waiting.append(dfd)
+            return dfd
+
+        waiting = self._in_flight[key] = []
+
+        def downloaded(result):
+            del self._in_flight[key]
+            for dfd in waiting:
+                dfd.callback(result)
+            return result
+
+        return self._fetch_resource(request_from_browser,
+                                    request).addBoth(downloaded)
+
+    @staticmethod
+    def _follows_redirects(request_from_browser):
+        # Engines not supporting it send requests without the attribute.
+        return (getattr(request_from_browser, 'follow_redirects', False) and
+                not request_from_browser.is_first_request)
+
+    def _fetch_resource(self, request_from_browser, request):
+        if self._follows_redirects(request_from_browser):
+            return self._follow_redirects(request,
+                                          request_from_browser.cookiejarkey)
+        return self._fetch(request)
+
+    @inlineCallbacks
+    def _follow_redirects(self, request, cookiejarkey):
+        """
+
+        Fetch a request following its redirects, up to REDIRECT_MAX_TIMES,
+        saving the browser engine a round trip for each of them.
+
+        """
+
+        max_redirects = self.crawler.settings.getint('REDIRECT_MAX_TIMES')
+        response = yield self._fetch(request)
+        redirects = 0
+        while redirects < max_redirects:
+            request = self._redirect_request(request, response, cookiejarkey)
+            if request is None:
+                break
+            redirects += 1
+            response = yield self._fetch(request)
+        if redirects:
+            self.crawler.stats.inc_value('browser_engine/redirect/followed',
+                                         redirects)
+        return response
+
+    def _redirect_request(self, request, response, cookiejarkey):
+        """
+
+        Make the request following a redirect response, or return None if the
+        response is to be given to the browser engine.
+
+        """
+
+        if response.status not in self.redirect_statuses:
+            return None
+        location = response.headers.get(b'Location')
+        # Cookies set by redirects are left for the browser engine to store,
+        # following the redirect itself.
+        if not location or b'Set-Cookie' in response.headers:
+            return None
+        url = urljoin(request.url, safe_url_string(location.decode('latin1')))
+        if urlsplit(url).scheme not in {'http', 'https'}:
+            return None
+
+        # As done by browsers.
+        if ((response.status in {301, 302} and request.method == 'POST') or
+                (response.status == 303 and request.method != 'HEAD')):
+            redirected = request.replace(url=url, method='GET', body=b'')
+            redirected.headers.pop(b'Content-Type', None)
+        else:
+            redirected = request.replace(url=url)
+        if urlsplit(url).hostname != urlsplit(request.url).hostname:
+            redirected.headers.pop(b'Authorization', None)
+
+        redirected.headers.pop(b'Cookie', None)
+        if self.cookie_jars is not None:
+            self.cookie_jars[cookiejarkey].add_cookie_header(redirected)
+        return redirected
+
+    def _fetch(self, request):
+        if self.cache is not None:
+            return self.cache.fetch(request, self.crawler.spider,
+                                    self._limited_download)
+        return self._limited_download(request)
+
+    def _limited_download(self, request):
+        return self._semaphore.run(self._download, request,
+                                   self.crawler.spider)
+
+    @inlineCallbacks
+    def _download(self, request, spider):
+        engine = self.crawler.engine
+        try:
+            result = request
+            # Downloader middlewares may return a new request (e.g. a retry).
+            while isinstance(result, Request):
+                request = result
+                result = yield engine.downloader.fetch(request, spider)
+        finally:
+            # The scheduler may have been waiting for downloads to finish.
+            slot = getattr(engine, 'slot', None)
+            if slot is not None:
+                slot.nextcall.schedule()
+
+        # As done by Scrapy's engine for downloaded responses.
+        if isinstance(result, Response):
+            result.request = request
+            logkws = self.crawler.logformatter.crawled(request, result, spider)
+            if logkws is not None:
+                logger.log(*logformatter_adapter(logkws),
+                           extra={'spider': spider})
+            self.crawler.signals.send_catch_log(
+                signal=signals.response_received, response=result,
+                request=request, spider=spider
+            )
+
+        return result
 
-    def process_response(self, response):
+    def process_response(self, response, wire_version=0):
+        if wire_version >= COMPRESSION_VERSION:
+            compression = self.compression
+        else:
+            compression = None
+        body = encode_body(response.body, shared_memory=self.shared_memory,
+                           compression=compression)
         return ResponseFromScrapy(response.url, response.status,
-                                  response.headers, response.body)
+                                  response.headers, body)
 
     scrapy_exceptions = {IgnoreRequest: ScrapyIgnoreRequest,
                          NotSupported: ScrapyNotSupported}
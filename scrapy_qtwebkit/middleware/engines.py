@@ -0,0 +1,190 @@
+import logging
+from operator import attrgetter
+
+from twisted.internet.defer import DeferredLock, inlineCallbacks
+from twisted.spread import jelly, pb
+
+from .._wire import (COMPRESSION_VERSION, negotiate_version,
+                     set_broker_version)
+from .utils import PBBrokerForEndpoint
+
+
+logger = logging.getLogger(__name__)
+
+
+class BrowserEngine(object):
+    """A browser engine server, connected to on first use."""
+
+    def __init__(self, endpoint, downloader, browser_options=None,
+                 compression_options=None):
+        super().__init__()
+        self.endpoint = endpoint
+        self.downloader = downloader
+        self.browser_options = (browser_options or {})
+        # Options for the engine to compress the bodies it sends, if it
+        # supports compressed bodies.
+        self.compression_options = compression_options
+        self.root = None
+        self.browser = None
+        # Encoding version of messages sent to the engine.
+        self.wire_version = 0
+        self.open_pages = 0
+        self.total_pages = 0
+        self.draining = False
+        self._init_lock = DeferredLock()
+
+    def __repr__(self):
+        return "<BrowserEngine {!r} ({} open pages)>".format(self.endpoint,
+                                                             self.open_pages)
+
+    @inlineCallbacks
+    def _init_browser(self):
+        if self.browser is not None:
+            return
+
+        # The endpoint does not call the factory's clientConnectionLost()
+        # method. PBClientFactory relies on this method being called in order
+        # to fail pending getRootObject() requests, thus a failed connection
+        # would not cause the failure of getRootObject(), which would hang
+        # forever.
+        # The endpoint does call the protocol's connectionLost(), so a protocol
+        # that calls the factory's clientConnectionLost() seems to solve this
+        # problem.
+        factory = pb.PBClientFactory(security=jelly.DummySecurityOptions())
+        factory.protocol = PBBrokerForEndpoint
+        yield self.endpoint.connect(factory)
+
+        root = yield factory.getRootObject()
+
+        try:
+            engine_versions = yield root.callRemote('get_wire_versions')
+        except pb.RemoteError:
+            # Older engines only support jelly.
+            engine_versions = ()
+        wire_version = negotiate_version(engine_versions)
+        # For objects sent through the connection, such as cookie jars.
+        set_broker_version(root.broker, wire_version)
+        options = self.browser_options
+        if wire_version:
+            options = dict(options, wire_version=wire_version)
+        if (wire_version >= COMPRESSION_VERSION and
+                self.compression_options is not None):
+            options = dict(options, compression=self.compression_options)
+
+        self.browser = yield root.callRemote('open_browser',
+                                             downloader=self.downloader,
+                                             options=options)
+        self.root = root
+        self.wire_version = wire_version
+
+    @inlineCallbacks
+    def get_browser(self):
+        if self.browser is None:
+            yield self._init_lock.run(self._init_browser)
+
+        return self.browser
+
+    def get_memory_usage(self):
+        """Resident set size of the engine process, in bytes."""
+        return self.root.callRemote('get_memory_usage')
+
+    def get_status(self):
+        """Memory usage and event loop lag of the engine process."""
+        return self.root.callRemote('get_status')
+
+    def page_opened(self):
+        self.open_pages += 1
+        self.total_pages += 1
+
+    def page_closed(self):
+        self.open_pages -= 1
+        if self.draining and not self.open_pages:
+            logger.info(f"Terminating drained browser engine {self!r}")
+            self.terminate()
+
+    def drain(self):
+        """Terminate the engine once its last open page is closed."""
+        self.draining = True
+        if not self.open_pages:
+            self.terminate()
+
+    def terminate(self):
+        """Terminate a started engine, or disconnect from a remote engine."""
+        if self.browser is None:
+            return
+        transport = self.browser.broker.transport
+        try:
+            transport.signalProcess("TERM")
+        except AttributeError:
+            transport.loseConnection()
+
+    def recycled(self):
+        """Make a new engine to replace this one."""
+        # Connecting to a process endpoint starts a new process.
+        return self.__class__(self.endpoint, self.downloader,
+                              self.browser_options, self.compression_options)
+
+
+class BrowserEnginePool(object):
+    """
+
+    Browser engines among which pages are distributed.
+
+    Engines are recycled (replaced by new ones, and terminated once their open
+    pages are closed) after opening max_pages pages or using more than max_rss
+    bytes of memory.
+
+    """
+
+    def __init__(self, engines, max_pages=0, max_rss=0, stats=None):
+        super().__init__()
+        self.engines = list(engines)
+        self.max_pages = max_pages
+        self.max_rss = max_rss
+        self._stats = stats
+        self._draining = set()
+
+    def least_loaded(self):
+        """Return the engine with the least open pages."""
+        return min(self.engines, key=attrgetter('open_pages'))
+
+    def open_page(self):
+        """Choose an engine for a new page and count the page as open on it."""
+        engine = self.least_loaded()
+        engine.page_opened()
+        if self.max_pages and engine.total_pages >= self.max_pages:
+            self.recycle(engine, 'max_pages')
+        return engine
+
+    def recycle(self, engine, reason):
+        if engine not in self.engines:
+            return
+        logger.info(f"Recycling browser engine {engine!r} ({reason})")
+        if self._stats:
+            self._stats.inc_value('browser_engine/recycled')
+            self._stats.inc_value(f'browser_engine/recycled/{reason}')
+
+        self.engines[self.engines.index(engine)] = engine.recycled()
+        self._draining = {e for e in self._draining if e.open_pages}
+        self._draining.add(engine)
+        engine.drain()
+
+    @inlineCallbacks
+    def check_memory_usage(self):
+        if not self.max_rss:
+            return
+        for engine in list(self.engines):
+            if engine.root is None:
+                continue
+            try:
+                rss = yield engine.get_memory_usage()
+            except Exception:
+                logger.exception(f"Error getting memory usage of browser "
+                                 f"engine {engine!r}")
+                continue
+            if rss > self.max_rss:
+                self.recycle(engine, 'max_rss')
+
+    def terminate(self):
+        for engine in self.engines + list(self._draining):
+            engine.terminate()
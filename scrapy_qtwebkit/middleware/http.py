@@ -2,6 +2,8 @@ from scrapy.http import HtmlResponse, Request
 from twisted.internet.defer import inlineCallbacks
 from twisted.spread import pb
 
+from .._bodies import apply_body_delta, read_body
+from .._extract import extract_from_response
 
 from .cookies import sync_cookies
 
@@ -38,22 +40,93 @@ class BrowserRequest(Request):
         return repr(self)
 
 
+class BrowserPageEvicted(ValueError):
+    """The webpage of a browser response was closed to free its resources."""
+
+
 class BrowserResponse(HtmlResponse):
+    _evicted = False
+    # Whether the browser engine can extract data from the webpage.
+    _engine_extracts = False
+    # Whether the browser engine sends the webpage body as deltas from the
+    # version of it in the response.
+    _body_deltas = False
+    _body_version = None
+    # Keeps stats of bodies received compressed (a BodyCompression).
+    _compression = None
+    # Called when the webpage is used.
+    _on_use = None
+
     @inlineCallbacks
     def update_body(self):
-        encoding, body = yield self.webpage.callRemote('get_body')
+        """
+
+        Update the body from the current state of the webpage. If the browser
+        engine supports it, only the changes to the body are transferred, and
+        the cached selector is kept if there are none.
+
+        """
+
+        if not self._body_deltas:
+            encoding, body = yield self.webpage.callRemote('get_body')
+            body = yield read_body(body, self._compression)
+            self._set_webpage_body(encoding, body)
+            return
+
+        version, encoding, delta = yield self.webpage.callRemote(
+            'get_body_delta', self._body_version
+        )
+        if delta is not None:
+            prefix, suffix, middle = delta
+            middle = yield read_body(middle, self._compression)
+            body = apply_body_delta(self.body, (prefix, suffix, middle))
+        self._body_version = version
+        if delta is not None and (body != self.body or
+                                  encoding != self._encoding):
+            self._set_webpage_body(encoding, body)
+
+    def _set_webpage_body(self, encoding, body):
         self._cached_benc = None
         self._cached_ubody = None
         self._cached_selector = None
         self._encoding = encoding
         self._set_body(body)
 
+    @inlineCallbacks
+    def extract(self, selectors):
+        """
+
+        Extract data from the current state of the webpage with a dict of
+        selectors by name, returning a dict of lists of strings by name. The
+        webpage body is not transferred unless the browser engine does not
+        support extraction, in which case the body is updated.
+
+        """
+
+        webpage = self.webpage
+        if self._engine_extracts:
+            return (yield webpage.callRemote('extract', selectors))
+        yield self.update_body()
+        return extract_from_response(self, selectors)
+
     @property
     def webpage(self):
         if self._webpage is None:
+            if self._evicted:
+                raise BrowserPageEvicted(
+                    "cannot access response webpage after it was closed for "
+                    "being idle or to free its page slot"
+                )
             raise ValueError("cannot access response webpage after closing")
+        if self._on_use is not None:
+            self._on_use()
         return self._webpage
 
+    def evict_webpage(self):
+        """Close the webpage, making later uses raise BrowserPageEvicted."""
+        self._evicted = True
+        return self.close_webpage()
+
     def sync_cookies(self):
         if self._cookiejar:
             return sync_cookies(self._cookiejar, self.webpage)
@@ -73,14 +146,14 @@ class BrowserResponse(HtmlResponse):
             else:
                 dfd_close = close_webpage(None)
 
-            semaphore = self._semaphore
-            self._semaphore = None
-            if semaphore:
-                def semaphore_release(v):
-                    semaphore.release()
+            page_slot = self._page_slot
+            self._page_slot = None
+            if page_slot:
+                def page_slot_release(v):
+                    page_slot.release()
                     return v
 
-                dfd_close.addBoth(semaphore_release)
+                dfd_close.addBoth(page_slot_release)
 
             return dfd_close
 
@@ -12,6 +12,15 @@ from .http import BrowserResponse
 logger = logging.getLogger(__name__)
 
 
+# Value for requests sent without browser responses in their meta.
+_NO_RESPONSES = ()
+
+# Types of meta values that cannot hold browser responses, skipped without
+# checking them against abstract collection types, which is much slower.
+_SCALAR_TYPES = frozenset({str, bytes, int, float, bool, type(None)})
+_COLLECTION_TYPES = frozenset({dict, list, tuple, set, frozenset})
+
+
 class DefaultWeakKeyDict(weakref.WeakKeyDictionary):
     def __init__(self, constructor):
         super().__init__()
@@ -45,29 +54,65 @@ class BrowserResponseTrackerMiddleware(object):
         super().__init__()
         self._responses_with_user = DefaultWeakKeyDict(int)
         self._responses_with_scrapy = DefaultWeakKeyDict(int)
+        # Browser responses counted in the meta of each request sent, to be
+        # uncounted when its response is received.
+        self._request_responses = weakref.WeakKeyDictionary()
         self._pending_close_requests = PendingDeferreds()
 
     def _spider_closed(self):
         return self._pending_close_requests.deferred()
 
-    def _get_browser_responses(self, values, seen_objects=()):
-        seen_objects += (values,)
+    def _get_browser_responses(self, values):
+        """Browser responses in a meta dict, at any depth."""
+        responses = []
+        self._add_browser_responses(values, responses, {id(values)})
+        return responses
+
+    def _add_browser_responses(self, values, responses, seen_ids):
         if isinstance(values, Mapping):
             values = list(values.values())
         for value in values:
-            if isinstance(value, BrowserResponse):
-                yield value
-            elif isinstance(value, Collection):
-                if value in seen_objects:
-                    continue
-                yield from self._get_browser_responses(value, seen_objects)
+            value_type = type(value)
+            if value_type in _SCALAR_TYPES:
+                continue
+            if value_type in _COLLECTION_TYPES or (
+                    isinstance(value, Collection) and
+                    not isinstance(value, (str, bytes, BrowserResponse))):
+                # Collections containing themselves are walked once.
+                if id(value) not in seen_ids:
+                    seen_ids.add(id(value))
+                    self._add_browser_responses(value, responses, seen_ids)
+            elif isinstance(value, BrowserResponse):
+                responses.append(value)
+
+    def _in_responses(self, response):
+        """
+
+        Browser responses given to the user with a response, as a WeakSet, or
+        _NO_RESPONSES if there are none.
+
+        """
+
+        request = response.request
+        in_responses = None
+        if request is not None:
+            in_responses = self._request_responses.pop(request, None)
+        if in_responses is None:
+            # Not sent from this spider (e.g. a start request or a copy of a
+            # request made by a downloader middleware).
+            in_responses = self._get_browser_responses(response.meta)
+            if in_responses:
+                in_responses = weakref.WeakSet(in_responses)
+            else:
+                in_responses = _NO_RESPONSES
+        return in_responses
 
     def process_spider_output(self, response, result, spider):
         if not response.meta.get('browser_response_track_active', True):
             yield from result
             return
 
-        in_responses = weakref.WeakSet()
+        in_responses = self._in_responses(response)
         if isinstance(response, BrowserResponse):
             # Add 1 when the response is sent from Scrapy (expected to happen
             # once, at the first time the response is seen).
@@ -75,10 +120,17 @@ class BrowserResponseTrackerMiddleware(object):
             # it will go back to 0; otherwise, it will stay at +1, but will go
             # to 0 once the user receives it again and does not send it back.
             self._responses_with_scrapy[response] += 1
+            if in_responses is _NO_RESPONSES:
+                in_responses = weakref.WeakSet()
             in_responses.add(response)
-        in_responses.update(self._get_browser_responses(response.meta))
         del response
 
+        # Only the counts of these responses change, so the others need not be
+        # checked for closing. Most callbacks involve none, so no sets are
+        # made for them.
+        touched_responses = (weakref.WeakSet(in_responses) if in_responses
+                             else None)
+
         for response in in_responses:
             self._responses_with_scrapy[response] -= 1
             self._responses_with_user[response] += 1
@@ -86,12 +138,18 @@ class BrowserResponseTrackerMiddleware(object):
 
         for r in result:
             if isinstance(r, Request):
-                out_responses = weakref.WeakSet(
-                    self._get_browser_responses(r.meta)
-                )
-                for response in out_responses:
-                    self._responses_with_scrapy[response] += 1
-                    del response
+                out_responses = self._get_browser_responses(r.meta)
+                if out_responses:
+                    out_responses = weakref.WeakSet(out_responses)
+                    self._request_responses[r] = out_responses
+                    if touched_responses is None:
+                        touched_responses = weakref.WeakSet()
+                    touched_responses.update(out_responses)
+                    for response in out_responses:
+                        self._responses_with_scrapy[response] += 1
+                        del response
+                else:
+                    self._request_responses[r] = _NO_RESPONSES
             yield r
             del r
 
@@ -99,8 +157,7 @@ class BrowserResponseTrackerMiddleware(object):
             self._responses_with_user[response] -= 1
             del response
 
-        for response in (weakref.WeakSet(self._responses_with_user.keys()) |
-                         weakref.WeakSet(self._responses_with_scrapy.keys())):
+        for response in touched_responses or ():
             scrapy_count = self._responses_with_scrapy[response]
             user_count = self._responses_with_user[response]
             if (scrapy_count + user_count) == 0:
@@ -1,4 +1,8 @@
-from twisted.internet.defer import succeed
+import time
+import weakref
+from collections import OrderedDict, deque
+
+from twisted.internet.defer import Deferred, DeferredSemaphore, succeed
 from twisted.spread import pb
 
 
@@ -34,8 +38,149 @@ class PBBrokerForEndpoint(pb.Broker):
 class DummySemaphore(object):
     tokens = 1
 
-    def acquire(self):
+    def acquire(self, priority=0):
         return succeed(self)
 
     def release(self):
         pass
+
+
+class PageSlot(object):
+    """Resources held by a browser page, released together when it closes."""
+
+    def __init__(self):
+        super().__init__()
+        self.engine = None
+        self._release_funcs = []
+
+    def add(self, release_func):
+        self._release_funcs.append(release_func)
+
+    def release(self):
+        release_funcs = self._release_funcs
+        self._release_funcs = []
+        for release_func in reversed(release_funcs):
+            release_func()
+
+
+class HeldPages(object):
+    """
+
+    Browser pages held open by responses, in order of last use.
+
+    Responses are referenced weakly, so that they can still close their pages
+    when deleted.
+
+    """
+
+    def __init__(self):
+        super().__init__()
+        # Time of last use, by weak reference to the response.
+        self._pages = OrderedDict()
+
+    def __len__(self):
+        return len(self._pages)
+
+    def add(self, response):
+        """Add a response, returning its key."""
+        key = weakref.ref(response)
+        self._pages[key] = time.monotonic()
+        return key
+
+    def touch(self, key):
+        """Mark the page of a response as used now."""
+        if key in self._pages:
+            self._pages[key] = time.monotonic()
+            self._pages.move_to_end(key)
+
+    def discard(self, key):
+        self._pages.pop(key, None)
+
+    def pop_least_recently_used(self):
+        """Remove and return the response least recently used, or None."""
+        while self._pages:
+            key, last_used = self._pages.popitem(last=False)
+            response = key()
+            if response is not None:
+                return response
+
+    def pop_idle(self, idle_timeout):
+        """Remove and return the responses not used for idle_timeout."""
+        now = time.monotonic()
+        responses = []
+        while self._pages:
+            key, last_used = next(iter(self._pages.items()))
+            if now - last_used < idle_timeout:
+                break
+            del self._pages[key]
+            response = key()
+            if response is not None:
+                responses.append(response)
+        return responses
+
+
+class PrioritySemaphore(DeferredSemaphore):
+    """
+
+    A DeferredSemaphore that gives tokens to waiters with higher priority
+    first, in order of arrival among waiters with the same priority.
+
+    waiting_callback, if given, is called with a priority and the number of
+    waiters with that priority whenever it changes.
+
+    """
+
+    def __init__(self, tokens, waiting_callback=None):
+        super().__init__(tokens)
+        self.waiting = {}
+        self.waiting_callback = waiting_callback
+
+    def _waiting_changed(self, priority):
+        num_waiting = len(self.waiting[priority])
+        if not num_waiting:
+            del self.waiting[priority]
+        if self.waiting_callback:
+            self.waiting_callback(priority, num_waiting)
+
+    def _cancelAcquire(self, d):
+        for priority, waiting in self.waiting.items():
+            if d in waiting:
+                waiting.remove(d)
+                self._waiting_changed(priority)
+                return
+
+    def _wake_waiting(self):
+        while self.tokens > 0 and self.waiting:
+            priority = max(self.waiting)
+            d = self.waiting[priority].popleft()
+            self._waiting_changed(priority)
+            self.tokens -= 1
+            d.callback(self)
+
+    def acquire(self, priority=0):
+        d = Deferred(canceller=self._cancelAcquire)
+        if self.tokens > 0:
+            self.tokens -= 1
+            d.callback(self)
+        else:
+            self.waiting.setdefault(priority, deque()).append(d)
+            self._waiting_changed(priority)
+        return d
+
+    def release(self):
+        self.tokens += 1
+        self._wake_waiting()
+
+
+class AdjustableSemaphore(PrioritySemaphore):
+    """A PrioritySemaphore whose limit can be changed while in use."""
+
+    def set_limit(self, limit):
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        # When the limit is lowered below the number of acquired tokens, tokens
+        # become negative and releases do not wake waiters until they are
+        # positive again.
+        self.tokens += limit - self.limit
+        self.limit = limit
+        self._wake_waiting()
@@ -0,0 +1,103 @@
+from scrapy import Request
+from scrapy.crawler import Crawler
+from scrapy.extensions.httpcache import RFC2616Policy
+from scrapy.http import Response
+from scrapy.settings import Settings
+from scrapy.spiders import Spider
+from twisted.internet.defer import inlineCallbacks, succeed
+from twisted.trial import unittest
+
+from scrapy_qtwebkit.middleware.cache import SubresourceCache
+
+
+class SubresourceCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.crawler = Crawler(Spider, Settings())
+        self.stats = self.crawler.stats
+        self.cache = SubresourceCache(RFC2616Policy(Settings()), 1024 * 1024,
+                                      stats=self.stats)
+        self.downloaded = []
+
+    def make_download(self, status=200, headers=None, body=b'body'):
+        def download(request):
+            self.downloaded.append(request)
+            return succeed(Response(request.url, status=status,
+                                    headers=headers, body=body))
+        return download
+
+    @staticmethod
+    def make_request(url='https://example.com/app.js', **meta):
+        return Request(url, meta=meta)
+
+    def fetch(self, download, request=None):
+        if request is None:
+            request = self.make_request()
+        return self.cache.fetch(request, None, download)
+
+    @inlineCallbacks
+    def test_fresh_hit(self):
+        download = self.make_download(headers={'Cache-Control': 'max-age=60'})
+        response_1 = yield self.fetch(download)
+        response_2 = yield self.fetch(download)
+        assert response_2 is response_1
+        assert len(self.downloaded) == 1
+        assert self.stats.get_value('browser_engine/cache/miss') == 1
+        assert self.stats.get_value('browser_engine/cache/hit') == 1
+
+    @inlineCallbacks
+    def test_revalidation(self):
+        download = self.make_download(headers={'ETag': '"v1"'})
+        response_1 = yield self.fetch(download)
+
+        download = self.make_download(status=304, body=b'')
+        response_2 = yield self.fetch(download)
+        assert response_2 is response_1
+        assert self.downloaded[1].headers[b'If-None-Match'] == b'"v1"'
+        assert self.stats.get_value('browser_engine/cache/revalidated') == 1
+
+    @inlineCallbacks
+    def test_uncacheable(self):
+        download = self.make_download(headers={'Cache-Control': 'max-age=60',
+                                               'Set-Cookie': 'a=1'})
+        yield self.fetch(download)
+        yield self.fetch(download)
+        assert len(self.downloaded) == 2
+
+        download = self.make_download(headers={'Cache-Control': 'max-age=60'})
+        request = self.make_request(browser_page_first_request=True)
+        yield self.fetch(download, request)
+        yield self.fetch(download, request)
+        assert len(self.downloaded) == 4
+
+    @inlineCallbacks
+    def test_private_request(self):
+        download = self.make_download(headers={'Cache-Control': 'max-age=60'})
+        for headers in ({'Cookie': 'session=a'}, {'Cookie': 'session=b'},
+                        {'Authorization': 'Basic YTpi'}):
+            request = Request('https://example.com/app.js', headers=headers)
+            yield self.fetch(download, request)
+        assert len(self.downloaded) == 3
+        assert not self.cache._responses
+
+        # Nor are responses to requests without them shared with those.
+        yield self.fetch(download)
+        yield self.fetch(download, Request('https://example.com/app.js',
+                                           headers={'Cookie': 'session=a'}))
+        assert len(self.downloaded) == 5
+
+    @inlineCallbacks
+    def test_eviction(self):
+        self.cache.max_size = 3000
+        download = self.make_download(headers={'Cache-Control': 'max-age=60'},
+                                      body=b'x' * 1000)
+        for i in range(3):
+            url = f'https://example.com/{i}'
+            yield self.fetch(download, self.make_request(url))
+        assert self.cache.size <= 3000
+        assert self.stats.get_value('browser_engine/cache/evicted') == 1
+
+        # The least recently used response was evicted.
+        yield self.fetch(download, self.make_request('https://example.com/1'))
+        assert len(self.downloaded) == 3
+        yield self.fetch(download, self.make_request('https://example.com/0'))
+        assert len(self.downloaded) == 4
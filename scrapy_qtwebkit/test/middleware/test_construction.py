@@ -1,13 +1,18 @@
 from unittest.mock import patch
 
+from scrapy.crawler import Crawler
 from scrapy.exceptions import NotConfigured
+from scrapy.settings import Settings
+from scrapy.spiders import Spider
 from twisted.internet import reactor
 from twisted.internet.defer import DeferredSemaphore
 
+from scrapy_qtwebkit.middleware import BrowserMiddleware
 from scrapy_qtwebkit.middleware.cookies import (
     RemotelyAccessibleCookiesMiddleware
 )
-from scrapy_qtwebkit.middleware.utils import DummySemaphore
+from scrapy_qtwebkit.middleware.utils import (AdjustableSemaphore,
+                                              DummySemaphore)
 
 from . import MiddlewareTest
 
@@ -86,8 +91,41 @@ class MiddlewareConstructionTest(MiddlewareTest):
                 'BROWSER_ENGINE_START_SERVER': True
             })
             assert not self.mock_clientFromString.called
-            assert mock_ProcessEndpoint.called
-            assert mw._client_endpoint == mock_ProcessEndpoint.return_value
+            assert mock_ProcessEndpoint.call_count == 1
+            assert ([e.endpoint for e in mw._engine_pool.engines] ==
+                    [mock_ProcessEndpoint.return_value])
+
+    def test_settings_start_server_count(self):
+        with self.patch_ProcessEndpoint() as mock_ProcessEndpoint:
+            mw = self.make_middleware({
+                'BROWSER_ENGINE_START_SERVER': 3
+            })
+            assert not self.mock_clientFromString.called
+            assert mock_ProcessEndpoint.call_count == 3
+            assert len(mw._engine_pool.engines) == 3
+
+    def test_settings_shared_memory(self):
+        with self.patch_ProcessEndpoint():
+            mw = self.make_middleware({
+                'BROWSER_ENGINE_START_SERVER': True
+            })
+            assert mw.shared_memory
+            assert mw._downloader.shared_memory
+            engine, = mw._engine_pool.engines
+            assert engine.browser_options['shared_memory']
+
+            mw = self.make_middleware({
+                'BROWSER_ENGINE_START_SERVER': True,
+                'BROWSER_ENGINE_SHARED_MEMORY': False
+            })
+            assert not mw.shared_memory
+
+        mw = self.make_middleware({
+            'BROWSER_ENGINE_SERVER': 'tcp:localhost:8000'
+        })
+        assert not mw.shared_memory
+        engine, = mw._engine_pool.engines
+        assert 'shared_memory' not in engine.browser_options
 
     def test_settings_server(self):
         with self.patch_ProcessEndpoint() as mock_ProcessEndpoint:
@@ -98,7 +136,43 @@ class MiddlewareConstructionTest(MiddlewareTest):
             assert not mock_ProcessEndpoint.called
             self.mock_clientFromString.assert_called_with(reactor,
                                                           'tcp:localhost:8000')
-            assert mw._client_endpoint == self.mock_endpoint
+            assert ([e.endpoint for e in mw._engine_pool.engines] ==
+                    [self.mock_endpoint])
+
+    def test_settings_server_list(self):
+        servers = ['tcp:localhost:8000', 'tcp:localhost:8001']
+        with self.patch_ProcessEndpoint() as mock_ProcessEndpoint:
+            mw = self.make_middleware({
+                'BROWSER_ENGINE_SERVER': servers
+            })
+
+            assert not mock_ProcessEndpoint.called
+            assert ([c[0][1] for c in
+                     self.mock_clientFromString.call_args_list] == servers)
+            assert len(mw._engine_pool.engines) == 2
+
+    def test_settings_compression(self):
+        mw = self.make_middleware({
+            'BROWSER_ENGINE_SERVER': 'tcp:localhost:8000',
+            'BROWSER_ENGINE_COMPRESSION_LEVEL': 9,
+        })
+        assert mw._compression.level == 9
+        assert mw._compression.min_size == 1024
+        assert mw._downloader.compression is mw._compression
+        engine, = mw._engine_pool.engines
+        assert engine.compression_options == {'level': 9, 'min_size': 1024}
+
+        mw = self.make_middleware({
+            'BROWSER_ENGINE_SERVER': 'tcp:localhost:8000',
+            'BROWSER_ENGINE_COMPRESSION_ENABLED': False,
+        })
+        assert mw._compression is None
+
+        with self.patch_ProcessEndpoint():
+            mw = self.make_middleware({
+                'BROWSER_ENGINE_START_SERVER': True
+            })
+        assert mw._compression is None
 
     def test_settings_page_limit(self):
         mw = self.make_middleware({
@@ -125,9 +199,28 @@ class MiddlewareConstructionTest(MiddlewareTest):
         })
         assert mw.browser_options == test_options
 
+    def test_positional_arguments(self):
+        crawler = Crawler(Spider, Settings())
+        test_options = {'option_one': 'value 1'}
+        mw = BrowserMiddleware(crawler, [self.mock_endpoint], 4, test_options)
+        assert mw.browser_options == test_options
+
     def test_settings_browser_options_none(self):
         mw = self.make_middleware({
             'BROWSER_ENGINE_SERVER': 'tcp:localhost:8000',
             'BROWSER_ENGINE_OPTIONS': None
         })
         assert mw.browser_options == {}
+
+    def test_settings_autothrottle(self):
+        mw = self.make_middleware({
+            'BROWSER_ENGINE_SERVER': 'tcp:localhost:8000',
+            'BROWSER_ENGINE_PAGE_LIMIT': 20,
+            'BROWSER_ENGINE_AUTOTHROTTLE_ENABLED': True,
+            'BROWSER_ENGINE_AUTOTHROTTLE_MIN_PAGES': 2,
+            'BROWSER_ENGINE_AUTOTHROTTLE_MAX_PAGES': 8,
+        })
+        assert isinstance(mw._semaphore, AdjustableSemaphore)
+        assert mw._semaphore.limit == 8
+        assert mw._autothrottle.min_pages == 2
+        assert mw._autothrottle.max_pages == 8
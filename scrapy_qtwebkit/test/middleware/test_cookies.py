@@ -0,0 +1,40 @@
+from unittest.mock import Mock
+
+from twisted.internet.defer import succeed
+from twisted.trial import unittest
+
+from scrapy_qtwebkit.cookies import RemotelyAccessibleCookieJar
+from scrapy_qtwebkit.middleware.cookies import sync_cookies
+
+
+class SyncCookiesTest(unittest.TestCase):
+    def setUp(self):
+        self.jar = RemotelyAccessibleCookieJar()
+        self.observer = Mock(broker=object())
+        self.observer.callRemote.return_value = succeed(None)
+        self.jar._observers.add(self.observer)
+        self.jar._cookies_for_remote(hash(self.observer), ['example.com'])
+        self.webpage = Mock(broker=self.observer.broker)
+        self.webpage.callRemote.return_value = succeed(None)
+
+    def remote_calls(self):
+        return [call[0][0] for call in self.webpage.callRemote.call_args_list]
+
+    def test_unchanged(self):
+        self.successResultOf(sync_cookies(self.jar, self.webpage,
+                                          remote_synced=True))
+        assert self.remote_calls() == []
+
+        self.successResultOf(sync_cookies(self.jar, self.webpage))
+        assert self.remote_calls() == ['_sync_cookies']
+
+    def test_changed(self):
+        self.jar._queue_change(('example.com', '/', 'a'), None)
+        self.successResultOf(sync_cookies(self.jar, self.webpage,
+                                          remote_synced=True))
+        assert self.remote_calls() == ['_commit_cookies']
+
+        # Committed changes are not committed again.
+        self.successResultOf(sync_cookies(self.jar, self.webpage,
+                                          remote_synced=True))
+        assert self.remote_calls() == ['_commit_cookies']
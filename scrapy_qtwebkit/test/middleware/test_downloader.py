@@ -0,0 +1,172 @@
+from collections import defaultdict
+from unittest.mock import Mock, patch
+
+from scrapy import Request, signals
+from scrapy.crawler import Crawler
+from scrapy.http import Response
+from scrapy.http.cookies import CookieJar
+from scrapy.settings import Settings
+from scrapy.spiders import Spider
+from twisted.internet.defer import Deferred, succeed
+from twisted.trial import unittest
+
+from scrapy_qtwebkit._intermediaries import RequestFromBrowser
+from scrapy_qtwebkit.middleware.downloader import BrowserRequestDownloader
+
+
+class BrowserRequestDownloaderTest(unittest.TestCase):
+    def setUp(self):
+        self.crawler = Crawler(Spider, Settings())
+        self.downloader = BrowserRequestDownloader(self.crawler, coalesce=True)
+
+    @staticmethod
+    def make_request_from_browser(url, referer, is_first_request=False,
+                                  follow_redirects=False):
+        return RequestFromBrowser(url, 'GET',
+                                  {b'Referer': referer, b'Accept': b'*/*'},
+                                  None, is_first_request, None,
+                                  follow_redirects=follow_redirects)
+
+    def coalesced_fetch(self, request_from_browser):
+        return self.downloader._coalesced_fetch(
+            request_from_browser, Request(request_from_browser.url)
+        )
+
+    def test_coalesce(self):
+        url_1 = 'https://example.com/app.js'
+        url_2 = 'https://example.com/app.css'
+        downloads = [Deferred(), Deferred()]
+        with patch.object(self.downloader, '_fetch',
+                          side_effect=downloads) as mock_fetch:
+            results = [
+                self.coalesced_fetch(
+                    self.make_request_from_browser(url_1, b'https://a/')
+                ),
+                self.coalesced_fetch(
+                    self.make_request_from_browser(url_1, b'https://b/')
+                ),
+                self.coalesced_fetch(
+                    self.make_request_from_browser(url_2, b'https://a/')
+                ),
+            ]
+        assert mock_fetch.call_count == 2
+        assert self.crawler.stats.get_value('browser_engine/coalesced') == 1
+
+        response_1 = Response(url_1)
+        downloads[0].callback(response_1)
+        assert self.successResultOf(results[0]) is response_1
+        assert self.successResultOf(results[1]) is response_1
+        assert self.downloader._in_flight.keys() == {
+            self.downloader._coalescing_key(
+                self.make_request_from_browser(url_2, b'https://a/')
+            )
+        }
+
+        downloads[1].callback(Response(url_2))
+        assert not self.downloader._in_flight
+
+    def test_not_coalesced(self):
+        url = 'https://example.com/'
+        request_from_browser = self.make_request_from_browser(
+            url, b'', is_first_request=True
+        )
+        assert self.downloader._coalescing_key(request_from_browser) is None
+
+        request_from_browser = self.make_request_from_browser(url, b'')
+        request_from_browser.method = 'POST'
+        assert self.downloader._coalescing_key(request_from_browser) is None
+
+    def test_follow_redirects(self):
+        self.downloader.cookie_jars = defaultdict(CookieJar)
+        self.downloader.cookie_jars[None].add_cookie_header = (
+            lambda request: request.headers.__setitem__(b'Cookie', b'a=1')
+        )
+        responses = {
+            'https://a.com/x': Response('https://a.com/x', status=302,
+                                        headers={'Location': '/y'}),
+            'https://a.com/y': Response('https://a.com/y', status=301,
+                                        headers={'Location': 'https://b/z'}),
+            'https://b/z': Response('https://b/z', status=200),
+        }
+        fetched = []
+
+        def fetch(request):
+            fetched.append(request)
+            return succeed(responses[request.url])
+
+        request_from_browser = self.make_request_from_browser(
+            'https://a.com/x', b'', follow_redirects=True
+        )
+        with patch.object(self.downloader, '_fetch', side_effect=fetch):
+            result = self.coalesced_fetch(request_from_browser)
+        assert self.successResultOf(result).url == 'https://b/z'
+        assert [request.url for request in fetched] == list(responses)
+        assert fetched[-1].headers[b'Cookie'] == b'a=1'
+        assert self.crawler.stats.get_value(
+            'browser_engine/redirect/followed'
+        ) == 2
+
+        # Redirects setting cookies are followed by the browser engine.
+        fetched.clear()
+        responses['https://a.com/y'].headers[b'Set-Cookie'] = b'b=2'
+        with patch.object(self.downloader, '_fetch', side_effect=fetch):
+            result = self.coalesced_fetch(request_from_browser)
+        assert self.successResultOf(result).url == 'https://a.com/y'
+        assert len(fetched) == 2
+
+
+class DownloadTest(unittest.TestCase):
+    def setUp(self):
+        self.crawler = Crawler(Spider, Settings())
+        self.crawler.spider = Spider('test')
+        self.crawler.engine = Mock()
+        self.downloads = {}
+        self.crawler.engine.downloader.fetch.side_effect = (
+            lambda request, spider: self.downloads.pop(request.url)
+        )
+        self.downloader = BrowserRequestDownloader(self.crawler,
+                                                   concurrency=1)
+
+    def test_concurrency(self):
+        first_download, second_download = Deferred(), Deferred()
+        self.downloads = {'https://a/': first_download,
+                          'https://b/': second_download}
+        first = self.downloader._limited_download(Request('https://a/'))
+        second = self.downloader._limited_download(Request('https://b/'))
+        # The second download waits for the first one to finish.
+        assert self.crawler.engine.downloader.fetch.call_count == 1
+
+        first_download.callback(Response('https://a/'))
+        assert self.successResultOf(first).url == 'https://a/'
+        assert self.crawler.engine.downloader.fetch.call_count == 2
+        second_download.callback(Response('https://b/'))
+        assert self.successResultOf(second).url == 'https://b/'
+        assert self.crawler.engine.slot.nextcall.schedule.call_count == 2
+
+    def test_retry(self):
+        retried = Request('https://a/retry')
+        self.downloads = {
+            'https://a/': succeed(retried),
+            'https://a/retry': succeed(Response('https://a/retry')),
+        }
+        received = []
+
+        def response_received(response, request, spider):
+            received.append((response, request, spider))
+
+        self.crawler.signals.connect(response_received,
+                                     signals.response_received)
+        result = self.downloader._limited_download(Request('https://a/'))
+        response = self.successResultOf(result)
+        assert response.request is retried
+        assert received == [(response, retried, self.crawler.spider)]
+        assert self.downloader._semaphore.tokens == 1
+
+    def test_failure(self):
+        self.downloads = {'https://a/': Deferred()}
+        download = self.downloads['https://a/']
+        result = self.downloader._limited_download(Request('https://a/'))
+        download.errback(ConnectionError("lost"))
+        self.failureResultOf(result, ConnectionError)
+        assert self.downloader._semaphore.tokens == 1
+        self.crawler.engine.slot.nextcall.schedule.assert_called_once_with()
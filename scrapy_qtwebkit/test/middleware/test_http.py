@@ -0,0 +1,39 @@
+from unittest.mock import Mock
+
+from scrapy import Request
+from twisted.internet.defer import inlineCallbacks, succeed
+from twisted.trial import unittest
+
+from scrapy_qtwebkit.middleware.http import BrowserResponse
+
+
+class BrowserResponseTest(unittest.TestCase):
+    def setUp(self):
+        url = 'https://example.com/'
+        self.response = BrowserResponse(url, request=Request(url),
+                                        body=b'<p>1</p><p>2</p>',
+                                        encoding='utf-8')
+        self.response._webpage = Mock()
+        self.response._page_slot = None
+        self.response._cookiejar = None
+        self.response._body_deltas = True
+        self.response._body_version = 1
+
+    def reply(self, *result):
+        self.response._webpage.callRemote.return_value = succeed(result)
+
+    @inlineCallbacks
+    def test_update_body_delta(self):
+        selector = self.response.selector
+        self.reply(1, 'utf-8', None)
+        yield self.response.update_body()
+        assert self.response.selector is selector
+
+        self.reply(2, 'utf-8', (3, 12, b'3'))
+        yield self.response.update_body()
+        self.response._webpage.callRemote.assert_called_with(
+            'get_body_delta', 1
+        )
+        assert self.response.body == b'<p>3</p><p>2</p>'
+        assert self.response._body_version == 2
+        assert self.response.css('p::text').getall() == ['3', '2']
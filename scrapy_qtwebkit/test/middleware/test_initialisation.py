@@ -1,5 +1,6 @@
 from unittest.mock import patch
 
+from scrapy import Request
 from twisted.internet.defer import fail, inlineCallbacks
 from twisted.internet.error import ConnectError
 from twisted.spread.pb import PBConnectionLost
@@ -32,7 +33,8 @@ class MiddlewareInitialisationTest(MiddlewareTest):
             'BROWSER_ENGINE_OPTIONS': test_options
         })
 
-        yield mw._init_browser()
+        engine = mw._engine_pool.engines[0]
+        yield engine._init_browser()
 
         self.mock_endpoint.connect.assert_called_with(self.mock_factory)
 
@@ -43,7 +45,30 @@ class MiddlewareInitialisationTest(MiddlewareTest):
         )
 
         mock_browser = self.mock_root.callRemote.return_value
-        assert mw._browser == mock_browser
+        assert engine.browser == mock_browser
+
+    @inlineCallbacks
+    def test_init_browser_wire_version(self):
+        mw = self.make_middleware({
+            'BROWSER_ENGINE_SERVER': 'tcp:localhost:8000',
+        })
+
+        remote_results = {'get_wire_versions': [0, 1, 2],
+                          'open_browser': object()}
+        self.mock_root.callRemote.side_effect = (
+            lambda name, **kwargs: remote_results[name]
+        )
+
+        engine = mw._engine_pool.engines[0]
+        yield engine._init_browser()
+
+        assert engine.wire_version == 2
+        self.mock_root.callRemote.assert_called_with(
+            'open_browser',
+            downloader=mw._downloader,
+            options={'wire_version': 2,
+                     'compression': {'level': 6, 'min_size': 1024}}
+        )
 
     @inlineCallbacks
     def test_init_browser_connection_failed(self):
@@ -53,10 +78,11 @@ class MiddlewareInitialisationTest(MiddlewareTest):
 
         self.mock_endpoint.connect.return_value = fail(ConnectError())
 
+        engine = mw._engine_pool.engines[0]
         with self.assertRaises(ConnectError):
-            yield mw._init_browser()
+            yield engine._init_browser()
 
-        assert mw._browser is None
+        assert engine.browser is None
 
     @inlineCallbacks
     def test_init_browser_connection_lost(self):
@@ -66,7 +92,80 @@ class MiddlewareInitialisationTest(MiddlewareTest):
 
         self.mock_root.callRemote.return_value = fail(PBConnectionLost())
 
+        engine = mw._engine_pool.engines[0]
         with self.assertRaises(PBConnectionLost):
-            yield mw._init_browser()
+            yield engine._init_browser()
+
+        assert engine.browser is None
+
+    @inlineCallbacks
+    def test_least_loaded_engine(self):
+        mw = self.make_middleware({
+            'BROWSER_ENGINE_SERVER': ['tcp:localhost:8000',
+                                      'tcp:localhost:8001'],
+        })
+        engine_1, engine_2 = mw._engine_pool.engines
+        request = Request('https://example.com/')
+
+        page_slot_1 = yield mw._acquire_page_slot(request)
+        assert page_slot_1.engine is engine_1
+        page_slot_2 = yield mw._acquire_page_slot(request)
+        assert page_slot_2.engine is engine_2
+        assert engine_1.open_pages == engine_2.open_pages == 1
+
+        page_slot_1.release()
+        assert engine_1.open_pages == 0
+        page_slot_3 = yield mw._acquire_page_slot(request)
+        assert page_slot_3.engine is engine_1
+
+    @inlineCallbacks
+    def test_recycle_engine_max_pages(self):
+        mw = self.make_middleware({
+            'BROWSER_ENGINE_SERVER': 'tcp:localhost:8000',
+            'BROWSER_ENGINE_MAX_PAGES': 2,
+        })
+        engine = mw._engine_pool.engines[0]
+        request = Request('https://example.com/')
+
+        page_slot_1 = yield mw._acquire_page_slot(request)
+        assert page_slot_1.engine is engine
+        assert not engine.draining
+        page_slot_2 = yield mw._acquire_page_slot(request)
+        assert page_slot_2.engine is engine
+        assert engine.draining
+
+        page_slot_3 = yield mw._acquire_page_slot(request)
+        assert page_slot_3.engine is not engine
+        assert mw._engine_pool.engines == [page_slot_3.engine]
+
+        with patch.object(engine, 'terminate') as mock_terminate:
+            page_slot_1.release()
+            assert not mock_terminate.called
+            page_slot_2.release()
+            assert mock_terminate.called
+
+    @inlineCallbacks
+    def test_domain_page_limit(self):
+        mw = self.make_middleware({
+            'BROWSER_ENGINE_SERVER': 'tcp:localhost:8000',
+            'BROWSER_ENGINE_PAGE_LIMIT': 4,
+            'BROWSER_ENGINE_PAGE_LIMIT_PER_DOMAIN': 1,
+        })
+
+        page_slot_1 = yield mw._acquire_page_slot(
+            Request('https://example.com/1')
+        )
+        dfd_2 = mw._acquire_page_slot(Request('https://example.com/2'))
+        assert not dfd_2.called
+        page_slot_3 = yield mw._acquire_page_slot(
+            Request('https://example.org/')
+        )
+        dfd_4 = mw._acquire_page_slot(
+            Request('https://example.net/', meta={'download_slot': 'slot'})
+        )
+        assert dfd_4.called
 
-        assert mw._browser is None
+        page_slot_1.release()
+        assert dfd_2.called
+        page_slot_3.release()
+        assert set(mw._domain_semaphores) == {'example.com', 'slot'}
@@ -0,0 +1,237 @@
+import os
+from unittest.mock import Mock, patch
+
+from scrapy.http import HtmlResponse
+from twisted.internet.defer import (Deferred, TimeoutError, fail,
+                                    inlineCallbacks, succeed)
+from twisted.internet.error import ConnectError
+from twisted.internet.task import Clock
+
+from scrapy_qtwebkit._bodies import (SHARED_MEMORY_MIN_SIZE, SharedMemoryBody,
+                                     SharedMemoryFiles)
+from scrapy_qtwebkit.middleware import BrowserRequest
+
+from . import MiddlewareTest
+
+
+class _FakeRemote(object):
+    """A remote reference replying to calls with preset results."""
+
+    def __init__(self, results):
+        super().__init__()
+        self.results = results
+        self.calls = []
+
+    def callRemote(self, name, *args, **kwargs):
+        self.calls.append((name, args, kwargs))
+        result = self.results[name]
+        if callable(result):
+            result = result(*args, **kwargs)
+        if isinstance(result, Deferred):
+            return result
+        return succeed(result)
+
+    def call_names(self):
+        return [name for name, args, kwargs in self.calls]
+
+
+class PageLoadingTest(MiddlewareTest):
+    def setUp(self):
+        super().setUp()
+        self.mw = self.make_middleware({
+            'BROWSER_ENGINE_SERVER': 'tcp:localhost:8000',
+            'BROWSER_ENGINE_PAGE_LIMIT': 2,
+        })
+        self.engine = self.mw._engine_pool.engines[0]
+
+    def set_browser(self, **results):
+        self.engine.browser = _FakeRemote(results)
+        return self.engine.browser
+
+    def assert_slot_released(self):
+        assert self.engine.open_pages == 0
+        assert self.mw._semaphore.tokens == 2
+        assert not self.mw._domain_semaphores
+
+
+class FetchTest(PageLoadingTest):
+    @inlineCallbacks
+    def test_fetch(self):
+        browser = self.set_browser(fetch=(
+            True, 200, {b'Content-Type': [b'text/html']}, None, [],
+            'https://example.com/', 'utf-8', b'<p>Page</p>'
+        ))
+        request = BrowserRequest('https://example.com/')
+        response = yield self.mw._make_browser_request(request)
+
+        assert browser.call_names() == ['fetch']
+        assert type(response) is HtmlResponse
+        assert response.body == b'<p>Page</p>'
+        assert response.request is request
+        self.assert_slot_released()
+
+    @inlineCallbacks
+    def test_fetch_failed(self):
+        self.set_browser(fetch=(
+            False, None, None, ConnectError("refused"), [], None, None, None
+        ))
+        with self.assertRaises(ConnectError):
+            yield self.mw._make_browser_request(
+                BrowserRequest('https://example.com/')
+            )
+        self.assert_slot_released()
+
+    @inlineCallbacks
+    def test_fetch_remote_error(self):
+        self.set_browser(fetch=lambda *args, **kwargs: fail(
+            ConnectionError("lost")
+        ))
+        with self.assertRaises(ConnectionError):
+            yield self.mw._make_browser_request(
+                BrowserRequest('https://example.com/')
+            )
+        self.assert_slot_released()
+
+    def test_cookies_committed_on_body_error(self):
+        # Removed by the browser engine, e.g. after its lease expired.
+        files = SharedMemoryFiles(clock=Clock())
+        body = SharedMemoryBody.from_bytes(b'x' * 16, files)
+        body.discard()
+        self.set_browser(fetch=(
+            True, 200, {}, None, [], 'https://example.com/', 'utf-8', body
+        ))
+        cookiejar = Mock()
+        cookiejar.sync.return_value = succeed(None)
+        self.failureResultOf(
+            self.mw._fetch_page(self.engine,
+                                BrowserRequest('https://example.com/'), {},
+                                {'timeout': 0}, cookiejar),
+            FileNotFoundError
+        )
+        cookiejar.commit.assert_called_once_with()
+
+
+class LoadRequestTest(PageLoadingTest):
+    def make_request(self, **results):
+        webpage = _FakeRemote(dict(results, close=None))
+        self.set_browser(create_webpage=webpage)
+        request = BrowserRequest('https://example.com/',
+                                 meta={'browser_response': True})
+        return webpage, self.mw._make_browser_request(request)
+
+    def test_load_request(self):
+        webpage, dfd = self.make_request(
+            load_request=(True, 200, {}, None, []),
+            get_url='https://example.com/',
+            get_body=('utf-8', b'<p>Page</p>'),
+        )
+        response = self.successResultOf(dfd)
+        assert response.body == b'<p>Page</p>'
+        assert 'close' not in webpage.call_names()
+        assert self.engine.open_pages == 1
+        response.close_webpage()
+        assert webpage.call_names()[-1] == 'close'
+        self.assert_slot_released()
+
+    def test_load_request_failed(self):
+        webpage, dfd = self.make_request(
+            load_request=(False, None, None, ConnectError("refused"), [])
+        )
+        self.failureResultOf(dfd, ConnectError)
+        assert webpage.call_names() == ['load_request', 'close']
+        self.assert_slot_released()
+
+
+class PageSlotReleaseTest(PageLoadingTest):
+    def test_open_page_error(self):
+        with patch.object(self.mw._engine_pool, 'open_page',
+                          side_effect=RuntimeError):
+            self.failureResultOf(
+                self.mw._make_browser_request(
+                    BrowserRequest('https://example.com/')
+                ), RuntimeError
+            )
+        self.assert_slot_released()
+
+    def test_request_error(self):
+        webpage = _FakeRemote({'close': None})
+        self.set_browser(create_webpage=webpage)
+        request = BrowserRequest('https://example.com/',
+                                 meta={'browser_response': True})
+        with patch.object(self.mw, '_make_remote_request',
+                          side_effect=OSError):
+            self.failureResultOf(self.mw._make_browser_request(request),
+                                 OSError)
+        assert webpage.call_names() == ['close']
+        self.assert_slot_released()
+
+
+class RenderTimeoutTest(PageLoadingTest):
+    def setUp(self):
+        super().setUp()
+        self.clock = Clock()
+        self._patcher_reactor = patch('scrapy_qtwebkit.middleware.reactor',
+                                      self.clock)
+        self._patcher_reactor.start()
+
+    def tearDown(self):
+        super().tearDown()
+        self._patcher_reactor.stop()
+
+    def test_timeout_grace(self):
+        browser = self.set_browser(fetch=Deferred())
+        request = BrowserRequest('https://example.com/',
+                                 meta={'browser_render_timeout': 10})
+        dfd = self.mw._make_browser_request(request)
+        [(name, args, kwargs)] = browser.calls
+        assert kwargs == {'timeout': 10, 'return_partial': False}
+
+        # The browser engine is given some time to stop the page itself.
+        self.clock.advance(10 + self.mw.render_timeout_grace - 1)
+        assert not dfd.called
+        self.clock.advance(1)
+        self.failureResultOf(dfd, TimeoutError)
+        self.assert_slot_released()
+
+    @inlineCallbacks
+    def test_partial(self):
+        browser = self.set_browser(fetch=(
+            True, 200, {}, None, ['partial'],
+            'https://example.com/', 'utf-8', b'<p>Partial</p>'
+        ))
+        request = BrowserRequest('https://example.com/', meta={
+            'browser_render_timeout': 10,
+            'browser_render_timeout_partial': True,
+        })
+        response = yield self.mw._make_browser_request(request)
+        [(name, args, kwargs)] = browser.calls
+        assert kwargs['return_partial'] is True
+        assert response.flags == ['partial']
+        assert not self.clock.getDelayedCalls()
+
+    def test_timeout_closes_webpage(self):
+        webpage = _FakeRemote({'load_request': Deferred(), 'close': None})
+        self.set_browser(create_webpage=webpage)
+        request = BrowserRequest('https://example.com/', meta={
+            'browser_render_timeout': 10,
+            'browser_response': True,
+        })
+        dfd = self.mw._make_browser_request(request)
+        self.clock.advance(10 + self.mw.render_timeout_grace)
+        self.failureResultOf(dfd, TimeoutError)
+        assert webpage.call_names() == ['load_request', 'close']
+        self.assert_slot_released()
+
+    def test_timeout_removes_request_body(self):
+        self.mw.shared_memory = True
+        browser = self.set_browser(fetch=Deferred())
+        request = BrowserRequest('https://example.com/', method='POST',
+                                 body=b'x' * (SHARED_MEMORY_MIN_SIZE + 1),
+                                 meta={'browser_render_timeout': 10})
+        dfd = self.mw._make_browser_request(request)
+        [(name, (options, remote_request), kwargs)] = browser.calls
+        assert os.path.exists(remote_request.body.path)
+        self.clock.advance(10 + self.mw.render_timeout_grace)
+        self.failureResultOf(dfd, TimeoutError)
+        # The browser engine would not read the body of a late request.
+        assert not os.path.exists(remote_request.body.path)
@@ -0,0 +1,61 @@
+from unittest.mock import Mock
+
+from scrapy import Request
+from scrapy.http import HtmlResponse
+from twisted.internet.defer import succeed
+from twisted.trial import unittest
+
+from scrapy_qtwebkit.middleware.http import BrowserResponse
+from scrapy_qtwebkit.middleware.spidermw import (
+    BrowserResponseTrackerMiddleware
+)
+
+
+def make_browser_response(url='https://example.com/'):
+    response = BrowserResponse(url, request=Request(url))
+    response._webpage = Mock()
+    response._webpage.callRemote.return_value = succeed(None)
+    response._page_slot = None
+    response._cookiejar = None
+    return response
+
+
+class BrowserResponseTrackerMiddlewareTest(unittest.TestCase):
+    def setUp(self):
+        self.mw = BrowserResponseTrackerMiddleware()
+
+    def process(self, response, *result):
+        return list(self.mw.process_spider_output(response, result, None))
+
+    def test_close_unused(self):
+        response = make_browser_response()
+        webpage = response._webpage
+        self.process(response, Request('https://example.com/next'))
+        webpage.callRemote.assert_called_once_with('close')
+
+    def test_close_after_kept(self):
+        response = make_browser_response()
+        webpage = response._webpage
+        request = Request('https://example.com/next',
+                          meta={'page': {'response': response}, 'a': 'text'})
+        self.process(response, request)
+        assert not webpage.callRemote.called
+
+        # Another page is not affected.
+        self.process(make_browser_response('https://example.com/other'))
+        assert not webpage.callRemote.called
+
+        self.process(HtmlResponse(request.url, request=request))
+        webpage.callRemote.assert_called_once_with('close')
+
+    def test_get_browser_responses(self):
+        responses = [make_browser_response(f'https://example.com/{i}')
+                     for i in range(3)]
+        nested = [responses[1], (1, 'text', b'bytes', None)]
+        nested.append(nested)
+        meta = {'a': responses[0], 'b': {'c': nested}, 'd': {responses[2]},
+                'e': [responses[0]], 'f': 'text'}
+        assert self.mw._get_browser_responses(meta) == [
+            responses[0], responses[1], responses[2], responses[0]
+        ]
+        assert self.mw._get_browser_responses({'a': [1, 'b']}) == []
@@ -0,0 +1,101 @@
+from unittest.mock import patch
+
+from twisted.internet.defer import CancelledError
+from twisted.trial import unittest
+
+from scrapy_qtwebkit.middleware.utils import (AdjustableSemaphore,
+                                              HeldPages, PrioritySemaphore)
+
+
+class AdjustableSemaphoreTest(unittest.TestCase):
+    def test_raise_limit(self):
+        semaphore = AdjustableSemaphore(1)
+        d1 = semaphore.acquire()
+        d2 = semaphore.acquire()
+        assert d1.called
+        assert not d2.called
+
+        semaphore.set_limit(2)
+        assert d2.called
+        assert semaphore.tokens == 0
+
+    def test_lower_limit(self):
+        semaphore = AdjustableSemaphore(2)
+        semaphore.acquire()
+        semaphore.acquire()
+
+        semaphore.set_limit(1)
+        assert semaphore.tokens == -1
+        d = semaphore.acquire()
+
+        semaphore.release()
+        assert not d.called
+        semaphore.release()
+        assert d.called
+        assert semaphore.tokens == 0
+
+
+class PrioritySemaphoreTest(unittest.TestCase):
+    def test_priority_order(self):
+        semaphore = PrioritySemaphore(1)
+        semaphore.acquire()
+        low = semaphore.acquire(priority=-1)
+        default_1 = semaphore.acquire()
+        high = semaphore.acquire(priority=10)
+        default_2 = semaphore.acquire()
+
+        woken = []
+        for name, d in [('low', low), ('default_1', default_1),
+                        ('high', high), ('default_2', default_2)]:
+            d.addCallback(lambda result, name=name: woken.append(name))
+
+        for _ in range(4):
+            semaphore.release()
+        assert woken == ['high', 'default_1', 'default_2', 'low']
+
+    def test_waiting_callback(self):
+        changes = []
+        semaphore = PrioritySemaphore(
+            1, waiting_callback=lambda *args: changes.append(args)
+        )
+        semaphore.acquire()
+        semaphore.acquire(priority=1)
+        d = semaphore.acquire(priority=1)
+        d.addErrback(lambda failure: failure.trap(CancelledError))
+        d.cancel()
+        semaphore.release()
+        assert changes == [(1, 1), (1, 2), (1, 1), (1, 0)]
+        assert not semaphore.waiting
+
+
+class _Response(object):
+    pass
+
+
+class HeldPagesTest(unittest.TestCase):
+    def test_pop_idle(self):
+        pages = HeldPages()
+        responses = [_Response(), _Response(), _Response()]
+        with patch('time.monotonic', side_effect=[0, 5, 10, 12, 19]):
+            keys = [pages.add(response) for response in responses]
+            pages.touch(keys[0])
+            assert pages.pop_idle(10) == [responses[1]]
+        assert len(pages) == 2
+
+    def test_pop_least_recently_used(self):
+        pages = HeldPages()
+        responses = [_Response(), _Response(), _Response()]
+        keys = [pages.add(response) for response in responses]
+        pages.touch(keys[0])
+        pages.discard(keys[2])
+        assert pages.pop_least_recently_used() is responses[1]
+        assert pages.pop_least_recently_used() is responses[0]
+        assert pages.pop_least_recently_used() is None
+
+    def test_deleted_response(self):
+        pages = HeldPages()
+        responses = [_Response(), _Response()]
+        for response in responses:
+            pages.add(response)
+        del responses[0]
+        assert pages.pop_least_recently_used() is responses[0]
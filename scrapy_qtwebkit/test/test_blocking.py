@@ -0,0 +1,52 @@
+from twisted.trial import unittest
+
+from scrapy_qtwebkit.browser_engine.utils.blocking import (BlockingRules,
+                                                           guess_resource_type,
+                                                           is_third_party)
+
+
+class BlockingTest(unittest.TestCase):
+    def test_guess_resource_type(self):
+        assert guess_resource_type('https://a.com/x.PNG?v=1') == 'image'
+        assert guess_resource_type('https://a.com/x.css') == 'stylesheet'
+        assert guess_resource_type('https://a.com/x', b'image/webp,*/*') == \
+            'image'
+        assert guess_resource_type('https://a.com/x', b'*/*') == 'other'
+        assert guess_resource_type('https://a.com/x.js',
+                                   is_document=True) == 'document'
+
+    def test_is_third_party(self):
+        assert not is_third_party('https://cdn.a.com/x', 'https://www.a.com/')
+        assert not is_third_party('https://b.a.co.uk/x', 'https://a.co.uk/')
+        assert is_third_party('https://b.co.uk/x', 'https://a.co.uk/')
+        assert is_third_party('https://b.com/x', 'https://a.com/')
+        # Public suffixes are taken from a list, not guessed from lengths.
+        assert not is_third_party('https://tvthek.orf.at/x',
+                                  'https://www.orf.at/')
+        assert not is_third_party('https://img.web.de/x', 'https://web.de/')
+        assert is_third_party('https://b.com.br/x', 'https://a.com.br/')
+        assert is_third_party('https://b.github.io/x', 'https://a.github.io/')
+        assert not is_third_party('http://127.0.0.1:8000/x',
+                                  'http://127.0.0.1/')
+        assert is_third_party('http://127.0.0.2/x', 'http://127.0.0.1/')
+
+    def test_should_block(self):
+        assert BlockingRules.from_options({}) is None
+        assert BlockingRules.from_options({'resource_types': []}) is None
+
+        rules = BlockingRules.from_options({
+            'resource_types': ['image'],
+            'urls': ['*://ads.example.com/*'],
+            'url_regexes': [r'/track(ing)?\b'],
+        })
+        assert rules.should_block('https://a.com/x.png', 'image')
+        assert rules.should_block('https://ads.example.com/x.js', 'script')
+        assert rules.should_block('https://a.com/tracking?x', 'other')
+        assert not rules.should_block('https://a.com/x.js', 'script')
+        assert not rules.should_block('https://a.com/x.png', 'document')
+
+        rules = BlockingRules(third_party=True)
+        assert rules.should_block('https://b.com/x.js', 'script',
+                                  'https://a.com/')
+        assert not rules.should_block('https://a.com/x.js', 'script',
+                                      'https://a.com/')
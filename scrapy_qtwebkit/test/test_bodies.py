@@ -0,0 +1,239 @@
+import os
+import tempfile
+import zlib
+from unittest.mock import Mock, patch
+
+from scrapy.statscollectors import StatsCollector
+from twisted.internet.defer import Deferred, TimeoutError
+from twisted.internet.task import Clock
+from twisted.spread import jelly, pb
+from twisted.test.iosim import connectedServerAndClient
+from twisted.trial import unittest
+
+from scrapy_qtwebkit._bodies import (SHARED_MEMORY_DIR,
+                                     _SHARED_MEMORY_PREFIX, BodyCompression,
+                                     BodySnapshot, CompressedBody,
+                                     SharedMemoryBody, SharedMemoryFiles,
+                                     StreamedBody, _BodyChunks,
+                                     apply_body_delta, body_delta,
+                                     encode_body, read_body, receive_body)
+
+
+class SharedMemoryBodyTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.files = SharedMemoryFiles(lease=60, clock=self.clock)
+
+    def make_body(self, data=b'x' * 100):
+        body = SharedMemoryBody.from_bytes(data, self.files)
+        self.addCleanup(self.files.release_all)
+        return body
+
+    def test_map(self):
+        body = self.make_body()
+        assert os.path.dirname(body.path) == SHARED_MEMORY_DIR
+        assert self.successResultOf(read_body(body)) == b'x' * 100
+        # The receiver removes the file once it has mapped it.
+        assert not os.path.exists(body.path)
+        # So that removing it here afterwards does nothing.
+        self.files.release(body)
+        assert body.path not in self.files
+        assert not self.clock.getDelayedCalls()
+
+    def test_check_path(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, path)
+        prefix = os.path.join(SHARED_MEMORY_DIR, _SHARED_MEMORY_PREFIX)
+        for invalid_path in (path, prefix + '../' + os.path.basename(path),
+                             os.path.join(SHARED_MEMORY_DIR, 'other')):
+            body = SharedMemoryBody(invalid_path, 0)
+            self.failureResultOf(read_body(body), ValueError)
+            with self.assertRaises(ValueError):
+                body.discard()
+        assert os.path.exists(path)
+
+    def test_release_owned_only(self):
+        # Files received from the other side are not removed by the sender.
+        fd, path = tempfile.mkstemp(prefix=_SHARED_MEMORY_PREFIX,
+                                    dir=SHARED_MEMORY_DIR)
+        os.close(fd)
+        self.addCleanup(os.unlink, path)
+        self.files.release(SharedMemoryBody(path, 0))
+        assert os.path.exists(path)
+
+        body = self.make_body()
+        self.files.release(CompressedBody(body, 1000))
+        assert not os.path.exists(body.path)
+
+    def test_cancelled_call(self):
+        body = self.make_body()
+        dfd = self.files.release_after(Deferred(), body)
+        dfd.cancel()
+        self.failureResultOf(dfd)
+        assert not os.path.exists(body.path)
+
+        body = self.make_body()
+        dfd = self.files.release_after(Deferred(), body)
+        dfd.addTimeout(10, self.clock)
+        self.clock.advance(10)
+        self.failureResultOf(dfd, TimeoutError)
+        assert not os.path.exists(body.path)
+        assert not self.clock.getDelayedCalls()
+
+    def test_lease(self):
+        body = self.make_body()
+        self.clock.advance(59)
+        assert os.path.exists(body.path)
+        self.clock.advance(1)
+        assert not os.path.exists(body.path)
+        assert body.path not in self.files
+
+    def test_map_removed(self):
+        body = self.make_body()
+        self.clock.advance(60)
+        with self.assertRaises(FileNotFoundError):
+            body.map()
+        self.failureResultOf(read_body(body), FileNotFoundError)
+
+    def test_release_all(self):
+        bodies = [self.make_body(), self.make_body()]
+        os.unlink(bodies[0].path)
+        self.files.release_all()
+        assert not any(os.path.exists(body.path) for body in bodies)
+        assert not self.clock.getDelayedCalls()
+
+
+class _Root(pb.Root):
+    def __init__(self):
+        super().__init__()
+        self.body = None
+
+    def remote_get_body(self):
+        return self.body
+
+
+class StreamedBodyTest(unittest.TestCase):
+    """Round trips of streamed bodies through a Perspective Broker."""
+
+    def setUp(self):
+        self.root = _Root()
+        server_factory = pb.PBServerFactory(
+            self.root, security=jelly.DummySecurityOptions()
+        )
+        client_factory = pb.PBClientFactory(
+            security=jelly.DummySecurityOptions()
+        )
+        client, server, self.pump = connectedServerAndClient(
+            lambda: server_factory.buildProtocol(None),
+            lambda: client_factory.buildProtocol(None),
+        )
+        self.remote_root = self.successResultOf(
+            client_factory.getRootObject()
+        )
+
+    def receive(self, body):
+        """Send a body from the root, returning the chunks received."""
+        self.root.body = body
+        chunks = []
+        dfd = self.remote_root.callRemote('get_body').addCallback(
+            receive_body, chunks.append
+        )
+        self.pump.flush()
+        return dfd, chunks
+
+    def test_chunk_boundaries(self):
+        body = bytes(range(256)) * 4
+        for chunk_size, sizes in ((256, [256] * 4),
+                                  (300, [300, 300, 300, 124]),
+                                  (1024, [1024]), (2048, [1024])):
+            dfd, chunks = self.receive(StreamedBody(body, chunk_size))
+            self.successResultOf(dfd)
+            assert [len(chunk) for chunk in chunks] == sizes
+            assert b''.join(chunks) == body
+
+    def test_read_body(self):
+        body = b'x' * 1000
+        self.root.body = encode_body(body, chunk_size=100)
+        assert isinstance(self.root.body, StreamedBody)
+        dfd = self.remote_root.callRemote('get_body').addCallback(read_body)
+        self.pump.flush()
+        assert self.successResultOf(dfd) == body
+
+    def test_compressed(self):
+        body = b'abc' * 10000
+        encoded = encode_body(body, chunk_size=16,
+                              compression=BodyCompression(min_size=1))
+        assert isinstance(encoded.data, StreamedBody)
+        dfd, chunks = self.receive(encoded)
+        self.successResultOf(dfd)
+        assert b''.join(chunks) == body
+
+    def test_invalid_compressed(self):
+        chunks = []
+        dfd = receive_body(CompressedBody(b'not zlib', 100), chunks.append)
+        self.failureResultOf(dfd, zlib.error)
+        assert not chunks
+
+    def test_empty(self):
+        for body in (StreamedBody(b''), encode_body(b''), None):
+            dfd, chunks = self.receive(body)
+            self.successResultOf(dfd)
+            assert chunks == []
+
+    def test_error(self):
+        read = _BodyChunks.remote_read
+        calls = []
+
+        def failing_read(chunks):
+            calls.append(chunks)
+            if len(calls) > 1:
+                raise OSError("body lost")
+            return read(chunks)
+
+        with patch.object(_BodyChunks, 'remote_read', failing_read):
+            dfd, chunks = self.receive(StreamedBody(b'abcdef', 4))
+        # The reading error reaches the receiver, with the chunks received.
+        self.failureResultOf(dfd)
+        assert chunks == [b'abcd']
+        self.flushLoggedErrors(OSError)
+
+
+class BodyCompressionTest(unittest.TestCase):
+    def test_stats(self):
+        stats = StatsCollector(Mock())
+        compression = BodyCompression(min_size=1, stats=stats)
+        sent = encode_body(b'abc' * 1000, compression=compression)
+        received = CompressedBody(zlib.compress(b'x' * 2000), 2000)
+        assert self.successResultOf(
+            read_body(received, compression)
+        ) == b'x' * 2000
+        # Bodies received uncompressed are not counted.
+        self.successResultOf(read_body(b'y' * 2000, compression))
+
+        compressed_bytes = len(sent.data) + len(received.data)
+        assert stats.get_stats() == {
+            'browser_engine/compression/original_bytes': 5000,
+            'browser_engine/compression/compressed_bytes': compressed_bytes,
+            'browser_engine/compression/ratio': round(compressed_bytes / 5000,
+                                                      3),
+        }
+
+
+class BodyDeltaTest(unittest.TestCase):
+    def test_body_delta(self):
+        old = b'<html>' + b'a' * 10000 + b'<p>1</p>' + b'b' * 10000
+        for new in (old.replace(b'1', b'22'), old.replace(b'<p>1</p>', b''),
+                    old + b'c', b'c' + old, b'', old):
+            delta = body_delta(old, new)
+            assert apply_body_delta(old, delta) == new
+            assert len(delta[2]) <= 2
+        assert body_delta(b'aa', b'aaa') == (2, 0, b'a')
+
+    def test_snapshot(self):
+        snapshot = BodySnapshot()
+        assert snapshot.update(b'abc') == (1, (0, 0, b'abc'))
+        assert snapshot.update(b'abc', 1) == (1, None)
+        assert snapshot.update(b'axc', 1) == (2, (1, 1, b'x'))
+        # Deltas from unknown versions have the whole body.
+        assert snapshot.update(b'axc', 1) == (3, (0, 0, b'axc'))
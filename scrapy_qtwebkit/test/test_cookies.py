@@ -0,0 +1,244 @@
+from http.cookiejar import Cookie
+
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+from scrapy_qtwebkit._wire import set_broker_version
+from scrapy_qtwebkit.browser_engine._cookies_for_url import (
+    cookies_for_origin, path_matches
+)
+from scrapy_qtwebkit._wire import BATCHED_COOKIES_VERSION
+from scrapy_qtwebkit.cookies import (RemoteCookieJar,
+                                     RemotelyAccessibleCookieJar)
+
+
+class _Broker(object):
+    pass
+
+
+class _Observer(object):
+    def __init__(self, version=BATCHED_COOKIES_VERSION):
+        super().__init__()
+        self.calls = []
+        self.broker = _Broker()
+        set_broker_version(self.broker, version)
+
+    def callRemote(self, name, *args):
+        self.calls.append((name,) + args)
+        return succeed(None)
+
+
+def make_cookie(name, value, domain='example.com', path='/'):
+    return Cookie(0, name, value, None, False, domain, True, False, path, True,
+                  False, None, True, None, None, {})
+
+
+class RemotelyAccessibleCookieJarTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.jar = RemotelyAccessibleCookieJar()
+        self.jar._clock = self.clock
+        self.observers = [_Observer(), _Observer()]
+        for observer in self.observers:
+            self.jar.getStateToCacheAndObserveFor(None, observer)
+            self.jar._cookies_for_remote(hash(observer),
+                                         ['example.com', 'other.com'])
+
+    def test_batched_changes(self):
+        self.jar.set_cookie(make_cookie('a', '1'))
+        self.jar.set_cookie(make_cookie('b', '1'))
+        self.jar.set_cookie(make_cookie('a', '2'))
+        assert not self.observers[0].calls
+
+        self.clock.advance(0)
+        for observer in self.observers:
+            [(name, changes)] = observer.calls
+            assert name == 'cookie_changes'
+            assert [(key, cookie.value) for key, cookie in changes] == [
+                (('example.com', '/', 'a'), '2'),
+                (('example.com', '/', 'b'), '1'),
+            ]
+
+    def test_sync(self):
+        self.jar.set_cookie(make_cookie('a', '1'))
+        self.successResultOf(self.jar.sync())
+        assert len(self.observers[0].calls) == 1
+        assert not self.clock.getDelayedCalls()
+
+    def test_remote_changes(self):
+        changer = self.observers[0]
+        self.jar._remote_method_caller.remote_set_cookies(hash(changer), [
+            (('example.com', '/', 'a'), make_cookie('a', '1')),
+            (('example.com', '/', 'b'), make_cookie('b', '1')),
+        ])
+        assert not list(self.jar)
+
+        self.jar.commit()
+        assert len(list(self.jar)) == 2
+        # Changes are not sent back to their remote.
+        assert not changer.calls
+        [(name, changes)] = self.observers[1].calls
+        assert len(changes) == 2
+
+    def test_remote_versions(self):
+        broker = self.observers[0].broker
+        assert self.jar.remote_version(broker) == 0
+        self.jar.set_cookie(make_cookie('a', '1'))
+        self.jar.set_cookie(make_cookie('b', '1'))
+        self.successResultOf(self.jar.sync())
+        assert self.jar.remote_version(broker) == 1
+        assert self.jar.committed_remote_version(broker) == 0
+
+        self.jar.remote_committed(broker, 1)
+        self.successResultOf(self.jar.sync())
+        assert self.jar.committed_remote_version(broker) == 1
+        assert self.jar.remote_version(_Broker()) == 0
+
+    def test_lazy_replication(self):
+        observer = _Observer()
+        expired = make_cookie('c', '1', domain='.example.com')
+        expired.expires = 1
+        for cookie in (make_cookie('a', '1'), make_cookie('b', '1', 'b.com'),
+                       expired):
+            self.jar.set_cookie(cookie)
+        state = self.jar.getStateToCacheAndObserveFor(None, observer)
+        assert state[0] == {}
+        assert state[4] == BATCHED_COOKIES_VERSION
+
+        cookies = self.jar._cookies_for_remote(hash(observer), [
+            'example.com', '.example.com', 'missing.com'
+        ])
+        assert cookies['example.com']['/']['a'].value == '1'
+        assert cookies.keys() == {'example.com'}
+
+        # Only changes to the cookies of domains got are sent.
+        self.successResultOf(self.jar.sync())
+        self.jar.set_cookie(make_cookie('a', '2'))
+        self.jar.set_cookie(make_cookie('b', '2', 'b.com'))
+        self.successResultOf(self.jar.sync())
+        [(name, changes)] = observer.calls
+        assert [key for key, cookie in changes] == [
+            ('example.com', '/', 'a')
+        ]
+
+    def test_legacy_observer(self):
+        # Browser engines not supporting batches get all cookies and changes.
+        observer = _Observer(version=BATCHED_COOKIES_VERSION - 1)
+        self.jar.set_cookie(make_cookie('a', '1', 'b.com'))
+        state = self.jar.getStateToCacheAndObserveFor(None, observer)
+        assert len(state) == 4
+        assert state[0]['b.com']['/']['a'].value == '1'
+
+        self.jar.set_cookie(make_cookie('a', '2', 'b.com'))
+        self.jar.clear('b.com', '/', 'a')
+        self.jar.set_cookie(make_cookie('b', '1', 'c.com'))
+        self.successResultOf(self.jar.sync())
+        assert [(name, key) for name, key, cookie in observer.calls] == [
+            ('cookie_change', ('b.com', '/', 'a')),
+            ('cookie_change', ('c.com', '/', 'b')),
+        ]
+
+        # Changes from them are made one by one.
+        observer.calls.clear()
+        self.jar._remote_method_caller.remote_set_cookie(
+            hash(observer), ('d.com', '/', 'a'), make_cookie('a', '1', 'd.com')
+        )
+        self.jar.commit()
+        self.successResultOf(self.jar.sync())
+        assert [cookie.domain for cookie in self.jar] == ['c.com', 'd.com']
+        assert not observer.calls
+
+        self.jar.stoppedObserving(None, observer)
+        assert not self.jar._legacy_observers
+
+
+class RemoteCookieJarTest(unittest.TestCase):
+    def setUp(self):
+        self.jar = RemoteCookieJar()
+        self.jarmethods = _Observer()
+        self.fetched = Deferred()
+        self.jarmethods.callRemote = (
+            lambda *args: self.jarmethods.calls.append(args) or self.fetched
+        )
+        self.jar.setCopyableState(({}, self.jarmethods, 1, False,
+                                   BATCHED_COOKIES_VERSION))
+
+    def test_fetch_cookies(self):
+        url = 'https://www.example.com/'
+        dfds = [self.jar.fetch_cookies(url), self.jar.fetch_cookies(url)]
+        [(name, observer_id, domains)] = self.jarmethods.calls
+        assert name == 'get_cookies'
+        assert set(domains) == {'www.example.com', 'example.com',
+                                '.www.example.com', '.example.com'}
+
+        self.fetched.callback({'example.com': {'/': {
+            'a': make_cookie('a', '1')
+        }}})
+        for dfd in dfds:
+            self.successResultOf(dfd)
+        assert [cookie.name for cookie in self.jar] == ['a']
+        assert self.jar.fetch_cookies(url) is None
+
+    def test_deleted_while_fetching(self):
+        self.jar._clock = Clock()
+        url = 'https://example.com/'
+        self.jar.set_cookie(make_cookie('a', '1'))
+        self.jar.set_cookie(make_cookie('b', '1'))
+        dfd = self.jar.fetch_cookies(url)
+        # Deleted here, and from Scrapy, while the cookies are fetched.
+        self.jar.clear('example.com', '/', 'a')
+        self.jar.observe_cookie_changes([(('example.com', '/', 'b'), None)])
+        self.jar.commit()
+
+        self.fetched.callback({'example.com': {'/': {
+            'a': make_cookie('a', '1'),
+            'b': make_cookie('b', '1'),
+            'c': make_cookie('c', '1'),
+        }}})
+        self.successResultOf(dfd)
+        assert [cookie.name for cookie in self.jar] == ['c']
+        assert not self.jar._deleted_while_fetching
+
+    def test_legacy_state(self):
+        # Older Scrapy sides send all the cookies, taking changes one by one.
+        clock = Clock()
+        jar = RemoteCookieJar()
+        jar._clock = clock
+        jar.setCopyableState(({'example.com': {'/': {
+            'a': make_cookie('a', '1')
+        }}}, self.jarmethods, 1, False))
+        assert jar.fetch_cookies('https://example.com/') is None
+        assert [cookie.name for cookie in jar] == ['a']
+
+        jar.set_cookie(make_cookie('b', '1'))
+        jar.clear('example.com', '/', 'a')
+        clock.advance(0)
+        assert [(name, key) for name, observer_id, key, cookie
+                in self.jarmethods.calls] == [
+            ('set_cookie', ('example.com', '/', 'b')),
+            ('set_cookie', ('example.com', '/', 'a')),
+        ]
+
+        jar.observe_cookie_change(('example.com', '/', 'b'), None)
+        jar.commit()
+        assert not list(jar)
+
+
+class CookiesForOriginTest(unittest.TestCase):
+    def test_cookies_for_origin(self):
+        jar = RemotelyAccessibleCookieJar()
+        jar._clock = Clock()
+        cookie_1 = make_cookie('a', '1', path='/')
+        cookie_2 = make_cookie('b', '2', path='/x')
+        cookie_3 = make_cookie('c', '3', domain='other.com')
+        for cookie in (cookie_1, cookie_2, cookie_3):
+            jar.set_cookie(cookie)
+        assert jar.generation == 3
+
+        cookies = list(cookies_for_origin(jar, 'https://example.com/y'))
+        assert {cookie.name for cookie in cookies} == {'a', 'b'}
+        assert [cookie.name for cookie in cookies
+                if path_matches(cookie.path, '/x/y')] == ['a', 'b']
+        assert [cookie.name for cookie in cookies
+                if path_matches(cookie.path, '/xy')] == ['a']
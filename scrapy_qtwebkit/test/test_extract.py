@@ -0,0 +1,238 @@
+import json
+import shutil
+import subprocess
+
+from lxml import etree
+from parsel.csstranslator import HTMLTranslator
+from scrapy.http import HtmlResponse
+from twisted.trial import unittest
+
+from scrapy_qtwebkit._extract import (extract_from_response,
+                                      extraction_script, load_extracted,
+                                      parse_selector)
+
+
+class ExtractTest(unittest.TestCase):
+    def test_parse_selector(self):
+        assert parse_selector('h1') == {'type': 'css', 'query': 'h1',
+                                        'text': False, 'attr': None,
+                                        'descendants': False}
+        assert parse_selector('h1::text') == {'type': 'css', 'query': 'h1',
+                                              'text': True, 'attr': None,
+                                              'descendants': False}
+        assert parse_selector('h1 ::text') == {'type': 'css', 'query': 'h1',
+                                               'text': True, 'attr': None,
+                                               'descendants': True}
+        assert parse_selector({'css': 'a::attr(href)'}) == {
+            'type': 'css', 'query': 'a', 'text': False, 'attr': 'href',
+            'descendants': False
+        }
+        assert parse_selector('h1 *::text')['descendants']
+        assert parse_selector('::text')['query'] == '*'
+        assert parse_selector('::text')['descendants']
+        assert parse_selector('ul > *::text')['query'] == 'ul > *'
+        assert not parse_selector('ul > *::text')['descendants']
+        assert parse_selector('ul >::text')['query'] == 'ul > *'
+        assert parse_selector({'xpath': '//a/@href'}) == {
+            'type': 'xpath', 'query': '//a/@href'
+        }
+        with self.assertRaises(ValueError):
+            parse_selector({'css': 'a', 'xpath': '//a'})
+
+    def test_extraction_script(self):
+        script = extraction_script({'title': 'h1::text'})
+        assert '{"title": {"type": "css", "query": "h1"' in script
+
+
+    def test_extract_from_response(self):
+        response = HtmlResponse(
+            'https://example.com/', encoding='utf-8',
+            body=b'<h1>Title</h1><a href="/a">A</a><a href="/b">B</a>'
+        )
+        assert extract_from_response(response, {
+            'title': 'h1::text',
+            'links': {'css': 'a::attr(href)'},
+            'texts': {'xpath': '//a/text()'},
+            'heading': 'h1',
+            'missing': 'p',
+        }) == {
+            'title': ['Title'],
+            'links': ['/a', '/b'],
+            'texts': ['A', 'B'],
+            'heading': ['<h1>Title</h1>'],
+            'missing': [],
+        }
+
+
+# Runs the extraction script with Node.js, in a stand-in for the browser DOM
+# built from the tree parsed by parsel, with the nodes matched by each CSS and
+# XPath query precomputed with lxml.
+_NODE_SCRIPT = """
+var data = JSON.parse(require('fs').readFileSync(0, 'utf-8'));
+globalThis.Node = {ELEMENT_NODE: 1, ATTRIBUTE_NODE: 2, TEXT_NODE: 3,
+                   COMMENT_NODE: 8, DOCUMENT_NODE: 9,
+                   DOCUMENT_POSITION_PRECEDING: 2,
+                   DOCUMENT_POSITION_FOLLOWING: 4};
+globalThis.XPathResult = {ANY_TYPE: 0, NUMBER_TYPE: 1, STRING_TYPE: 2,
+                          BOOLEAN_TYPE: 3, UNORDERED_NODE_ITERATOR_TYPE: 4};
+var nodes = data.nodes.map(function (spec, index) {
+    return {
+        index: index, nodeType: spec.type, nodeValue: spec.value,
+        outerHTML: spec.html, parentNode: null, childNodes: [],
+        hasAttribute: function (name) { return name in spec.attrs; },
+        getAttribute: function (name) { return spec.attrs[name]; },
+        contains: function (node) {
+            for (; node; node = node.parentNode) {
+                if (node === this) { return true; }
+            }
+            return false;
+        },
+        compareDocumentPosition: function (node) {
+            return node.index > this.index ? 4 : 2;
+        },
+        querySelectorAll: function (query) {
+            var self = this;
+            return nodes.filter(function (node) {
+                return node.nodeType === 1 && node !== self &&
+                    self.contains(node);
+            });
+        },
+    };
+});
+data.nodes.forEach(function (spec, index) {
+    spec.children.forEach(function (child) {
+        nodes[index].childNodes.push(nodes[child]);
+        nodes[child].parentNode = nodes[index];
+    });
+});
+globalThis.document = nodes[0];
+document.documentElement = nodes[0].childNodes[0];
+document.querySelectorAll = function (query) {
+    return data.css[query].map(function (index) { return nodes[index]; });
+};
+document.evaluate = function (query) {
+    var result = data.xpath[query];
+    var selected = (result.nodes || []).map(function (node) {
+        if (typeof node === 'number') {
+            return nodes[node];
+        }
+        return {nodeType: node.type, nodeValue: node.value};
+    });
+    return {
+        resultType: result.type,
+        numberValue: Number(result.value),
+        stringValue: result.value,
+        booleanValue: result.value,
+        iterateNext: function () { return selected.shift() || null; },
+    };
+};
+process.stdout.write(eval(data.script));
+"""
+
+
+def _run_extraction_script(response, selectors):
+    root = response.selector.root
+    nodes = [{'type': 9, 'value': None, 'children': []}]
+    indexes = {}
+
+    def add(node_type, value, parent):
+        nodes.append({'type': node_type, 'value': value, 'children': [],
+                      'attrs': {}, 'html': None})
+        nodes[parent]['children'].append(len(nodes) - 1)
+        return len(nodes) - 1
+
+    def add_element(element, parent):
+        if element.tag is etree.Comment:
+            index = indexes[element] = add(8, element.text, parent)
+        else:
+            index = indexes[element] = add(1, None, parent)
+            nodes[index]['attrs'] = dict(element.attrib)
+            nodes[index]['html'] = etree.tostring(
+                element, method='html', encoding='unicode', with_tail=False
+            )
+            if element.text:
+                indexes[element, 'text'] = add(3, element.text, index)
+            for child in element:
+                add_element(child, index)
+        if element.tail:
+            indexes[element, 'tail'] = add(3, element.tail, parent)
+
+    def selected(value):
+        if getattr(value, 'is_attribute', False):
+            return {'type': 2, 'value': str(value)}
+        if getattr(value, 'is_text', False):
+            return indexes[value.getparent(), 'text']
+        if getattr(value, 'is_tail', False):
+            return indexes[value.getparent(), 'tail']
+        return indexes[value]
+
+    add_element(root, 0)
+    css, xpath = {}, {}
+    for selector in map(parse_selector, selectors.values()):
+        query = selector['query']
+        if selector['type'] == 'css':
+            css[query] = [indexes[element] for element in root.xpath(
+                HTMLTranslator().css_to_xpath(query)
+            )]
+            continue
+        result = root.xpath(query)
+        if isinstance(result, list):
+            xpath[query] = {'type': 4, 'nodes': list(map(selected, result))}
+        elif isinstance(result, bool):
+            xpath[query] = {'type': 3, 'value': result}
+        elif isinstance(result, float):
+            value = {'nan': 'NaN', 'inf': 'Infinity',
+                     '-inf': '-Infinity'}.get(repr(result), repr(result))
+            xpath[query] = {'type': 1, 'value': value}
+        else:
+            xpath[query] = {'type': 2, 'value': str(result)}
+    data = {'nodes': nodes, 'css': css, 'xpath': xpath,
+            'script': extraction_script(selectors)}
+    output = subprocess.run(
+        [shutil.which('node'), '-e', _NODE_SCRIPT], check=True,
+        input=json.dumps(data), stdout=subprocess.PIPE, text=True
+    ).stdout
+    return load_extracted(output)
+
+
+class ExtractionScriptTest(unittest.TestCase):
+    if shutil.which('node') is None:
+        skip = "Node.js is not installed"
+
+    def test_same_as_fallback(self):
+        response = HtmlResponse(
+            'https://example.com/', encoding='utf-8',
+            body=b'<html><head><title>Title</title></head><body>'
+                 b'<div class="a">A<div class="b">B<p class="c">P</p>C</div>D'
+                 b'<!-- comment --></div>'
+                 b'<ul><li class="d">1</li><li>2</li></ul>'
+                 b'</body></html>'
+        )
+        selectors = {
+            'elements': 'div',
+            'text': 'div::text',
+            'descendant_text': 'div ::text',
+            'universal_text': 'div *::text',
+            'all_text': '::text',
+            'child_text': 'ul > *::text',
+            'sibling_text': 'li + ::text',
+            'attr': 'div::attr(class)',
+            'descendant_attr': 'div ::attr(class)',
+            'count': {'xpath': 'count(//li)'},
+            'fraction': {'xpath': 'count(//li) div 8'},
+            'small': {'xpath': 'count(//li) div 100000'},
+            'large': {'xpath': 'count(//li) * 10000000000000000'},
+            'negative_zero': {'xpath': '-0'},
+            'infinity': {'xpath': '-1 div 0'},
+            'nan': {'xpath': 'number("a")'},
+            'string': {'xpath': 'string(//title)'},
+            'boolean': {'xpath': 'boolean(//li)'},
+            'nodes': {'xpath': '//div/text() | //li/@class | //comment()'},
+        }
+        extracted = _run_extraction_script(response, selectors)
+        assert extracted == extract_from_response(response, selectors)
+        assert extracted['descendant_text'] == ['A', 'B', 'P', 'C', 'D']
+        assert extracted['text'] == ['A', 'B', 'C', 'D']
+        assert extracted['count'] == ['2.0']
+        assert extracted['small'] == ['2e-05']
+        assert extracted['large'] == ['2e+16']
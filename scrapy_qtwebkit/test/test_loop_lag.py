@@ -0,0 +1,18 @@
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+from scrapy_qtwebkit.browser_engine.utils.loop_lag import LoopLagMonitor
+
+
+class LoopLagMonitorTest(unittest.TestCase):
+    def test_stop(self):
+        clock = Clock()
+        monitor = LoopLagMonitor(clock, interval=1)
+        monitor.start()
+        clock.advance(1.5)
+        assert monitor.pop_max_lag() == 0.5
+
+        monitor.stop()
+        assert not monitor.running
+        assert not clock.getDelayedCalls()
+        monitor.stop()
@@ -0,0 +1,189 @@
+import os
+from unittest.mock import Mock, patch
+
+from twisted.internet.defer import inlineCallbacks, succeed
+from twisted.internet.error import ConnectionLost
+from twisted.internet.task import Clock
+from twisted.python.failure import Failure
+from twisted.trial import unittest
+
+from scrapy_qtwebkit._bodies import CompressedBody, SharedMemoryBody
+from scrapy_qtwebkit._intermediaries import ResponseFromScrapy
+from scrapy_qtwebkit.cookies import RemoteCookieJar
+
+try:
+    from PyQt5.QtCore import QUrl
+    from PyQt5.QtNetwork import (QNetworkAccessManager, QNetworkCookieJar,
+                                 QNetworkReply, QNetworkRequest)
+    from PyQt5.QtWidgets import QApplication
+    from scrapy_qtwebkit.browser_engine.qt import Browser
+    from scrapy_qtwebkit.browser_engine.qt.cookiejar import (
+        CookielibQtCookieJar
+    )
+except ImportError:
+    Browser = None
+
+
+def make_browser(**options):
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    if not QApplication.instance():
+        QApplication([])
+    return Browser(Clock(), Mock(), options)
+
+
+class QtBrowserTest(unittest.TestCase):
+    if Browser is None:
+        skip = "PyQt5 with QtWebKit is not installed"
+
+    def setUp(self):
+        self.browser = make_browser()
+        self.webpage = Mock()
+        self.webpage.remote_get_url.return_value = 'https://example.com/'
+        self.webpage.remote_get_body.return_value = ('utf-8', b'<p>Page</p>')
+        self._patcher = patch.object(self.browser, 'remote_create_webpage',
+                                     return_value=self.webpage)
+        self._patcher.start()
+
+    def tearDown(self):
+        self._patcher.stop()
+
+    @inlineCallbacks
+    def test_fetch(self):
+        self.webpage.remote_load_request.return_value = succeed(
+            (True, 200, {}, None, [])
+        )
+        result = yield self.browser.remote_fetch({}, object(), timeout=5)
+        assert result == (True, 200, {}, None, [],
+                          'https://example.com/', 'utf-8', b'<p>Page</p>')
+        self.webpage.remote_close.assert_called_once_with()
+
+    @inlineCallbacks
+    def test_fetch_failed(self):
+        exc = ConnectionError()
+        self.webpage.remote_load_request.return_value = succeed(
+            (False, None, None, exc, [])
+        )
+        result = yield self.browser.remote_fetch({}, object())
+        assert result == (False, None, None, exc, [], None, None, None)
+        assert not self.webpage.remote_get_body.called
+        self.webpage.remote_close.assert_called_once_with()
+
+
+class QtPageReuseTest(unittest.TestCase):
+    if Browser is None:
+        skip = "PyQt5 with QtWebKit is not installed"
+
+    def setUp(self):
+        self.browser = make_browser(page_pool_size=1, page_pool_prewarm=1)
+
+    def test_reuse_resets_bindings(self):
+        cookiejar = RemoteCookieJar()
+        cookiejar.setCopyableState(({}, Mock(), 1, False))
+        webpage = self.browser.remote_create_webpage({
+            'cookiejarkey': 'a',
+            'cookiejar': cookiejar,
+            'user_agent': b'UA',
+            'block': {'resource_types': ['image']},
+        })
+        assert not self.browser._page_pool
+        qwebpage = webpage._qwebpage
+        nam = qwebpage.networkAccessManager()
+        assert nam.cookiejarkey == 'a'
+        assert nam.user_agent == b'UA'
+        assert nam.blocking_rules is not None
+        assert isinstance(nam.cookieJar(), CookielibQtCookieJar)
+
+        # As done by release_webpage() once the page is reset.
+        nam._had_requests = True
+        webpage._qwebpage = None
+        self.browser._page_pool.append(qwebpage)
+
+        reused = self.browser.remote_create_webpage({})
+        assert reused._qwebpage is qwebpage
+        assert nam.cookiejarkey is None
+        assert nam.user_agent is None
+        assert nam.blocking_rules is None
+        assert not nam._had_requests
+        assert type(nam.cookieJar()) is QNetworkCookieJar
+
+    def test_failed_reply_discarded(self):
+        webpage = self.browser.remote_create_webpage({})
+        nam = webpage._qwebpage.networkAccessManager()
+        reply = nam._make_reply(QNetworkAccessManager.GetOperation,
+                                QNetworkRequest())
+        assert nam._replies == {reply}
+        reply.errback(Failure(ConnectionLost()))
+        assert not nam._replies
+
+    def test_missing_shared_memory_body(self):
+        webpage = self.browser.remote_create_webpage({})
+        nam = webpage._qwebpage.networkAccessManager()
+        reply = nam._make_reply(QNetworkAccessManager.GetOperation,
+                                QNetworkRequest())
+        # Removed by the sender, e.g. after its lease expired.
+        body = SharedMemoryBody.from_bytes(b'x' * 16)
+        body.discard()
+        reply.callback(ResponseFromScrapy('https://example.com/', 200, {},
+                                          body))
+        assert reply.error() == QNetworkReply.UnknownNetworkError
+        assert not nam._replies
+
+    def test_invalid_compressed_body(self):
+        webpage = self.browser.remote_create_webpage({})
+        nam = webpage._qwebpage.networkAccessManager()
+        reply = nam._make_reply(QNetworkAccessManager.GetOperation,
+                                QNetworkRequest())
+        finished = Mock()
+        reply.finished.connect(finished)
+        reply.callback(ResponseFromScrapy('https://example.com/', 200, {},
+                                          CompressedBody(b'not zlib', 100)))
+        assert reply.error() == QNetworkReply.UnknownNetworkError
+        assert not finished.called
+        assert not nam._replies
+
+
+class QtDocumentRequestTest(unittest.TestCase):
+    if Browser is None:
+        skip = "PyQt5 with QtWebKit is not installed"
+
+    def setUp(self):
+        self.browser = make_browser()
+        webpage = self.browser.remote_create_webpage({
+            'block': {'third_party': True},
+            'follow_redirects': True,
+        })
+        self.nam = webpage._qwebpage.networkAccessManager()
+        self.nam.remote_downloader = Mock()
+
+    def request(self, url):
+        reply = self.nam.createRequest(QNetworkAccessManager.GetOperation,
+                                       QNetworkRequest(QUrl(url)))
+        call_remote = self.nam.remote_downloader.callRemote
+        if not call_remote.called:
+            # Blocked.
+            return reply, None
+        name, remote_req = call_remote.call_args[0]
+        call_remote.reset_mock()
+        return reply, remote_req
+
+    def test_main_document_redirect(self):
+        reply, remote_req = self.request('https://a.com/')
+        assert reply.document_type == 'main'
+        assert remote_req.is_first_request
+        assert not remote_req.follow_redirects
+        reply.callback(ResponseFromScrapy('https://a.com/', 302, {
+            b'Location': [b'https://www.b.com/page'],
+        }, b''))
+
+        # The redirect target is the main document, of another site.
+        reply, remote_req = self.request('https://www.b.com/page')
+        assert reply.document_type == 'main'
+        assert remote_req.is_first_request
+        assert self.nam._page_url == 'https://www.b.com/page'
+
+        reply, remote_req = self.request('https://cdn.b.com/app.js')
+        assert reply.document_type is None
+        assert not remote_req.is_first_request
+        assert remote_req.follow_redirects
+        reply, remote_req = self.request('https://a.com/app.js')
+        assert remote_req is None
@@ -0,0 +1,90 @@
+from twisted.trial import unittest
+
+from scrapy_qtwebkit._bodies import (CompressedBody, SharedMemoryBody,
+                                     StreamedBody)
+from scrapy_qtwebkit._intermediaries import (RequestFromBrowser,
+                                             RequestFromScrapy,
+                                             ResponseFromScrapy)
+from scrapy_qtwebkit._wire import (BATCHED_COOKIES_VERSION,
+                                   FOLLOW_REDIRECTS_VERSION, WIRE_VERSIONS,
+                                   broker_version, decode_message,
+                                   encode_message, message_version,
+                                   negotiate_version, set_broker_version)
+
+
+class WireTest(unittest.TestCase):
+    def test_negotiate_version(self):
+        assert negotiate_version(WIRE_VERSIONS) == max(WIRE_VERSIONS)
+        assert negotiate_version([0]) == 0
+        assert negotiate_version([]) == 0
+
+    def test_broker_version(self):
+        class Broker(object):
+            pass
+
+        broker = Broker()
+        # Connections without negotiation are with older browser engines.
+        assert broker_version(broker) == 0
+        set_broker_version(broker, BATCHED_COOKIES_VERSION)
+        assert broker_version(broker) == BATCHED_COOKIES_VERSION
+        assert broker_version(Broker()) == 0
+
+    def test_round_trip(self):
+        messages = [
+            RequestFromScrapy('https://example.com/é', 'POST',
+                              {b'Content-Type': [b'text/plain']}, b'body'),
+            RequestFromBrowser('https://example.com/', 'GET',
+                               {b'Accept': b'*/*'}, None, True, 3),
+            ResponseFromScrapy('https://example.com/', 404,
+                               {b'Set-Cookie': [b'a=1', b'b=2']}, b''),
+        ]
+        for message in messages:
+            data = encode_message(message, 1)
+            assert isinstance(data, bytes)
+            decoded = decode_message(data)
+            assert type(decoded) is type(message)
+            for attr, value in vars(message).items():
+                if attr == 'headers':
+                    value = {k: v if isinstance(v, list) else [v]
+                             for k, v in value.items()}
+                assert getattr(decoded, attr) == value
+
+    def test_shared_memory_body(self):
+        message = ResponseFromScrapy('https://example.com/', 200, {},
+                                     SharedMemoryBody('/dev/shm/x', 10))
+        decoded = decode_message(encode_message(message, 1))
+        assert decoded.body.path == '/dev/shm/x'
+        assert decoded.body.size == 10
+
+    def test_compressed_body(self):
+        message = ResponseFromScrapy('https://example.com/', 200, {},
+                                     CompressedBody(b'compressed', 100))
+        data = encode_message(message, 2)
+        assert message_version(data) == 2
+        decoded = decode_message(data)
+        assert decoded.body.data == b'compressed'
+        assert decoded.body.size == 100
+        assert message_version(message) == 0
+
+    def test_jelly_fallback(self):
+        message = ResponseFromScrapy('https://example.com/', 200, {},
+                                     StreamedBody(b'x' * 10))
+        assert encode_message(message, 1) is message
+        assert decode_message(message) is message
+
+        message = ResponseFromScrapy('https://example.com/', 200, {}, b'')
+        assert encode_message(message, 0) is message
+
+    def test_added_attributes(self):
+        message = RequestFromBrowser('https://example.com/', 'GET', {}, None,
+                                     False, None, follow_redirects=True)
+        assert decode_message(encode_message(message, 3)).follow_redirects
+        assert not decode_message(encode_message(message, 2)).follow_redirects
+
+    def test_encoding_version(self):
+        # Later versions do not change the encoding, so messages for receivers
+        # supporting them are encoded with the last one that did.
+        message = ResponseFromScrapy('https://example.com/', 200, {}, b'')
+        data = encode_message(message, max(WIRE_VERSIONS))
+        assert message_version(data) == FOLLOW_REDIRECTS_VERSION
+        assert type(decode_message(data)) is ResponseFromScrapy
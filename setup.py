@@ -8,5 +8,5 @@ setup(
     author='Artur Gaspar',
     author_email='artur.gaspar.00@gmail.com',
     packages=find_packages(),
-    install_requires=['Twisted>=18']
+    install_requires=['Twisted>=18', 'tldextract>=5.3']
 )